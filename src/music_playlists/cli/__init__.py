@@ -1,17 +1,19 @@
+import datetime
 import pathlib
+import typing
 
 import click
 
-from rich.console import Console
-from rich.table import Table
-
-from music_playlists import process
+from music_playlists import manifest
 from music_playlists.__about__ import __version__
-from music_playlists.services import spotify, youtube_music
-from music_playlists.sources import abc_radio, last_fm, radio_4zzz
 
 
-CONFIG_FILE_OPT = {
+# The processing modules and their dependencies are slow to import,
+# so they are imported in the commands that use them.
+# This keeps '--help' and shell completion fast.
+
+
+CONFIG_FILE_OPT: dict[str, typing.Any] = {
     "args": ["--config-file"],
     "kwargs": {
         "envvar": "MUSIC_PLAYLISTS_CONFIG_FILE",
@@ -20,20 +22,80 @@ CONFIG_FILE_OPT = {
     },
 }
 
+CONFIG_FILES_OPT: dict[str, typing.Any] = {
+    "args": ["--config-file"],
+    "kwargs": {
+        "envvar": "MUSIC_PLAYLISTS_CONFIG_FILE",
+        "type": click.Path(),
+        "multiple": True,
+        "default": [pathlib.Path.cwd().joinpath("config.toml")],
+        "help": "A config file, or a directory of config files. Can be repeated.",
+    },
+}
+
+
+class ChartCode(click.Choice[str]):
+    """A chart code, or the code of a composite chart from the config."""
+
+    def __init__(self) -> None:
+        super().__init__(manifest.chart_codes(), case_sensitive=False)
+
+    def convert(
+        self,
+        value: typing.Any,
+        param: click.Parameter | None,
+        ctx: click.Context | None,
+    ) -> typing.Any:
+        if isinstance(value, str) and value.startswith(f"{manifest.COMPOSITE}-"):
+            return value
+        return super().convert(value, param, ctx)
+
+
+EXPIRE_OPT: dict[str, typing.Any] = {
+    "args": ["--expire"],
+    "kwargs": {
+        "default": "1h",
+        "show_default": True,
+        "help": "How long to reuse cached responses, e.g. '30m' or '1d'.",
+    },
+}
+
+
+def _expire_days(value: str) -> float:
+    from music_playlists import utils
+
+    return utils.parse_duration(value).total_seconds() / (60 * 60 * 24)
+
+
+def _config_files(values: typing.Iterable[str]) -> list[pathlib.Path]:
+    result: list[pathlib.Path] = []
+    for value in values:
+        path = pathlib.Path(value)
+        if path.is_dir():
+            result.extend(sorted(path.glob("*.toml")))
+        else:
+            result.append(path)
+    return result
+
 
 @click.group(
     context_settings={"help_option_names": ["-h", "--help"]},
     no_args_is_help=True,
 )
 @click.version_option(version=__version__, prog_name="Music Playlists")
-def music_playlists():
+def music_playlists() -> None:
     """Generates streaming music playlists from various song charts."""
 
 
 @music_playlists.command("list")
 @click.option(*CONFIG_FILE_OPT["args"], **CONFIG_FILE_OPT["kwargs"])
-def list_cmd(config_file):
+def list_cmd(config_file: str) -> None:
     """List all the music playlist sources and services."""
+    from rich.console import Console
+    from rich.table import Table
+
+    from music_playlists import process
+
     p = process.Process(pathlib.Path(config_file))
     rows = p.list_available()
 
@@ -58,32 +120,24 @@ def list_cmd(config_file):
 
 
 @music_playlists.group()
-def sources():
+def sources() -> None:
     """The sources that provide music playlists."""
 
 
 @sources.command()
 @click.argument(
     "code",
-    type=click.Choice(
-        sorted(
-            [
-                f"{m.code}-{k}"
-                for m in [
-                    abc_radio.Manage,
-                    last_fm.Manage,
-                    radio_4zzz.Manage,
-                ]
-                for k in m.available().keys()
-            ]
-        ),
-        case_sensitive=False,
-    ),
+    type=ChartCode(),
 )
 @click.option("--refresh", is_flag=True)
 @click.option(*CONFIG_FILE_OPT["args"], **CONFIG_FILE_OPT["kwargs"])
-def show(config_file, code, refresh):
+def show(config_file: str, code: str, *, refresh: bool) -> None:
     """Show all the tracks from the music playlist with CODE."""
+    from rich.console import Console
+    from rich.table import Table
+
+    from music_playlists import process
+
     p = process.Process(pathlib.Path(config_file), refresh=refresh)
     tl = p.source_show(code)
 
@@ -104,72 +158,265 @@ def show(config_file, code, refresh):
     console.print(table)
 
 
+@sources.command()
+@click.option(
+    "--code",
+    type=ChartCode(),
+)
+@click.option(
+    "--source",
+    type=click.Choice(manifest.source_codes(), case_sensitive=False),
+)
+@click.option("--refresh", is_flag=True, default=True)
+@click.option(
+    "--from",
+    "date_from",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Build the charts as they were on each day from this date.",
+)
+@click.option(
+    "--to",
+    "date_to",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="The last date to build charts for (default today).",
+)
+@click.option(
+    "--step",
+    default="1d",
+    show_default=True,
+    help="The time between each chart, e.g. '1d' or '1w'.",
+)
+@click.option(*CONFIG_FILES_OPT["args"], **CONFIG_FILES_OPT["kwargs"])
+def fetch(
+    config_file: tuple[str, ...],
+    *,
+    code: str | None = None,
+    source: str | None = None,
+    refresh: bool = False,
+    date_from: datetime.datetime | None = None,
+    date_to: datetime.datetime | None = None,
+    step: str = "1d",
+) -> None:
+    """Get the source charts and save them as snapshots for 'services update'.
+
+    Use '--from' to backfill the charts for past days.
+    """
+    from music_playlists import process, utils
+
+    run_cache = process.RunCache()
+    for path in _config_files(config_file):
+        p = process.Process(path, refresh=refresh, run_cache=run_cache)
+        if date_from is None:
+            snapshot_paths = p.sources_fetch(code, source)
+        else:
+            snapshot_paths = p.sources_backfill(
+                date_from.date(),
+                date_to.date() if date_to else p.now().date(),
+                utils.parse_duration(step),
+                code,
+                source,
+            )
+        for snapshot_path in snapshot_paths:
+            click.echo(f"Saved snapshot {snapshot_path}")
+
+
 @music_playlists.group()
-def services():
+def services() -> None:
     """The music services that host streaming music playlists."""
 
 
 @services.command()
 @click.option(
     "--code",
-    type=click.Choice(
-        sorted(
-            [
-                f"{m.code}-{k}"
-                for m in [
-                    abc_radio.Manage,
-                    last_fm.Manage,
-                    radio_4zzz.Manage,
-                ]
-                for k in m.available().keys()
-            ]
-        ),
-        case_sensitive=False,
-    ),
+    type=ChartCode(),
 )
 @click.option(
     "--source",
-    type=click.Choice(
-        sorted(
-            [
-                m.code
-                for m in [
-                    abc_radio.Manage,
-                    last_fm.Manage,
-                    radio_4zzz.Manage,
-                ]
-            ]
-        ),
-        case_sensitive=False,
-    ),
+    type=click.Choice(manifest.source_codes(), case_sensitive=False),
 )
 @click.option(
     "--service",
-    type=click.Choice(
-        sorted(
-            [
-                m.code
-                for m in [
-                    spotify.Manage,
-                    youtube_music.Manage,
-                ]
-            ]
-        ),
-        case_sensitive=False,
-    ),
+    type=click.Choice(manifest.service_codes(), case_sensitive=False),
 )
 @click.option("--refresh", is_flag=True, default=True)
-@click.option(*CONFIG_FILE_OPT["args"], **CONFIG_FILE_OPT["kwargs"])
+@click.option(
+    "--plan",
+    is_flag=True,
+    help="Show the expected requests using cached responses, without updating.",
+)
+@click.option(
+    "--enqueue",
+    is_flag=True,
+    help="Add the updates to the job queue for workers, instead of running them.",
+)
+@click.option(
+    "--deadline",
+    help="The longest time the update can take, e.g. '45m' or '2h'.",
+)
+@click.option(
+    "--from-snapshot",
+    is_flag=True,
+    help="Use the charts saved by 'sources fetch', instead of the sources.",
+)
+@click.option(*CONFIG_FILES_OPT["args"], **CONFIG_FILES_OPT["kwargs"])
 def update(
-    config_file,
+    config_file: tuple[str, ...],
+    *,
     code: str | None = None,
     source: str | None = None,
     service: str | None = None,
     refresh: bool = False,
-):
+    plan: bool = False,
+    enqueue: bool = False,
+    deadline: str | None = None,
+    from_snapshot: bool = False,
+) -> None:
     """Update the songs in the playlists."""
-    p = process.Process(pathlib.Path(config_file), refresh=refresh)
-    p.services_update(code, source, service)
+    from music_playlists import job_queue, process, utils
+
+    config_files = _config_files(config_file)
+
+    if plan:
+        run_cache = process.RunCache()
+        rows = []
+        for path in config_files:
+            p = process.Process(
+                path, refresh=False, run_cache=run_cache, from_snapshot=from_snapshot
+            )
+            rows.extend(p.services_plan(code, source, service))
+        _print_plan(rows)
+        return
+
+    if enqueue:
+        for path in config_files:
+            p = process.Process(path, refresh=False)
+            queue = job_queue.JobQueue(p.base_path / "jobs.sqlite")
+            count = p.services_enqueue(queue, code, source, service)
+            click.echo(f"Added {count} jobs from {path}. Queue: {queue.counts()}")
+        return
+
+    run_deadline = utils.Deadline()
+    if deadline:
+        run_deadline = utils.Deadline(utils.parse_duration(deadline).total_seconds())
+
+    if len(config_files) == 1:
+        p = process.Process(
+            config_files[0], refresh=refresh, from_snapshot=from_snapshot
+        )
+        p.services_update(code, source, service, run_deadline)
+    else:
+        failed = process.run_batch(
+            config_files,
+            code,
+            source,
+            service,
+            run_deadline,
+            refresh=refresh,
+            from_snapshot=from_snapshot,
+        )
+        if failed:
+            msg = f"Could not update playlists for {', '.join(str(i) for i in failed)}."
+            raise click.ClickException(msg)
+
+    for cut in run_deadline.cuts:
+        click.echo(f"Cut to meet the deadline: {cut}")
+
+
+def _print_plan(rows: list[dict[str, typing.Any]]) -> None:
+    from rich.console import Console
+    from rich.table import Table
+
+    table = Table(title="Update Plan")
+    table.add_column("Title", style="magenta")
+    table.add_column("Code", justify="left", style="green")
+    table.add_column("Service", justify="left", style="blue")
+    table.add_column("Tracks", justify="right")
+    table.add_column("Known", justify="right")
+    table.add_column("Searches", justify="right")
+    table.add_column("Writes", justify="right")
+    table.add_column("Requests", justify="right")
+    table.add_column("Est. Time", justify="right")
+
+    for row in rows:
+        table.add_row(
+            row.get("title"),
+            row.get("code"),
+            row.get("service"),
+            str(row.get("tracks")),
+            str(row.get("known")),
+            f"{row.get('searches_min')}-{row.get('searches_max')}",
+            str(row.get("writes")),
+            str(row.get("requests")),
+            f"{row.get('seconds'):.0f}s",
+        )
+
+    total_requests = sum(row["requests"] for row in rows)
+    total_seconds = sum(row["seconds"] for row in rows)
+    console = Console()
+    console.print(table)
+    console.print(
+        f"Total: {total_requests} requests, about {total_seconds:.0f}s. "
+        "Nothing was written to the services."
+    )
+
+
+@music_playlists.command()
+@click.option(
+    "--jitter",
+    type=int,
+    help="The maximum seconds to randomly delay each update (default from config).",
+)
+@click.option(*EXPIRE_OPT["args"], **EXPIRE_OPT["kwargs"])
+@click.option(*CONFIG_FILE_OPT["args"], **CONFIG_FILE_OPT["kwargs"])
+def daemon(config_file: str, jitter: int | None = None, expire: str = "1h") -> None:
+    """Keep running and update each playlist on its schedule."""
+    from music_playlists import process, schedule
+
+    p = process.Process(pathlib.Path(config_file), expire_days=_expire_days(expire))
+    d = schedule.Daemon(p, jitter=p.schedule_jitter if jitter is None else jitter)
+    d.run()
+
+
+@music_playlists.command()
+@click.option("--wait", is_flag=True, help="Keep waiting for new jobs.")
+@click.option(
+    "--lease",
+    type=int,
+    default=600,
+    show_default=True,
+    help="The number of seconds a job is held without a heartbeat.",
+)
+@click.option(*EXPIRE_OPT["args"], **EXPIRE_OPT["kwargs"])
+@click.option(*CONFIG_FILE_OPT["args"], **CONFIG_FILE_OPT["kwargs"])
+def worker(config_file: str, *, wait: bool, lease: int, expire: str = "1h") -> None:
+    """Run playlist update jobs from the job queue."""
+    from music_playlists import job_queue, process
+
+    p = process.Process(pathlib.Path(config_file), expire_days=_expire_days(expire))
+    queue = job_queue.JobQueue(p.base_path / "jobs.sqlite")
+    job_queue.Worker(p, queue, lease=lease).run(wait=wait)
+
+
+@music_playlists.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8000, show_default=True)
+@click.option(
+    "--window",
+    type=int,
+    default=300,
+    show_default=True,
+    help="The number of seconds to reuse each response.",
+)
+@click.option(*EXPIRE_OPT["args"], **EXPIRE_OPT["kwargs"])
+@click.option(*CONFIG_FILE_OPT["args"], **CONFIG_FILE_OPT["kwargs"])
+def serve(
+    config_file: str, host: str, port: int, window: int, expire: str = "1h"
+) -> None:
+    """Serve the charts and service matches as json."""
+    from music_playlists import process, server
+
+    p = process.Process(pathlib.Path(config_file), expire_days=_expire_days(expire))
+    server.serve(p, host, port, window)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,13 @@
+import array
+import collections
+import datetime
 import functools
+import hashlib
+import heapq
+import json
 import logging
+import math
+import operator
 import re
 import unicodedata
 
@@ -19,6 +27,34 @@ class TrackNormalised:
     title: str
     artists: list[str]
 
+    @functools.cached_property
+    def title_key(self) -> str:
+        """The title without spaces, for matching."""
+        result: str = _caches["remove_spaces"](self.title)
+        return result
+
+    @functools.cached_property
+    def artist_keys(self) -> frozenset[str]:
+        """The artists without spaces, for matching."""
+        return frozenset(_caches["remove_spaces"](i) for i in self.artists)
+
+    @functools.cached_property
+    def fingerprint(self) -> int:
+        """A 64-bit hash of the title and artists, to identify the track."""
+        content = "\x1f".join([self.title_key, *sorted(self.artist_keys)])
+        digest = hashlib.blake2b(content.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    @functools.cached_property
+    def title_tokens(self) -> frozenset[str]:
+        """The words in the title, for scoring similar titles."""
+        return frozenset(self.title.split())
+
+    @functools.cached_property
+    def artist_tokens(self) -> frozenset[str]:
+        """The words in all the artists, for scoring similar artists."""
+        return frozenset(w for i in self.artists for w in i.split())
+
     @functools.cached_property
     def queries(self) -> list[str]:
         queries = []
@@ -43,6 +79,12 @@ class Track:
     artists: list[str]
     raw: typing.Any
     normalised: TrackNormalised | None = None
+    duration: int | None = None
+    """The length of the track in seconds, if known."""
+    played_at: datetime.datetime | None = None
+    """When the track was played, for a track that is a play."""
+    station: str | None = None
+    """The station or program that played the track, for a track that is a play."""
 
     def __str__(self):
         c = self.origin_code
@@ -53,6 +95,163 @@ class Track:
     def set_normalised(self, item: TrackNormalised) -> None:
         object.__setattr__(self, "normalised", item)
 
+    @property
+    def fingerprint(self) -> int:
+        """The fingerprint of the normalised title and artists."""
+        if self.normalised is None:
+            msg = f"Track {self} is not normalised."
+            raise ValueError(msg)
+        return self.normalised.fingerprint
+
+
+@beartype
+class PlayLog:
+    """Plays stored as columns, to rank tracks without keeping every play.
+
+    Each play is stored as the index of its distinct title and artists,
+    the time it was played, and the index of the station that played it.
+    Only the first play of each distinct title and artists is kept as a track.
+    The columns keep the plays small to store and quick to merge,
+    and the scores are still added up one play at a time.
+    """
+
+    def __init__(self) -> None:
+        self.tracks: list[Track] = []
+        self.stations: list[str | None] = []
+        self.track_ids: array.array[int] = array.array("L")
+        self.played_at: array.array[float] = array.array("d")
+        """The time of each play as a unix timestamp, or nan if not known."""
+        self.station_ids: array.array[int] = array.array("H")
+        self._track_index: dict[tuple[str, tuple[str, ...]], int] = {}
+        self._station_index: dict[str | None, int] = {}
+
+    @classmethod
+    def from_columns(
+        cls,
+        tracks: list[Track],
+        stations: list[str | None],
+        track_ids: typing.Iterable[int],
+        played_at: typing.Iterable[float],
+        station_ids: typing.Iterable[int],
+    ) -> "PlayLog":
+        """Create a log from the columns of another log."""
+        plays = cls()
+        plays.tracks = tracks
+        plays.stations = stations
+        plays.track_ids.extend(track_ids)
+        plays.played_at.extend(played_at)
+        plays.station_ids.extend(station_ids)
+        if not len(plays.track_ids) == len(plays.played_at) == len(plays.station_ids):
+            msg = "The play log columns must be the same length."
+            raise ValueError(msg)
+        plays._track_index = {
+            (t.title, tuple(t.artists)): i for i, t in enumerate(tracks)
+        }
+        plays._station_index = {s: i for i, s in enumerate(stations)}
+        return plays
+
+    def __len__(self) -> int:
+        return len(self.track_ids)
+
+    def append(self, track: Track) -> None:
+        """Add a play."""
+        key = (track.title, tuple(track.artists))
+        track_id = self._track_index.get(key)
+        if track_id is None:
+            track_id = len(self.tracks)
+            self._track_index[key] = track_id
+            self.tracks.append(track)
+
+        station_id = self._station_index.get(track.station)
+        if station_id is None:
+            station_id = len(self.stations)
+            self._station_index[track.station] = station_id
+            self.stations.append(track.station)
+
+        self.track_ids.append(track_id)
+        self.played_at.append(
+            track.played_at.timestamp() if track.played_at else math.nan
+        )
+        self.station_ids.append(station_id)
+
+    def extend(self, tracks: typing.Iterable[Track]) -> None:
+        """Add many plays."""
+        for track in tracks:
+            self.append(track)
+
+    def merge(self, other: "PlayLog") -> None:
+        """Add the plays from another log, keeping the tracks from this log."""
+        track_map: list[int] = []
+        for track in other.tracks:
+            key = (track.title, tuple(track.artists))
+            track_id = self._track_index.get(key)
+            if track_id is None:
+                track_id = len(self.tracks)
+                self._track_index[key] = track_id
+                self.tracks.append(track)
+            track_map.append(track_id)
+
+        station_map: list[int] = []
+        for station in other.stations:
+            station_id = self._station_index.get(station)
+            if station_id is None:
+                station_id = len(self.stations)
+                self._station_index[station] = station_id
+                self.stations.append(station)
+            station_map.append(station_id)
+
+        self.track_ids.extend(map(track_map.__getitem__, other.track_ids))
+        self.played_at.extend(other.played_at)
+        self.station_ids.extend(map(station_map.__getitem__, other.station_ids))
+
+    def counts(self) -> array.array[int]:
+        """Get the number of plays of each track."""
+        counts = array.array("L", [0]) * len(self.tracks)
+        for track_id, count in collections.Counter(self.track_ids).items():
+            counts[track_id] = count
+        return counts
+
+    def scores(
+        self,
+        half_life: float | None = None,
+        station_weights: dict[str, float] | None = None,
+    ) -> array.array[float]:
+        """Get the weighted number of plays of each track.
+
+        Args:
+            half_life: The seconds before the latest play after which a play
+                counts half as much. A play with no time is not decayed.
+                None to count the plays the same no matter when they were played.
+            station_weights: How much a play counts for each station.
+                A station that is not included counts as 1.
+        """
+        weight_by_station = station_weights or {}
+        weights = [
+            1.0 if i is None else weight_by_station.get(i, 1.0) for i in self.stations
+        ]
+        scores = array.array("d", [0.0]) * len(self.tracks)
+
+        if half_life is None:
+            for track_id, station_id in zip(
+                self.track_ids, self.station_ids, strict=True
+            ):
+                scores[track_id] += weights[station_id]
+            return scores
+
+        if half_life <= 0:
+            msg = f"Half life must be more than 0, not {half_life}."
+            raise ValueError(msg)
+        latest = max((i for i in self.played_at if not math.isnan(i)), default=0.0)
+        rate = math.log(2) / half_life
+        for track_id, played_at, station_id in zip(
+            self.track_ids, self.played_at, self.station_ids, strict=True
+        ):
+            weight = weights[station_id]
+            if not math.isnan(played_at):
+                weight *= math.exp(rate * (played_at - latest))
+            scores[track_id] += weight
+        return scores
+
 
 @beartype
 class TrackListType(Enum):
@@ -99,124 +298,118 @@ class ServiceConfig:
     track_embedded_id: typing.Callable[[Track], Track | None]
     playlist_tracks: typing.Callable[[ServicePlaylistTracks], bool]
     playlist_info: typing.Callable[[ServicePlaylistInfo], bool]
+    search_allowed: typing.Callable[[], bool] | None = None
+
+
+_title_artist_1 = [
+    r"\[",
+    r"\]",
+    r"\{",
+    r"\}",
+    r"\(",
+    r"\)",
+    r"\bft\.\s+",
+    r"\bft\b",
+    r"\bfeat\.\s+",
+    r"\bfeat\b",
+    r"\bfeaturing\b",
+    r"\bw/\s+",
+    r"\bx\b",
+    r"\s+&\s+",
+    r"\s+\+\s+",
+    r"\blive\b\s*\bat\b",
+]
+_title_artist_2 = [
+    r"\bft\.\s+",
+    r"\bft\b",
+    r"\bfeat\.\s+",
+    r"\bfeat\b",
+    r"\bfeaturing\b",
+    r"\bwith\b",
+    r"\bw/\s+",
+    r"\bx\b",
+    r"\s+&\s+",
+    r"\s+\+\s+",
+    r"\band\b",
+    r"\blive\b\s*\bat\b",
+    r"(?:\s+|\b),(?:\s+|\b)",
+]
+_artist_delimiters = [
+    r"\[",
+    r"\]",
+    r"\{",
+    r"\}",
+    r"\(",
+    r"\)",
+    r"\bft\.\s+",
+    r"\bft\b",
+    r"\bfeat\.\s+",
+    r"\bfeat\b",
+    r"\bfeaturing\b",
+    r"\bwith\b",
+    r"\bw/\s+",
+    r"\bx\b",
+    r"\s+&\s+",
+    r"\s+\+\s+",
+    r"\band\b",
+    r"\blive\b\s*\bat\b",
+    r"(?:\s+|\b),(?:\s+|\b)",
+]
+_title_suffix_remove = [" single version", " (single version)", " radio edit"]
+_punctuation_remove = ["'", "’", "?", "#", "*", "!"]
+_punctuation_replace = ["/", "-", "."]
+_punctuation_remove_table = str.maketrans("", "", "".join(_punctuation_remove))
+_re_punctuation_any = re.compile(
+    f"[{re.escape(''.join(_punctuation_remove + _punctuation_replace))}]"
+)
+
+_re_whitespaces = re.compile(r"\s+")
+_spellings: list[dict[str, typing.Any]] = [
+    {"check": "cryin", "re": re.compile(r"\bcryin\b"), "repl": "crying"},
+    {"check": "%", "re": re.compile(r"%"), "repl": " percent "},
+]
+
+
+def _build_re_list(
+    values: list[str], *, escape: bool = True, allow_multiple: bool = True
+) -> re.Pattern[str]:
+    items = [
+        f"{re.escape(i) if escape else i}{'+' if allow_multiple else ''}"
+        for i in values
+    ]
+    joined = "|".join(items)
+    return re.compile(rf"(?:{joined})")
 
 
-@beartype
-class Manage:
-    _title_artist_1 = [
-        r"\[",
-        r"\]",
-        r"\{",
-        r"\}",
-        r"\(",
-        r"\)",
-        r"\bft\.\s+",
-        r"\bft\b",
-        r"\bfeat\.\s+",
-        r"\bfeat\b",
-        r"\bfeaturing\b",
-        r"\bw/\s+",
-        r"\bx\b",
-        r"\s+&\s+",
-        r"\s+\+\s+",
-        r"\blive\b\s*\bat\b",
-    ]
-    _title_artist_2 = [
-        r"\bft\.\s+",
-        r"\bft\b",
-        r"\bfeat\.\s+",
-        r"\bfeat\b",
-        r"\bfeaturing\b",
-        r"\bwith\b",
-        r"\bw/\s+",
-        r"\bx\b",
-        r"\s+&\s+",
-        r"\s+\+\s+",
-        r"\band\b",
-        r"\blive\b\s*\bat\b",
-        r"(?:\s+|\b),(?:\s+|\b)",
-    ]
-    _artist_delimiters = [
-        r"\[",
-        r"\]",
-        r"\{",
-        r"\}",
-        r"\(",
-        r"\)",
-        r"\bft\.\s+",
-        r"\bft\b",
-        r"\bfeat\.\s+",
-        r"\bfeat\b",
-        r"\bfeaturing\b",
-        r"\bwith\b",
-        r"\bw/\s+",
-        r"\bx\b",
-        r"\s+&\s+",
-        r"\s+\+\s+",
-        r"\band\b",
-        r"\blive\b\s*\bat\b",
-        r"(?:\s+|\b),(?:\s+|\b)",
-    ]
-    _title_suffix_remove = [" single version", " (single version)", " radio edit"]
-    _punctuation_remove = ["'", "’", "?", "#", "*", "!"]
-    _punctuation_replace = ["/", "-", "."]
+@functools.cache
+def _re_punctuation_replace() -> re.Pattern[str]:
+    return _build_re_list(_punctuation_replace)
 
-    _re_whitespaces = re.compile(r"\s+")
-    _re_slug1 = re.compile(r"[^-\w\s_]")
-    _re_slug2 = re.compile(r"[-_\s]+")
-    _spellings = [
-        {"check": "cryin", "re": re.compile(r"\bcryin\b"), "repl": "crying"},
-        {"check": "%", "re": re.compile(r"%"), "repl": " percent "},
-    ]
-    _re_built = {}
 
-    @classmethod
-    def _re_punctuation_replace(cls):
-        return cls._re_builder("_re_punctuation_replace", (cls._punctuation_replace,))
+@functools.cache
+def _re_title_artist_1() -> re.Pattern[str]:
+    return _build_re_list(_title_artist_1, escape=False, allow_multiple=False)
 
-    @classmethod
-    def _re_title_artist_1(cls):
-        return cls._re_builder(
-            "_re_title_artist_1", (cls._title_artist_1, False, False)
-        )
 
-    @classmethod
-    def _re_title_artist_2(cls):
-        return cls._re_builder(
-            "_re_title_artist_2", (cls._title_artist_2, False, False)
-        )
+@functools.cache
+def _re_title_artist_2() -> re.Pattern[str]:
+    return _build_re_list(_title_artist_2, escape=False, allow_multiple=False)
 
-    @classmethod
-    def _re_punctuation_remove(cls):
-        return cls._re_builder("_re_punctuation_remove", (cls._punctuation_remove,))
 
-    @classmethod
-    def _re_split_artists(cls):
-        return cls._re_builder(
-            "_re_split_artists",
-            (cls._artist_delimiters, False, False),
-        )
+@functools.cache
+def _re_punctuation_remove() -> re.Pattern[str]:
+    return _build_re_list(_punctuation_remove)
 
-    @classmethod
-    def _build_re_list(
-        cls, values: list[str], escape: bool = True, allow_multiple: bool = True
-    ):
-        items = [
-            f"{re.escape(i) if escape else i}{'+' if allow_multiple else ''}"
-            for i in values
-        ]
-        joined = "|".join(items)
-        return re.compile(rf"(?:{joined})")
 
-    @classmethod
-    def _re_builder(cls, key, value):
-        found = cls._re_built.get(key)
-        if found is None:
-            cls._re_built[key] = cls._build_re_list(*value)
-            found = cls._re_built.get(key)
-        else:
-            pass
-        return found
+@functools.cache
+def _re_split_artists() -> re.Pattern[str]:
+    return _build_re_list(_artist_delimiters, escape=False, allow_multiple=False)
+
+
+@beartype
+class Manage:
+    _re_slug1 = re.compile(r"[^-\w\s_]")
+    _re_slug2 = re.compile(r"[-_\s]+")
 
     def queries(self, track: Track):
         """Build a query for a service from a normalise track."""
@@ -224,30 +417,186 @@ class Manage:
         result = track.normalised.queries
         return result
 
-    def most_played(self, track_list: TrackList) -> TrackList:
-        """Convert a list of tracks into an ordered list from the most to least played."""
-        groups = {}
-        for track in track_list.tracks:
-            key = "-".join([i for i in track.artists + [track.title] if i])
-            if key not in groups:
-                groups[key] = []
-            groups[key].append(track)
-
-        raw = sorted(
-            [(k, len(v), v) for k, v in groups.items() if len(v) > 1],
-            key=lambda x: x[1],
-            reverse=True,
+    _match_weight_title = 0.6
+    _match_weight_artists = 0.3
+    _match_weight_duration = 0.1
+    _match_rank_penalty = 0.05
+    """The most the score is lowered for a track that is not the first result."""
+    _match_duration_same = 3
+    """The difference in seconds for durations to be treated as the same."""
+    _match_duration_different = 30
+    """The extra difference in seconds for durations to be treated as different."""
+
+    def __init__(self, *, trace: bool = False):
+        """Create a manager for track lists.
+
+        Args:
+            trace: Log the result of each normalisation step for every track.
+        """
+        self._trace = trace
+
+    def most_played(
+        self,
+        track_list: TrackList,
+        limit: int | None = 100,
+        half_life: float | None = None,
+        station_weights: dict[str, float] | None = None,
+    ) -> TrackList:
+        """Convert a list of tracks into an ordered list from the most to least played.
+
+        Plays of the same normalised track are counted together,
+        and the first play is kept to represent the track.
+        Tracks played only once are left out.
+        Tracks with the same score are in the order they were first played.
+
+        Args:
+            track_list: The plays.
+            limit: The most tracks to keep. The default is the most tracks
+                that can be set in a Spotify playlist in one request.
+                None to keep every track.
+            half_life: Rank recent plays higher, see PlayLog.scores.
+            station_weights: Rank plays by some stations higher,
+                see PlayLog.scores.
+        """
+        plays = PlayLog()
+        plays.extend(track_list.tracks)
+        return self.rank_plays(
+            plays, track_list.title, limit, half_life, station_weights
+        )
+
+    def rank_plays(
+        self,
+        plays: PlayLog,
+        title: str | None,
+        limit: int | None = 100,
+        half_life: float | None = None,
+        station_weights: dict[str, float] | None = None,
+    ) -> TrackList:
+        """Convert a log of plays into an ordered list from the most to least played.
+
+        See most_played.
+        """
+        counts = plays.counts()
+        scores = plays.scores(half_life, station_weights)
+
+        # combine the plays of the same normalised track
+        self.normalise_tracklist(
+            TrackList(type=TrackListType.ALL_PLAYS, title=title, tracks=plays.tracks)
+        )
+        # the tracks are in the order they were first played
+        totals: dict[int, list[typing.Any]] = {}
+        for index, track in enumerate(plays.tracks):
+            fingerprint = track.fingerprint
+            if fingerprint in totals:
+                totals[fingerprint][0] += counts[index]
+                totals[fingerprint][1] += scores[index]
+            else:
+                totals[fingerprint] = [counts[index], scores[index], -index, track]
+
+        items = (i for i in totals.values() if i[0] > 1)
+        sort_key = operator.itemgetter(1, 2)
+        if limit is None:
+            top = sorted(items, key=sort_key, reverse=True)
+        else:
+            top = heapq.nlargest(limit, items, key=sort_key)
+        return TrackList(
+            title=title,
+            type=TrackListType.ORDERED,
+            tracks=[i[3] for i in top],
         )
+
+    def merge_charts(
+        self,
+        track_lists: list[TrackList],
+        title: str | None,
+        method: str = "rrf",
+        limit: int | None = 100,
+        rrf_k: int = 60,
+    ) -> TrackList:
+        """Combine ordered charts into one ordered chart.
+
+        Each chart scores its tracks by rank, using reciprocal rank fusion ('rrf')
+        or Borda count ('borda'), and the scores of the same normalised track
+        are added together.
+        The best ranked play of each track, in the first chart with that rank,
+        is kept to represent the track.
+        Tracks with the same total score are in the order of their best rank,
+        then the order of the charts.
+
+        Args:
+            track_lists: The ordered charts.
+            title: The title of the combined chart.
+            method: How to score a rank.
+            limit: The most tracks to keep. None to keep every track.
+            rrf_k: Reduces the difference between the scores of the top ranks
+                for reciprocal rank fusion.
+        """
+        for track_list in track_lists:
+            self.normalise_tracklist(track_list)
+        score = self._rank_score(track_lists, method, rrf_k)
+
+        # total score, best score, first chart with the best score, track
+        totals: dict[int, list[typing.Any]] = {}
+        for index, track_list in enumerate(track_lists):
+            # a track repeated in the same chart only counts at its best rank
+            seen: set[int] = set()
+            for track in track_list.tracks:
+                fingerprint = track.fingerprint
+                if fingerprint in seen:
+                    continue
+                rank_score = score(len(seen))
+                seen.add(fingerprint)
+                item = totals.get(fingerprint)
+                if item is None:
+                    totals[fingerprint] = [rank_score, rank_score, -index, track]
+                    continue
+                item[0] += rank_score
+                if rank_score > item[1]:
+                    item[1:] = [rank_score, -index, track]
+
+        sort_key = operator.itemgetter(0, 1, 2)
+        if limit is None:
+            top = sorted(totals.values(), key=sort_key, reverse=True)
+        else:
+            top = heapq.nlargest(limit, totals.values(), key=sort_key)
         return TrackList(
-            title=track_list.title,
+            title=title,
             type=TrackListType.ORDERED,
-            tracks=[ts[0] for k, c, ts in raw],
+            tracks=[i[3] for i in top],
         )
 
+    @staticmethod
+    def _rank_score(
+        track_lists: list[TrackList], method: str, rrf_k: int
+    ) -> typing.Callable[[int], float]:
+        """Get the function that scores a rank for a chart merge method."""
+        if method == "rrf":
+            return lambda rank: 1 / (rrf_k + rank + 1)
+        if method == "borda":
+            size = max((len(i.tracks) for i in track_lists), default=0)
+            return lambda rank: float(size - rank)
+        msg = f"Unknown chart merge method '{method}'."
+        raise ValueError(msg)
+
+    def fingerprint(self, track_list: TrackList) -> str:
+        """Get a hash of the title and the track fingerprints in order."""
+        self.normalise_tracklist(track_list)
+        items = [track.fingerprint for track in track_list.tracks]
+        content = json.dumps([track_list.title, items], separators=(",", ":"))
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
     def normalise_tracklist(self, item: TrackList) -> None:
         """Normalise each track in a list."""
-        for track in item.tracks:
-            self.normalise_track(track)
+        pending = [t for t in item.tracks if t is not None and t.normalised is None]
+        if self._trace:
+            for track in pending:
+                self.normalise_track(track)
+            return
+        results = self.normalise_many(
+            [t.title for t in pending], [t.artists for t in pending]
+        )
+        for track, normalised in zip(pending, results, strict=True):
+            track.set_normalised(normalised)
 
     def normalise_track(self, item: Track) -> None:
         """Normalise a track."""
@@ -259,12 +608,112 @@ class Manage:
         item.set_normalised(normalised)
 
     def normalise_info(
+        self,
+        title: str | None,
+        artists: list[str] | None,
+        *,
+        trace: bool | None = None,
+    ) -> TrackNormalised:
+        """Normalise a title and artists.
+
+        Set 'trace' to log the steps for this call,
+        otherwise the steps are logged if tracing is on for the Manage instance.
+        """
+        if trace or (trace is None and self._trace):
+            steps = self.normalise_trace(title, artists)
+            for step in steps[1:]:
+                if step["before"] != step["after"]:
+                    logger.info(
+                        "Normalise %s: %s -> %s",
+                        step["name"],
+                        step["before"],
+                        step["after"],
+                    )
+            result = steps[-1]["after"]
+            return TrackNormalised(title=result["title"], artists=result["artists"])
+        return self._normalise_info_compiled(title, artists)
+
+    def normalise_trace(
+        self, title: str | None, artists: list[str] | None
+    ) -> list[dict[str, typing.Any]]:
+        """Normalise a title and artists one step at a time and record each step.
+
+        Each step has a name, and the title and artists before and after the step.
+        The first step is the input. This helps find out why tracks do not match.
+        """
+        steps = [
+            {
+                "name": "input",
+                "before": None,
+                "after": {"title": title, "artists": artists},
+            }
+        ]
+        self._normalise_info_staged(title, artists, steps)
+        return steps
+
+    def normalise_many(
+        self,
+        titles: typing.Sequence[str | None],
+        artists: typing.Sequence[list[str] | None],
+    ) -> list[TrackNormalised]:
+        """Normalise many titles and artists at once.
+
+        Each step runs over all the distinct values before the next step.
+        Identical inputs are normalised once and share the result.
+        The results are the same as normalise_info for each item.
+        """
+        if len(titles) != len(artists):
+            msg = f"Got {len(titles)} titles and {len(artists)} artist lists."
+            raise ValueError(msg)
+        keys = [
+            (str(t if t is not None else ""), tuple(str(i) for i in a or []))
+            for t, a in zip(titles, artists, strict=True)
+        ]
+        unique = list(dict.fromkeys(keys))
+        normalised = _normalise_unique(unique)
+
+        results = {
+            key: TrackNormalised(title=title, artists=names)
+            for key, (title, names) in zip(unique, normalised, strict=True)
+        }
+        return [results[key] for key in keys]
+
+    def _normalise_info_compiled(
         self, title: str | None, artists: list[str] | None
     ) -> TrackNormalised:
-        """Normalise a title and artists."""
+        """Normalise a title and artists in as few passes as possible.
+
+        The result is the same as the staged normalisation.
+        """
+        spaces = _re_whitespaces
+        title_norm = str(title if title is not None else "")
+        title_norm = spaces.sub(" ", title_norm).strip().casefold()
+        title_norm, title_artists = _caches["split_title_artist"](title_norm)
+
+        values = [title_norm]
+        split_artist = _caches["split_artist"]
+        for artist in artists if artists is not None else []:
+            values.extend(split_artist(spaces.sub(" ", str(artist)).strip().casefold()))
+        values.extend(title_artists)
+
+        clean = _caches["clean"]
+        return TrackNormalised(
+            title=clean(values[0], is_title=True),
+            artists=[clean(i, is_title=False) for i in values[1:]],
+        )
+
+    def _normalise_info_staged(
+        self,
+        title: str | None,
+        artists: list[str] | None,
+        steps: list[dict[str, typing.Any]] | None = None,
+    ) -> TrackNormalised:
+        """Normalise a title and artists one step at a time.
+
+        The steps are added to 'steps' if it is a list.
+        """
         title_norm = str(title if title is not None else "")
         artists_norm = [str(i) for i in (artists if artists is not None else [])]
-        steps = []
 
         title_norm, artists_norm = self._normalise_step(
             steps,
@@ -324,149 +773,368 @@ class Manage:
 
     def _normalise_step(
         self,
-        steps: list[dict[str, typing.Any]],
+        steps: list[dict[str, typing.Any]] | None,
         name: str,
         title: str,
         artists: list[str],
     ) -> tuple[str, list[str]]:
-        step = {"name": name, "title": title, "artists": artists}
-        steps.append(step)
-
-        if len(steps) > 1 and name != "case":
-            cur = (step["title"], step["artists"])
-            prev = (steps[-2]["title"], steps[-2]["artists"])
-            if step["title"] != steps[-2]["title"]:
-                pass
-            if step["artists"] != steps[-2]["artists"]:
-                pass
-
-        return step["title"], step["artists"]
+        if steps is not None:
+            steps.append(
+                {
+                    "name": name,
+                    "before": steps[-1]["after"] if steps else None,
+                    "after": {"title": title, "artists": artists},
+                }
+            )
+        return title, artists
 
-    @functools.cache
     def _normalise_collapse_spaces(self, value: str) -> str:
-        return self._re_whitespaces.sub(" ", value).strip()
+        result: str = _caches["collapse_spaces"](value)
+        return result
 
-    @functools.cache
     def _normalise_remove_spaces(self, value: str) -> str:
-        return self._re_whitespaces.sub("", value)
+        result: str = _caches["remove_spaces"](value)
+        return result
 
-    @functools.cache
     def _normalise_split_title_artist(self, value: str) -> tuple[str, list[str]]:
         """Split the title to extract artist names."""
-        # two phases:
-        # first phase splits on a different set of delimiters to keep the title intact
-        # second phase is normalise_split_artist
-        phase1 = []
-        for i in self._re_title_artist_1().split(value):
-            i = i.strip()
-            if i:
-                phase1.append(i)
-
-        if len(phase1) > 1:
-            result = []
-            for i in phase1[1:]:
-                for a in self._re_title_artist_2().split(i):
-                    a = a.strip()
-                    if a:
-                        result.append(a)
-            return phase1[0], result
-        return phase1[0] if len(phase1) > 0 else "", []
-
-    @functools.cache
+        result: tuple[str, list[str]] = _caches["split_title_artist"](value)
+        return result
+
     def _normalise_split_artist(self, value: str) -> list[str]:
         """Split artist names into separate items."""
-        result = []
-        for a in self._re_split_artists().split(value):
-            a = a.strip()
-            if a:
-                result.append(a)
+        result: list[str] = _caches["split_artist"](value)
         return result
 
-    @functools.cache
     def _normalise_case(self, value: str) -> str:
-        return value.casefold()
+        result: str = _caches["case"](value)
+        return result
 
-    @functools.cache
     def _normalise_punctuation(self, value: str) -> str:
-        first = self._re_punctuation_remove().sub("", value)
-        second = self._re_punctuation_replace().sub(" ", first).strip()
-        return second
+        result: str = _caches["punctuation"](value)
+        return result
 
-    @functools.cache
     def _normalise_constants(self, value: str) -> str:
-        items = self._title_suffix_remove
-        result = str(value)
-        for item in items:
-            if result.endswith(item):
-                length = len(item)
-                result = result[0:-length].strip()
-                return result
+        result: str = _caches["constants"](value)
         return result
 
-    @functools.cache
     def _normalise_spelling(self, value: str) -> str:
-        result = str(value)
-        for spelling in self._spellings:
-            check = spelling["check"]
-            regex = spelling["re"]
-            repl = spelling["repl"]
-            if check in result:
-                result = regex.sub(repl, value)
+        result: str = _caches["spelling"](value)
         return result
 
-    @functools.cache
     def _normalise_encoding(self, value: str) -> str:
         """Normalise a string's encoding."""
-        return (
-            unicodedata.normalize("NFKD", str(value))
-            .encode("ascii", "ignore")
-            .decode("ascii")
-        )
+        result: str = _caches["encoding"](value)
+        return result
 
     def match(
-        self, track: Track, available: list[Track], first_count: int
+        self,
+        track: Track,
+        available: list[Track],
+        first_count: int,
+        threshold: float = 0.85,
     ) -> Track | None:
-        self.normalise_track(track)
+        """Find the track with the best score that reaches the threshold.
 
-        track_title_norm = self._normalise_remove_spaces(track.normalised.title)
-        track_artists_norm = [
-            self._normalise_remove_spaces(i) for i in track.normalised.artists
-        ]
+        All the available tracks are scored,
+        so a close match does not need another search.
+        Later results score a little lower, up to the first count.
+        """
+        self.normalise_track(track)
 
-        haystack = available[:first_count]
-        for other in haystack:
+        best = None
+        best_score = 0.0
+        for rank, other in enumerate(available):
             self.normalise_track(other)
-
-            other_title_norm = self._normalise_remove_spaces(other.normalised.title)
-            other_artists_norm = [
-                self._normalise_remove_spaces(i) for i in other.normalised.artists
-            ]
-
-            matched_title = track_title_norm == other_title_norm
-
-            a_in_b_artists = all(i in other_artists_norm for i in track_artists_norm)
-            b_in_a_artists = all(i in track_artists_norm for i in other_artists_norm)
-            matched_artists = a_in_b_artists or b_in_a_artists
-
-            if matched_title and matched_artists:
-                logger.debug(
-                    "Matched track %s to query result %s ('%s' == '%s').",
-                    track,
-                    other,
-                    track.normalised,
-                    other.normalised,
-                )
-                return other
+            score = self.match_score(track, other, rank, first_count)
             logger.debug(
-                "No match for track %s to query result %s ('%s' != '%s').",
+                "Score %.3f for track %s to query result %s ('%s' vs '%s').",
+                score,
                 track,
                 other,
                 track.normalised,
                 other.normalised,
             )
+            if score > best_score:
+                best = other
+                best_score = score
+
+        if best is not None and best_score >= threshold:
+            logger.debug(
+                "Matched track %s to query result %s with score %.3f.",
+                track,
+                best,
+                best_score,
+            )
+            return best
 
         logger.debug(
-            "No match for track %s in first %s query results.", track, len(haystack)
+            "No match for track %s in %s query results (best score %.3f).",
+            track,
+            len(available),
+            best_score,
         )
-
         return None
+
+    def match_score(
+        self, track: Track, other: Track, rank: int, first_count: int
+    ) -> float:
+        """Score how well another track matches a track, from 0 to 1.
+
+        The score combines the similarity of the titles and artists,
+        how close the durations are when both tracks have a duration,
+        and the rank of the other track in the query results.
+        A title that differs by a word scores much lower than the same title.
+
+        A track with the same title, and artists that include all the other's
+        artists, always scores at least 0.85.
+        """
+        a = track.normalised
+        b = other.normalised
+        if a is None or b is None:
+            msg = "Both tracks must be normalised to score a match."
+            raise ValueError(msg)
+
+        if a.title_key == b.title_key:
+            title_score = 1.0
+        else:
+            title_score = _dice(a.title_tokens, b.title_tokens) ** 2
+
+        if a.artist_keys <= b.artist_keys or b.artist_keys <= a.artist_keys:
+            artist_score = 1.0
+        else:
+            artist_score = _dice(a.artist_tokens, b.artist_tokens)
+
+        scores = [
+            (self._match_weight_title, title_score),
+            (self._match_weight_artists, artist_score),
+        ]
+        if track.duration and other.duration:
+            difference = abs(track.duration - other.duration)
+            duration_score = 1.0 - min(
+                max(difference - self._match_duration_same, 0)
+                / self._match_duration_different,
+                1.0,
+            )
+            scores.append((self._match_weight_duration, duration_score))
+
+        total_weight = sum(weight for weight, _ in scores)
+        score = sum(weight * value for weight, value in scores) / total_weight
+
+        rank_ratio = min(rank, first_count) / first_count if first_count > 0 else 1.0
+        return score * (1.0 - self._match_rank_penalty * rank_ratio)
+
+
+_caches: dict[str, typing.Any] = {}
+_cache_functions: dict[str, typing.Callable[..., typing.Any]] = {}
+_cache_max_size = 16384
+
+
+def _dice(a: frozenset[str], b: frozenset[str]) -> float:
+    """Get the similarity of two sets of words, from 0 to 1."""
+    if not a and not b:
+        return 1.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+_F = typing.TypeVar("_F", bound=typing.Callable[..., typing.Any])
+
+
+def _cached(name: str) -> typing.Callable[[_F], _F]:
+    """Keep the results of a function in the normalisation cache with a name."""
+
+    def decorator(func: _F) -> _F:
+        _cache_functions[name] = func
+        _caches[name] = functools.lru_cache(maxsize=_cache_max_size)(func)
+        return func
+
+    return decorator
+
+
+def configure_caches(
+    max_size: int | None = _cache_max_size, **sizes: int | None
+) -> None:
+    """Set the maximum number of items in the normalisation caches.
+
+    The caches are shared by every Manage instance.
+    The 'max_size' is used for every cache that is not given by name
+    in 'sizes'. A size of None means the cache is not limited.
+    A cache is cleared when its size changes.
+    """
+    unknown = set(sizes) - set(_cache_functions)
+    if unknown:
+        names = ", ".join(sorted(unknown))
+        msg = f"Unknown normalisation caches {names}."
+        raise ValueError(msg)
+    for name, func in _cache_functions.items():
+        size = sizes.get(name, max_size)
+        if _caches[name].cache_info().maxsize != size:
+            _caches[name] = functools.lru_cache(maxsize=size)(func)
+
+
+def cache_stats() -> dict[str, dict[str, int | None]]:
+    """Get the hits, misses, size and maximum size of each normalisation cache."""
+    result = {}
+    for name, cache in _caches.items():
+        info = cache.cache_info()
+        result[name] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "max_size": info.maxsize,
+        }
+    return result
+
+
+def clear_caches() -> None:
+    """Remove all items from the normalisation caches."""
+    for cache in _caches.values():
+        cache.cache_clear()
+
+
+@_cached("collapse_spaces")
+def _collapse_spaces(value: str) -> str:
+    return _re_whitespaces.sub(" ", value).strip()
+
+
+@_cached("remove_spaces")
+def _remove_spaces(value: str) -> str:
+    return _re_whitespaces.sub("", value)
+
+
+@_cached("split_title_artist")
+def _split_title_artist(value: str) -> tuple[str, list[str]]:
+    # two phases:
+    # first phase splits on a different set of delimiters to keep the title intact
+    # second phase is normalise_split_artist
+    phase1 = []
+    for i in _re_title_artist_1().split(value):
+        i = i.strip()
+        if i:
+            phase1.append(i)
+
+    if len(phase1) > 1:
+        result = []
+        for i in phase1[1:]:
+            for a in _re_title_artist_2().split(i):
+                a = a.strip()
+                if a:
+                    result.append(a)
+        return phase1[0], result
+    return phase1[0] if len(phase1) > 0 else "", []
+
+
+@_cached("split_artist")
+def _split_artist(value: str) -> list[str]:
+    result = []
+    for a in _re_split_artists().split(value):
+        a = a.strip()
+        if a:
+            result.append(a)
+    return result
+
+
+@_cached("case")
+def _case(value: str) -> str:
+    return value.casefold()
+
+
+@_cached("punctuation")
+def _punctuation(value: str) -> str:
+    first = _re_punctuation_remove().sub("", value)
+    second = _re_punctuation_replace().sub(" ", first).strip()
+    return second
+
+
+@_cached("constants")
+def _constants(value: str) -> str:
+    items = _title_suffix_remove
+    result = str(value)
+    for item in items:
+        if result.endswith(item):
+            length = len(item)
+            result = result[0:-length].strip()
+            return result
+    return result
+
+
+@_cached("spelling")
+def _spelling(value: str) -> str:
+    result = str(value)
+    for spelling in _spellings:
+        check = spelling["check"]
+        regex = spelling["re"]
+        repl = spelling["repl"]
+        if check in result:
+            result = regex.sub(repl, value)
+    return result
+
+
+@_cached("encoding")
+def _encoding(value: str) -> str:
+    return (
+        unicodedata.normalize("NFKD", str(value))
+        .encode("ascii", "ignore")
+        .decode("ascii")
+    )
+
+
+@_cached("clean")
+def _clean(value: str, *, is_title: bool) -> str:
+    """Run the normalisation steps after splitting the title and artists.
+
+    The punctuation, spelling and encoding steps are skipped
+    for values that do not have the characters they change.
+    """
+    changed = False
+    if _re_punctuation_any.search(value):
+        value = value.translate(_punctuation_remove_table)
+        value = _re_punctuation_replace().sub(" ", value).strip()
+        changed = True
+    if is_title:
+        value = _caches["constants"](value)
+    if any(i["check"] in value for i in _spellings):
+        value = _caches["spelling"](value)
+        changed = True
+    if not value.isascii():
+        value = _caches["encoding"](value)
+        changed = True
+    if changed:
+        value = _re_whitespaces.sub(" ", value).strip()
+    return value
+
+
+def _normalise_unique(
+    unique: list[tuple[str, tuple[str, ...]]],
+) -> list[tuple[str, list[str]]]:
+    """Normalise distinct titles and artists, one step at a time over all of them."""
+    # collapse spaces and case fold each distinct title and artist
+    spaces = _re_whitespaces
+    texts = {i for title, names in unique for i in (title, *names)}
+    prepared = {i: spaces.sub(" ", i).strip().casefold() for i in texts}
+
+    # split the artists from the titles, and the artist names
+    split_title_artist = _caches["split_title_artist"]
+    split_artist = _caches["split_artist"]
+    titles_split = {t: split_title_artist(prepared[t]) for t, _ in unique}
+    artists_split = {i: split_artist(prepared[i]) for _, names in unique for i in names}
+
+    # clean each distinct value
+    clean = _caches["clean"]
+    titles_clean = {
+        t: clean(title, is_title=True) for t, (title, _) in titles_split.items()
+    }
+    values = {i for names in artists_split.values() for i in names}
+    values.update(i for _, names in titles_split.values() for i in names)
+    values_clean = {i: clean(i, is_title=False) for i in values}
+
+    return [
+        (
+            titles_clean[title],
+            [
+                *[values_clean[a] for i in names for a in artists_split[i]],
+                *[values_clean[a] for a in titles_split[title][1]],
+            ],
+        )
+        for title, names in unique
+    ]
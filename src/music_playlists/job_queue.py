@@ -0,0 +1,279 @@
+import contextlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from pathlib import Path
+
+import attrs
+
+from beartype import beartype, typing
+
+from music_playlists import utils
+
+
+logger = logging.getLogger(__name__)
+
+
+@beartype
+@attrs.frozen
+class Job:
+    """A playlist update waiting to run or running in a worker."""
+
+    id: int
+    source: str
+    code: str
+    service: str
+    playlist_id: str
+    attempts: int
+
+
+@beartype
+class JobQueue:
+    """A queue of playlist updates stored in a sqlite database.
+
+    Workers claim a job by taking a lease, keep the lease with heartbeats,
+    and mark the job as done or failed.
+    A job whose lease expires, because the worker stopped, can be claimed again.
+    Failed jobs are retried until they reach the maximum attempts.
+
+    The database can be in a directory shared by many hosts,
+    as long as the file system supports sqlite file locks.
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            code TEXT NOT NULL,
+            service TEXT NOT NULL,
+            playlist_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            lease_owner TEXT,
+            lease_expires REAL,
+            error TEXT,
+            updated REAL NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS jobs_active ON jobs (
+            source, code, service, playlist_id
+        ) WHERE status IN ('pending', 'running');
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_attempts: int = 3,
+        retry_delay: int = 60,
+        timeout: int = 30,
+    ):
+        self._path = path
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._timeout = timeout
+        with self._connect(self._schema):
+            pass
+
+    def enqueue(self, source: str, code: str, service: str, playlist_id: str) -> bool:
+        """Add a job, unless the same job is already waiting or running."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO jobs "
+                "(source, code, service, playlist_id, available_at, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (source, code, service, playlist_id, now, now),
+            )
+            return cursor.rowcount > 0
+
+    def claim(self, owner: str, lease: int) -> Job | None:
+        """Take the lease on the next job that is ready to run."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, source, code, service, playlist_id, attempts FROM jobs "
+                "WHERE (status = 'pending' AND available_at <= ?) "
+                "OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY id LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is None:
+                return None
+
+            job_id, source, code, service, playlist_id, attempts = row
+            job = Job(job_id, source, code, service, playlist_id, attempts + 1)
+            if job.attempts > self._max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', lease_owner = NULL, "
+                    "error = 'Lease expired too many times.', updated = ? "
+                    "WHERE id = ?",
+                    (now, job.id),
+                )
+                conn.commit()
+                return self.claim(owner, lease)
+
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = ?, lease_owner = ?, "
+                "lease_expires = ?, updated = ? WHERE id = ?",
+                (job.attempts, owner, now + lease, now, job.id),
+            )
+            return job
+
+    def heartbeat(self, job: Job, owner: str, lease: int) -> bool:
+        """Extend the lease on a running job."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (now + lease, now, job.id, owner),
+            )
+            return cursor.rowcount > 0
+
+    def complete(self, job: Job, owner: str) -> bool:
+        """Mark a job as done."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', lease_owner = NULL, updated = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (time.time(), job.id, owner),
+            )
+            return cursor.rowcount > 0
+
+    def fail(self, job: Job, owner: str, error: str) -> bool:
+        """Mark a job as failed, so it is retried if it has attempts left."""
+        now = time.time()
+        retry = job.attempts < self._max_attempts
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, available_at = ?, lease_owner = NULL, "
+                "error = ?, updated = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (
+                    "pending" if retry else "failed",
+                    now + self._retry_delay * job.attempts,
+                    error,
+                    now,
+                    job.id,
+                    owner,
+                ),
+            )
+            return cursor.rowcount > 0
+
+    def counts(self) -> dict[str, int]:
+        """Get the number of jobs with each status."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def active(self, service: str) -> int:
+        """Get the number of waiting and running jobs for a service."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM jobs "
+                "WHERE service = ? AND status IN ('pending', 'running')",
+                (service,),
+            ).fetchone()
+        return int(row[0])
+
+    def _connect(
+        self, schema: str | None = None
+    ) -> contextlib.AbstractContextManager[sqlite3.Connection]:
+        # A new connection for each operation, so the queue can be used from
+        # the heartbeat thread, and the transaction ends with the block.
+        return utils.connect(self._path, schema, self._timeout)
+
+
+@beartype
+class Worker:
+    """Runs the jobs in a queue using a process."""
+
+    def __init__(
+        self,
+        process: typing.Any,
+        queue: JobQueue,
+        lease: int = 600,
+        poll: int = 30,
+        owner: str | None = None,
+    ):
+        self._process = process
+        self._queue = queue
+        self._lease = lease
+        self._poll = poll
+        self._owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+
+    def run(self, *, wait: bool = False) -> int:
+        """Run jobs until the queue is empty, or forever if waiting for new jobs.
+
+        Returns the number of jobs that completed.
+        """
+        logger.info("Starting worker %s.", self._owner)
+        completed = 0
+        while True:
+            # the jobs claimed one after another share the charts and searches
+            with self._process.run_context():
+                while job := self._queue.claim(self._owner, self._lease):
+                    if self.run_job(job):
+                        completed += 1
+            if not wait:
+                break
+            time.sleep(self._poll)
+        logger.info("Worker %s completed %s jobs.", self._owner, completed)
+        return completed
+
+    def run_job(self, job: Job) -> bool:
+        """Run one job while keeping its lease.
+
+        The service search quota left today is shared by the jobs
+        for the service that are waiting or running.
+        """
+        logger.info(
+            "Running job %s for %s-%s on %s (attempt %s).",
+            job.id,
+            job.source,
+            job.code,
+            job.service,
+            job.attempts,
+        )
+        stop = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(job, stop), daemon=True)
+        beat.start()
+        try:
+            share = max(self._queue.active(job.service), 1)
+            self._process.update_playlist(*self._playlist_job(job), share=share)
+        except Exception as e:
+            logger.exception("Job %s failed.", job.id)
+            stop.set()
+            beat.join()
+            self._queue.fail(job, self._owner, str(e))
+            return False
+
+        stop.set()
+        beat.join()
+        if not self._queue.complete(job, self._owner):
+            logger.warning("Job %s lease was lost before it completed.", job.id)
+            return False
+        return True
+
+    def _playlist_job(self, job: Job) -> tuple[typing.Any, ...]:
+        """Find the source, chart code and playlist config for a job."""
+        for source, code, pc in self._process.playlist_jobs(
+            f"{job.source}-{job.code}", job.source, job.service
+        ):
+            if pc.playlist_id == job.playlist_id:
+                return source, code, pc
+        msg = f"Job {job.id} does not match a configured playlist."
+        raise ValueError(msg)
+
+    def _heartbeat(self, job: Job, stop: threading.Event) -> None:
+        interval = max(self._lease / 3, 1)
+        while not stop.wait(interval):
+            if not self._queue.heartbeat(job, self._owner, self._lease):
+                logger.warning("Could not renew lease for job %s.", job.id)
@@ -0,0 +1,54 @@
+"""The codes of the available sources, charts and services.
+
+These are used for the command line choices, so the command line can start
+without importing the sources and services.
+Keep in sync with the `code` and `available()` of each `Manage` class.
+The composite charts are defined in the config, so they are not listed here.
+"""
+
+COMPOSITE = "composite"
+
+SOURCES: dict[str, list[str]] = {
+    "abc-radio": [
+        "doublej-most-played-daily",
+        "triplej-most-played-daily",
+        "unearthed-most-played-weekly",
+        "jazz-recently-played",
+        "classic-recently-played",
+        "jazz-most-played-monthly",
+        "jazz-most-played-yearly",
+        "classic-most-played-monthly",
+        "classic-most-played-yearly",
+    ],
+    "last-fm": [
+        "aus-most-played-weekly",
+    ],
+    "radio-4zzz": [
+        "all-most-played-weekly",
+        "all-most-played-monthly",
+        "all-most-played-yearly",
+    ],
+    COMPOSITE: [],
+}
+
+SERVICES: list[str] = [
+    "spotify",
+    "youtube-music",
+]
+
+
+def source_codes() -> list[str]:
+    """Get the sorted source codes."""
+    return sorted(SOURCES)
+
+
+def chart_codes() -> list[str]:
+    """Get the sorted codes of every fixed chart, as '{source}-{chart}'."""
+    return sorted(
+        f"{source}-{chart}" for source, charts in SOURCES.items() for chart in charts
+    )
+
+
+def service_codes() -> list[str]:
+    """Get the sorted service codes."""
+    return sorted(SERVICES)
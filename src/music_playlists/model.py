@@ -1,3 +1,5 @@
+import datetime
+
 from abc import abstractmethod
 
 from beartype import beartype, typing
@@ -15,7 +17,35 @@ class Source(typing.Protocol):
     @abstractmethod
     def available(
         cls,
-    ) -> dict[str, typing.Callable[[typing.Self, str], inter.TrackList]]:
+    ) -> dict[str, typing.Callable[..., inter.TrackList]]:
+        raise NotImplementedError
+
+
+@beartype
+@typing.runtime_checkable
+class DailySource(Source, typing.Protocol):
+    """A protocol for sources with charts that can be built one day at a time."""
+
+    @classmethod
+    @abstractmethod
+    def daily(cls) -> dict[str, str]:
+        raise NotImplementedError
+
+    @classmethod
+    @abstractmethod
+    def windows(cls) -> dict[str, tuple[str, int]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def days(
+        self, as_of: datetime.date | None = None, count: int | None = None
+    ) -> list[datetime.date]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def days_plays(
+        self, code: str, days: list[datetime.date]
+    ) -> dict[datetime.date, list[inter.Track]]:
         raise NotImplementedError
 
 
@@ -32,6 +62,17 @@ class ServiceClient(typing.Protocol):
 class Service(typing.Protocol):
     """A protocol for classes that host streaming music playlists."""
 
+    code: str
+    title: str
+    host: str
+    """The host name that receives the service requests."""
+
+    login_request_count: int
+    """The number of requests needed to log in."""
+
+    update_request_count: int
+    """The number of requests needed to update a playlist."""
+
     @property
     @abstractmethod
     def client(self) -> ServiceClient:
@@ -49,6 +90,10 @@ class Service(typing.Protocol):
     ) -> inter.TrackList:
         raise NotImplementedError
 
+    @abstractmethod
+    def track_embedded_id(self, track: inter.Track) -> inter.Track | None:
+        raise NotImplementedError
+
     @abstractmethod
     def update_playlist_tracks(self, info: inter.ServicePlaylistTracks) -> bool:
         raise NotImplementedError
@@ -1,16 +1,31 @@
+import concurrent.futures
+import contextlib
+import dataclasses
 import datetime
+import inspect
 import logging
 import pathlib
+import threading
 import zoneinfo
 
-from beartype import beartype
+import attrs
+
+from beartype import beartype, typing
 from beartype.claw import beartype_package
 
 from music_playlists import intermediate as inter
-from music_playlists import model, settings, utils
+from music_playlists import (
+    job_queue,
+    model,
+    schedule,
+    settings,
+    sketch,
+    snapshot,
+    utils,
+)
 from music_playlists.intermediate import TrackListType
 from music_playlists.services import spotify, youtube_music
-from music_playlists.sources import abc_radio, last_fm, radio_4zzz
+from music_playlists.sources import abc_radio, composite, last_fm, radio_4zzz
 
 
 beartype_package("music_playlists")
@@ -24,54 +39,294 @@ logging.getLogger("urllib3.connectionpool").setLevel(logging.INFO)
 
 logger = logging.getLogger(__name__)
 
+_first_count = 5
+"""The number of search results checked for a match."""
+
+
+@beartype
+@attrs.define
+class _TrackSearch:
+    """The search for the service track that matches a source track."""
+
+    track: inter.Track
+    queries: list[str] = attrs.field(factory=list)
+    match: inter.Track | None = None
+    found_count: int = 0
+    tried_count: int = 0
+
+
+@beartype
+class RunCache:
+    """The results that can be shared by the playlist updates in one run.
+
+    Only results that do not depend on service credentials are shared.
+    """
+
+    def __init__(self) -> None:
+        self.charts: dict[tuple[str, ...], inter.TrackList] = {}
+        self.searches: dict[tuple[str, str], inter.TrackList] = {}
+        self.planned_searches: set[tuple[str, str]] = set()
+        self.downloaders: dict[pathlib.Path | None, utils.Downloader] = {}
+        self.intermediate = inter.Manage()
+        self._cache_size: int | None = None
+        self._caches_configured = False
+
+    def configure_caches(self, size: int | None) -> None:
+        """Set the size of the normalisation caches once for the run.
+
+        The caches are shared by every process in the run,
+        so the first config file sets their size and they are not cleared again.
+        """
+        if self._caches_configured:
+            if size != self._cache_size:
+                logger.info(
+                    "Keeping normalisation cache size %s for the run, not %s.",
+                    self._cache_size,
+                    size,
+                )
+            return
+        self._caches_configured = True
+        self._cache_size = size
+        if size is not None:
+            inter.configure_caches(size)
+
+    def downloader(
+        self, base_path: pathlib.Path | None, *, refresh: bool
+    ) -> utils.Downloader:
+        """Get the downloader for a base path."""
+        if base_path not in self.downloaders:
+            self.downloaders[base_path] = utils.Downloader(
+                store_path=base_path,
+                expire_days=7,
+                refresh=refresh,
+                force_refresh=refresh,
+            )
+        return self.downloaders[base_path]
+
 
 @beartype
 class Process:
-    def __init__(self, config_file: pathlib.Path, refresh: bool = False):
+    _source_classes: typing.ClassVar[list[type[model.Source]]] = [
+        abc_radio.Manage,
+        last_fm.Manage,
+        radio_4zzz.Manage,
+        composite.Manage,
+    ]
+    _service_classes: typing.ClassVar[list[type[model.Service]]] = [
+        spotify.Manage,
+        youtube_music.Manage,
+    ]
+
+    def __init__(
+        self,
+        config_file: pathlib.Path,
+        *,
+        refresh: bool = False,
+        run_cache: RunCache | None = None,
+        from_snapshot: bool = False,
+        expire_days: float = 7,
+    ):
         # common
+        self._config_file = config_file
         self._settings = settings.Settings(config_file)
         s = self._settings
 
-        self._time_zone = zoneinfo.ZoneInfo(s.time_zone)
-        tz = self._time_zone
-
         self._base_path = pathlib.Path(s.base_path).resolve() if s.base_path else None
-        self._downloader = utils.Downloader(store_path=self._base_path, expire_days=7, refresh=refresh, force_refresh=refresh)
-        d = self._downloader
+        self._run_cache = run_cache
+        if run_cache is None:
+            self._intermediate = inter.Manage()
+        else:
+            self._intermediate = run_cache.intermediate
+        self._latency = utils.LatencyStore(self._base_path)
+        if run_cache is not None:
+            run_cache.configure_caches(s.normalise_cache_size)
+        elif s.normalise_cache_size is not None:
+            inter.configure_caches(int(s.normalise_cache_size))
+        self._playlist_state = utils.PlaylistStateStore(self._base_path)
+        self._match_threshold = float(s.match_threshold)
+        self._from_snapshot = from_snapshot
+        self._stores_days = True
+        self._day_builds: dict[
+            tuple[str | datetime.date, ...], concurrent.futures.Future[typing.Any]
+        ] = {}
+        self._day_builds_lock = threading.Lock()
+        self._rejected_modified: float | None = None
+
+        # The components are built on first use,
+        # so commands only pay for the components they use.
+        self._components = utils.Registry()
+        if run_cache is None:
+            self._components.register(
+                "downloader",
+                lambda: utils.Downloader(
+                    store_path=self._base_path,
+                    expire_days=expire_days,
+                    refresh=refresh,
+                    force_refresh=refresh,
+                ),
+            )
+        else:
+            self._components.register(
+                "downloader",
+                lambda: run_cache.downloader(self._base_path, refresh=refresh),
+            )
+
+        self._build()
+        self._quota = utils.QuotaStore(
+            self._base_path, s.quotas, lambda: self.now().date()
+        )
+
+    def _build(self) -> None:
+        """Register the sources and services using the current settings.
+
+        Registering replaces any components that were already built.
+        """
+        s = self._settings
+        c = self._components
+
+        self._time_zone = zoneinfo.ZoneInfo(s.time_zone)
+        self._playlists_config = list(s.playlists)
 
         # sources
-        self._abc_radio = abc_radio.Manage(d, tz)
-        self._last_fm = last_fm.Manage(d, tz, s.lastfm_api_key)
-        self._radio_4zzz = radio_4zzz.Manage(d, tz)
+        c.register(
+            abc_radio.Manage.code,
+            lambda: abc_radio.Manage(self._downloader, self._time_zone),
+        )
+        c.register(
+            last_fm.Manage.code,
+            lambda: last_fm.Manage(
+                self._downloader, self._time_zone, self._settings.lastfm_api_key
+            ),
+        )
+        c.register(
+            radio_4zzz.Manage.code,
+            lambda: radio_4zzz.Manage(self._downloader, self._time_zone),
+        )
+        c.register(composite.Manage.code, composite.Manage)
 
         # services
-        self._spotify_client = spotify.Client(
-            d,
-            s.spotify_redirect_uri,
-            s.spotify_client_id,
-            s.spotify_client_secret,
-            s.spotify_refresh_token,
+        c.register(
+            spotify.Manage.code,
+            lambda: spotify.Manage(
+                self._downloader,
+                spotify.Client(
+                    self._downloader,
+                    self._settings.spotify_redirect_uri,
+                    self._settings.spotify_client_id,
+                    self._settings.spotify_client_secret,
+                    self._settings.spotify_refresh_token,
+                ),
+            ),
+        )
+        c.register(
+            youtube_music.Manage.code,
+            lambda: youtube_music.Manage(
+                self._downloader,
+                youtube_music.Client(
+                    self._downloader, self._settings.youtube_music_config
+                ),
+            ),
         )
-        self._spotify = spotify.Manage(d, self._spotify_client)
 
-        self._youtube_music_client = youtube_music.Client(d, s.youtube_music_config)
-        self._youtube_music = youtube_music.Manage(d, self._youtube_music_client)
+    @property
+    def _downloader(self) -> utils.Downloader:
+        result: utils.Downloader = self._components.get("downloader")
+        return result
+
+    def _source(self, code: str) -> model.Source:
+        result: model.Source = self._components.get(code)
+        return result
+
+    def _service(self, code: str) -> model.Service:
+        result: model.Service = self._components.get(code)
+        return result
+
+    def reload(self) -> bool:
+        """Load the config file again if it has changed.
 
-        # processing
-        self._intermediate = inter.Manage()
-        self._playlists_config = list(self._settings.playlists)
+        The file is only read again when its modified time has changed.
+        The downloader and normalisation caches are kept.
+        Sources and services are only rebuilt when the secrets or time zone change,
+        so logged in service clients stay logged in.
+        A config file that cannot be loaded is logged and the previous settings
+        are kept, until the file changes again.
+        """
+        current = self._settings
+        path = self._config_file
+        modified = path.stat().st_mtime if path.exists() else None
+        if modified in (current.modified, self._rejected_modified):
+            return False
 
-        self._sources: list[model.Source] = [
-            self._abc_radio,
-            self._last_fm,
-            self._radio_4zzz,
-        ]
+        logger.info("Reloading config file %s.", path)
+        try:
+            loaded = settings.Settings(path)
+            playlists = list(loaded.playlists)
+            zoneinfo.ZoneInfo(loaded.time_zone)
+            for item in [loaded.schedule, *(i.schedule for i in playlists)]:
+                if item:
+                    schedule.CronSchedule(item)
+        except Exception:
+            logger.exception(
+                "Could not reload config file %s, keeping the previous settings.", path
+            )
+            self._rejected_modified = modified
+            return False
 
-    def list_available(self):
+        self._rejected_modified = None
+        self._settings = loaded
+        if loaded.secrets != current.secrets or loaded.time_zone != current.time_zone:
+            self._build()
+        else:
+            self._playlists_config = playlists
+        return True
+
+    @property
+    def components(self) -> utils.Registry:
+        """The downloader, sources and services, which are built on first use."""
+        return self._components
+
+    @property
+    def base_path(self) -> pathlib.Path:
+        """The directory that stores the cache and other run data."""
+        if self._base_path is None:
+            msg = "The config must set a general base_path."
+            raise ValueError(msg)
+        return self._base_path
+
+    def services_enqueue(
+        self,
+        queue: job_queue.JobQueue,
+        code_name: str | None = None,
+        source_name: str | None = None,
+        service_name: str | None = None,
+    ) -> int:
+        """Add a job to the queue for each playlist that would be updated."""
+        count = 0
+        jobs = self.playlist_jobs(code_name, source_name, service_name)
+        for source, code, pc in jobs:
+            if queue.enqueue(source.code, code, pc.service, pc.playlist_id):
+                count += 1
+        logger.info("Added %s playlist update jobs to the queue.", count)
+        return count
+
+    def now(self) -> datetime.datetime:
+        """The current time in the configured time zone."""
+        return datetime.datetime.now(tz=self._time_zone)
+
+    @property
+    def default_schedule(self) -> str | None:
+        """The schedule for playlists that do not set their own schedule."""
+        return self._settings.schedule
+
+    @property
+    def schedule_jitter(self) -> int:
+        """The maximum number of seconds to randomly delay a scheduled update."""
+        return int(self._settings.schedule_jitter)
+
+    def list_available(self) -> list[dict[str, str]]:
         result = []
-        for item in self._sources:
-            available = item.available() or {}
-            for code in available.keys():
+        for item in self._source_classes:
+            for code in self._chart_codes(item):
                 for pc in self._playlists_config:
                     if pc.code == code and pc.source == item.code:
                         result.append(
@@ -89,28 +344,159 @@ class Process:
         )
         return result
 
-    def source_show(self, name: str):
-        for item in self._sources:
-            available = item.available() or {}
-            for code in available.keys():
+    def source_show(
+        self, name: str, as_of: datetime.date | None = None
+    ) -> inter.TrackList:
+        """Get a source chart, as it was on the day 'as_of' if it is given."""
+        for item in self._source_classes:
+            for code in self._chart_codes(item):
                 key = f"{item.code}-{code}"
                 if name != key:
                     continue
                 for pc in self._playlists_config:
                     if pc.code == code and pc.source == item.code:
-                        func = available[code]
-                        tracks = func(item, pc.title)
-                        if tracks.type == TrackListType.ALL_PLAYS:
-                            tracks = self._intermediate.most_played(tracks)
-                        return tracks
-        raise ValueError(f"Could not find a source named '{name}'.")
+                        return self._chart(self._source(item.code), code, pc, as_of)
+        msg = f"Could not find a source named '{name}'."
+        raise ValueError(msg)
+
+    def sources_fetch(
+        self,
+        code_name: str | None = None,
+        source_name: str | None = None,
+    ) -> list[pathlib.Path]:
+        """Get the source charts and save a snapshot of each chart.
+
+        Only the charts used by a playlist in the config are fetched.
+        """
+        store = snapshot.SnapshotStore(self.base_path)
+        result = []
+        fetched = set()
+        with self.run_context():
+            for source, code, pc in self.playlist_jobs(
+                code_name, source_name, require_playlist_id=False
+            ):
+                if (source.code, code) in fetched:
+                    continue
+                fetched.add((source.code, code))
+                tracks = self._chart(source, code, pc)
+                result.append(
+                    store.write(source.code, code, str(self._time_zone), tracks)
+                )
+        return result
+
+    def sources_backfill(
+        self,
+        date_from: datetime.date,
+        date_to: datetime.date,
+        step: datetime.timedelta,
+        code_name: str | None = None,
+        source_name: str | None = None,
+    ) -> list[pathlib.Path]:
+        """Build the charts as they were on past days and save a snapshot of each.
+
+        There is a chart for every step from the first to the last day.
+        The sources download the plays for each day once,
+        for all the charts that include that day.
+        Only sources that can build a chart for a past day are included.
+        """
+        if step < datetime.timedelta(days=1):
+            msg = "The backfill step must be at least one day."
+            raise ValueError(msg)
+        if date_from > date_to:
+            msg = "The backfill start must not be after the end."
+            raise ValueError(msg)
+        days = []
+        day = date_from
+        while day <= date_to:
+            days.append(day)
+            day += step
+
+        items: list[
+            tuple[model.Source, str, settings.PlaylistSetting, datetime.date]
+        ] = []
+        fetched = set()
+        for source, code, pc in self.playlist_jobs(
+            code_name, source_name, require_playlist_id=False
+        ):
+            if (source.code, code) in fetched:
+                continue
+            fetched.add((source.code, code))
+            if not self._builds_past_charts(source, code):
+                logger.warning(
+                    "Source %s-%s cannot build past charts.", source.code, code
+                )
+                continue
+            items.extend((source, code, pc, day) for day in days)
+
+        logger.info(
+            "Backfilling %s charts for %s days from %s to %s.",
+            len(fetched),
+            len(days),
+            date_from,
+            date_to,
+        )
+        store = snapshot.SnapshotStore(self.base_path)
+
+        # The charts are built one at a time, as the sources share
+        # the downloader, and its session and deadline are not thread-safe.
+        result = []
+        with self.run_context():
+            for source, code, pc, as_of in items:
+                tracks = self._chart(source, code, pc, as_of)
+                result.append(
+                    store.write(source.code, code, str(self._time_zone), tracks, as_of)
+                )
+        return result
+
+    def source_matches(
+        self, name: str, service_name: str
+    ) -> tuple[inter.TrackList, inter.TrackList, str, bool]:
+        """Find the service tracks for a source chart, without updating playlists.
+
+        The searches use the search quota, and can use at most the share
+        of the quota left today of one playlist for the service.
+        Raises QuotaReachedError if there is no quota left to share.
+
+        Returns the chart, the matched service tracks, the description,
+        and whether every track was searched.
+        """
+        if service_name not in [i.code for i in self._service_classes]:
+            msg = f"Could not find a service named '{service_name}'."
+            raise ValueError(msg)
+        service = self._service(service_name)
+
+        share = sum(1 for i in self._playlists_config if i.service == service_name)
+        share = max(share, 1)
+        remaining = self._quota.remaining(service_name)
+        if remaining is not None and remaining < share:
+            msg = f"The {service.title} search quota is used up for today."
+            raise utils.QuotaReachedError(msg)
+
+        tracks = self.source_show(name)
+        service.client.login()
+        results, descr, finished = self._find_tracks(
+            service_name, tracks.tracks, self._service_config(service, share)
+        )
+        matched = inter.TrackList(
+            type=TrackListType.ORDERED,
+            title=tracks.title,
+            tracks=list(results.values()),
+        )
+        return tracks, matched, descr, finished
 
     def services_update(
         self,
         code_name: str | None = None,
         source_name: str | None = None,
-        service_name: str | None = None
-    ):
+        service_name: str | None = None,
+        deadline: utils.Deadline | None = None,
+    ) -> list[str]:
+        """Update the service playlists from the source charts.
+
+        Each playlist gets an equal share of the time left before the deadline.
+        Returns a description of the work that was cut to meet the deadline.
+        """
+        deadline = deadline or utils.Deadline()
         logger.info(
             "Updating music playlists with code %s, source %s, service %s.",
             code_name or "(all)",
@@ -118,114 +504,810 @@ class Process:
             service_name or "(all)",
         )
 
-        if not service_name or service_name == self._spotify.code:
-            self._spotify.client.login()
-        if not service_name or service_name == self._youtube_music.code:
-            self._youtube_music.client.login()
-
         # get the new tracks from the source playlists
         # and find the new tracks in the streaming services
-        for source in self._sources:
-            if source_name and source_name != source.code:
+        with self.run_context():
+            jobs = list(self.playlist_jobs(code_name, source_name, service_name))
+            for service_code in sorted({pc.service for _, _, pc in jobs}):
+                self._service(service_code).client.login()
+            for index, (source, code, pc) in enumerate(jobs):
+                job_deadline = deadline.stage(1 / (len(jobs) - index))
+                share = sum(1 for i in jobs[index:] if i[2].service == pc.service)
+                self.update_playlist(source, code, pc, job_deadline, share)
+
+        if deadline.cuts:
+            logger.warning(
+                "Finished updating music playlists, with %s items cut to meet "
+                "the deadline: %s",
+                len(deadline.cuts),
+                " ".join(deadline.cuts),
+            )
+        else:
+            logger.info("Finished updating music playlists")
+        logger.debug("Normalisation caches: %s", inter.cache_stats())
+        return deadline.cuts
+
+    @contextlib.contextmanager
+    def run_context(self) -> typing.Iterator[RunCache]:
+        """Share charts and searches between the playlists in one run."""
+        if self._run_cache is not None:
+            yield self._run_cache
+            return
+        self._run_cache = RunCache()
+        try:
+            yield self._run_cache
+        finally:
+            self._run_cache = None
+
+    def update_playlist(
+        self,
+        source: model.Source,
+        code: str,
+        pc: settings.PlaylistSetting,
+        deadline: utils.Deadline | None = None,
+        share: int = 1,
+    ) -> None:
+        """Update one service playlist from a source chart.
+
+        Getting the chart can use part of the time before the deadline.
+        After that, requests use the cached responses.
+        The service search quota left today is shared by the number of
+        playlists in 'share'.
+
+        The playlist is not changed if the chart is the same as the last update,
+        except for refreshing the description, if that is configured.
+        """
+        deadline = deadline or utils.Deadline()
+        with self._downloader.using(deadline.stage(0.4)) as fetch_deadline:
+            try:
+                tracks = self._chart(source, code, pc)
+            except ValueError:
+                if not fetch_deadline.expired:
+                    raise
+                logger.exception("Could not get chart %s.", pc.title)
+                deadline.cut(f"{pc.title}: could not get the chart in time.")
+                return
+
+        if pc.service in [i.code for i in self._service_classes]:
+            service = self._service(pc.service)
+            key = self._playlist_state_key(source, code, pc)
+            fingerprint = self._intermediate.fingerprint(tracks)
+            state = self._playlist_state.get(key)
+            if state is not None and state.get("fingerprint") == fingerprint:
+                logger.info(
+                    "Chart for %s %s is unchanged since %s.",
+                    service.title,
+                    pc.title,
+                    state.get("updated"),
+                )
+                if self._settings.refresh_description:
+                    service.client.login()
+                    service.update_playlist_details(
+                        inter.ServicePlaylistInfo(
+                            playlist_id=pc.playlist_id,
+                            title=pc.title,
+                            description=self._description(
+                                state.get("found", 0), state.get("total", 0)
+                            ),
+                            is_public=True,
+                        )
+                    )
+            else:
+                service.client.login()
+                found = self._update_service(
+                    service.title,
+                    tracks,
+                    pc.playlist_id,
+                    self._service_config(service, share),
+                    deadline,
+                )
+                if found is not None:
+                    self._playlist_state.set(
+                        key,
+                        {
+                            "fingerprint": fingerprint,
+                            "track_ids": [t.track_id for t in found],
+                            "found": len(found),
+                            "total": len(tracks.tracks),
+                            "updated": self.now().isoformat(),
+                        },
+                    )
+        self._latency.update(self._downloader.latencies)
+        self._downloader.latencies.clear()
+
+    def services_plan(
+        self,
+        code_name: str | None = None,
+        source_name: str | None = None,
+        service_name: str | None = None,
+    ) -> list[dict[str, typing.Any]]:
+        """Estimate the requests that an update would send, without sending them.
+
+        The charts are built from the cached responses, or the snapshots,
+        and the plays and sketches of the days are not saved.
+        A playlist is left out if its chart cannot be built from the cache.
+        The tracks are looked up in the same way as an update.
+        """
+        service_codes = [i.code for i in self._service_classes]
+        run_cache = self._run_cache
+        planned = run_cache.planned_searches if run_cache is not None else set()
+        logins = set()
+        result = []
+        for source, code, pc in self.playlist_jobs(
+            code_name, source_name, service_name
+        ):
+            if pc.service not in service_codes:
+                continue
+            service = self._service(pc.service)
+            try:
+                tracks = self._cached_chart(source, code, pc)
+            except ValueError:
+                logger.warning("Could not plan %s from the cache.", pc.title)
                 continue
-            available = source.available() or {}
-            for code in available.keys():
-                code_key = f"{source.code}-{code}"
+            state = self._playlist_state.get(self._playlist_state_key(source, code, pc))
+            unchanged = state is not None and state.get(
+                "fingerprint"
+            ) == self._intermediate.fingerprint(tracks)
+
+            if unchanged:
+                known_count = len(tracks.tracks)
+                searches_min = searches_max = 0
+                writes = 1 if self._settings.refresh_description else 0
+            else:
+                items = self._track_searches(tracks.tracks, service.track_embedded_id)
+                known_count, searches_min, searches_max = self._plan_searches(
+                    service.code, items, planned
+                )
+                writes = service.update_request_count
+            requests = searches_max + writes
+            if requests and service.code not in logins:
+                logins.add(service.code)
+                requests += service.login_request_count
+            latency = self._latency.estimate(service.host)
+
+            result.append(
+                {
+                    "code": f"{source.code}-{code}",
+                    "title": pc.title,
+                    "service": pc.service,
+                    "tracks": len(tracks.tracks),
+                    "known": known_count,
+                    "searches_min": searches_min,
+                    "searches_max": searches_max,
+                    "writes": writes,
+                    "requests": requests,
+                    "seconds": requests * latency,
+                }
+            )
+        return result
+
+    def _plan_searches(
+        self,
+        service_name: str,
+        items: list[_TrackSearch],
+        planned: set[tuple[str, str]],
+    ) -> tuple[int, int, int]:
+        """Count the tracks that need no searches, and the fewest and most searches.
+
+        The searches from earlier in the run are reused, as they are in an update.
+        A search that is planned is not counted again for a later track or playlist.
+        """
+        cache = self._run_cache.searches if self._run_cache is not None else {}
+        known_count = 0
+        searches_min = 0
+        searches_max = 0
+        for item in items:
+            needed = []
+            for query in [] if item.match is not None else item.queries:
+                key = (service_name, query)
+                found = cache.get(key)
+                if found is not None and self._intermediate.match(
+                    item.track, found.tracks, _first_count, self._match_threshold
+                ):
+                    break
+                if found is None and key not in planned:
+                    needed.append(key)
+            if not needed:
+                known_count += 1
+                continue
+            planned.update(needed)
+            searches_min += 1
+            searches_max += len(needed)
+        return known_count, searches_min, searches_max
+
+    def _cached_chart(
+        self, source: model.Source, code: str, pc: settings.PlaylistSetting
+    ) -> inter.TrackList:
+        """Get a chart using only the cached responses, without saving any days."""
+        self._stores_days = False
+        try:
+            with self._downloader.cache_only():
+                return self._chart(source, code, pc)
+        finally:
+            self._stores_days = True
+
+    def playlist_jobs(
+        self,
+        code_name: str | None = None,
+        source_name: str | None = None,
+        service_name: str | None = None,
+        *,
+        require_playlist_id: bool = True,
+    ) -> typing.Iterator[tuple[model.Source, str, settings.PlaylistSetting]]:
+        """Find the source, chart code and playlist config for each playlist."""
+        for source_class in self._source_classes:
+            if source_name and source_name != source_class.code:
+                continue
+            for code in self._chart_codes(source_class):
+                code_key = f"{source_class.code}-{code}"
                 if code_name and code_name != code_key:
                     continue
                 for pc in self._playlists_config:
-                    if not pc.playlist_id:
+                    if require_playlist_id and not pc.playlist_id:
                         continue
                     if service_name and service_name != pc.service:
                         continue
-                    if pc.code == code and pc.source == source.code:
-                        func = available[code]
-                        tracks = func(source, pc.title)
-                        if tracks.type == TrackListType.ALL_PLAYS:
-                            tracks = self._intermediate.most_played(tracks)
-                        self._intermediate.normalise_tracklist(tracks)
-                        if pc.service == self._spotify.code:
-                            self.update_spotify(tracks, pc.playlist_id)
-                        elif pc.service == self._youtube_music.code:
-                            self.update_youtube_music(tracks, pc.playlist_id)
-
-        logger.info("Finished updating music playlists")
-
-    def update_spotify(self, track_list: inter.TrackList, playlist_id: str):
+                    if pc.code == code and pc.source == source_class.code:
+                        yield self._source(source_class.code), code, pc
+
+    def _chart_codes(self, source_class: type[model.Source]) -> list[str]:
+        """Get the chart codes of a source.
+
+        The composite charts are defined in the settings.
+        """
+        if source_class is composite.Manage:
+            return list(self._settings.composites)
+        return list((source_class.available() or {}).keys())
+
+    def _find_chart(self, name: str) -> tuple[model.Source, str]:
+        """Get the source and chart code for a '{source}-{chart}' code."""
+        for source_class in self._source_classes:
+            for code in self._chart_codes(source_class):
+                if name == f"{source_class.code}-{code}":
+                    return self._source(source_class.code), code
+        msg = f"Could not find a chart named '{name}'."
+        raise ValueError(msg)
+
+    def _builds_past_charts(self, source: model.Source, code: str) -> bool:
+        """Check whether a chart can be built as it was on a past day."""
+        if source.code == composite.Manage.code:
+            charts = self._settings.composites[code].get("charts", [])
+            members = [self._find_chart(name) for name in charts]
+            return all(
+                s.code != composite.Manage.code and self._builds_past_charts(s, c)
+                for s, c in members
+            )
+        func = source.available()[code]
+        return "as_of" in inspect.signature(func).parameters
+
+    def _playlist_state_key(
+        self, source: model.Source, code: str, pc: settings.PlaylistSetting
+    ) -> str:
+        return f"{source.code}-{code}/{pc.service}/{pc.playlist_id}"
+
+    def _chart(
+        self,
+        source: model.Source,
+        code: str,
+        pc: settings.PlaylistSetting,
+        as_of: datetime.date | None = None,
+    ) -> inter.TrackList:
+        """Get the normalised ordered track list for a source chart.
+
+        The chart is loaded from the snapshot instead of the source
+        when the process is using snapshots.
+        A past chart is built when 'as_of' is a date.
+        A chart of all plays that can be built one day at a time
+        only gets the plays for the days that are not stored.
+        A chart of all plays over many days is estimated from a sketch of each day.
+        A composite chart is merged from the other charts.
+        """
+        cache = self._run_cache.charts if self._run_cache is not None else {}
+        ranking = self._settings.rankings.get(f"{source.code}-{code}", {})
+        options = ranking
+        if source.code == composite.Manage.code:
+            options = self._settings.composites.get(code, {})
+        key = (
+            source.code,
+            code,
+            str(self._time_zone),
+            str(as_of or ""),
+            repr(sorted(options.items())),
+        )
+        tracks = cache.get(key)
+        if tracks is None and self._from_snapshot:
+            store = snapshot.SnapshotStore(self.base_path)
+            tracks = store.read(source.code, code, str(self._time_zone), as_of)
+            cache[key] = tracks
+        elif tracks is None:
+            tracks = self._build_chart(source, code, pc, ranking, as_of)
+            self._intermediate.normalise_tracklist(tracks)
+            cache[key] = tracks
+        if tracks.title != pc.title:
+            tracks = attrs.evolve(tracks, title=pc.title)
+        return tracks
+
+    def _build_chart(
+        self,
+        source: model.Source,
+        code: str,
+        pc: settings.PlaylistSetting,
+        ranking: dict[str, typing.Any],
+        as_of: datetime.date | None = None,
+    ) -> inter.TrackList:
+        """Build a source chart using the ranking settings for the chart."""
+        half_life = ranking.get("half_life")
+        if half_life is not None:
+            half_life = utils.parse_duration(str(half_life)).total_seconds()
+        weights = ranking.get("station_weights") or {}
+        weights = {k: float(v) for k, v in weights.items()}
+
+        if source.code == composite.Manage.code:
+            return self._composite_chart(code, pc, as_of)
+        if isinstance(source, model.DailySource) and self._base_path is not None:
+            if code in source.windows():
+                return self._window_chart(source, code, pc.title, as_of)
+            if code in source.daily():
+                plays = self._day_plays(source, code, as_of)
+                return self._intermediate.rank_plays(
+                    plays, pc.title, half_life=half_life, station_weights=weights
+                )
+
+        func = source.available()[code]
+        if as_of is None:
+            tracks = func(source, pc.title)
+        else:
+            tracks = func(source, pc.title, as_of=as_of)
+        if tracks.type == TrackListType.ALL_PLAYS:
+            tracks = self._intermediate.most_played(
+                tracks, half_life=half_life, station_weights=weights
+            )
+        return tracks
+
+    def _composite_chart(
+        self,
+        code: str,
+        pc: settings.PlaylistSetting,
+        as_of: datetime.date | None = None,
+    ) -> inter.TrackList:
+        """Merge the charts of a composite chart into one chart.
+
+        The charts already built in the run are reused,
+        so a composite chart only gets the charts that are not built yet.
+        Each chart is built with its own playlist config, so the charts
+        in the run cache do not have the title of the composite chart.
+        """
+        options = self._settings.composites[code]
+        track_lists = []
+        for name in options.get("charts", []):
+            source, chart_code = self._find_chart(name)
+            if source.code == composite.Manage.code:
+                msg = f"Composite chart '{code}' cannot include '{name}'."
+                raise ValueError(msg)
+            member = self._member_config(source, chart_code, pc)
+            track_lists.append(self._chart(source, chart_code, member, as_of))
+
+        limit = options.get("limit", 100)
+        return self._intermediate.merge_charts(
+            track_lists,
+            pc.title,
+            method=options.get("method", "rrf"),
+            limit=None if limit is None else int(limit),
+        )
+
+    def _member_config(
+        self, source: model.Source, code: str, pc: settings.PlaylistSetting
+    ) -> settings.PlaylistSetting:
+        """Get the playlist config for a chart in a composite chart.
+
+        This is the config of a playlist for the chart if there is one,
+        otherwise the composite playlist config with the chart name as the title.
+        """
+        for item in self._playlists_config:
+            if item.source == source.code and item.code == code:
+                return item
+        name = f"{source.code}-{code}"
+        return dataclasses.replace(pc, source=source.code, code=code, title=name)
+
+    def _day_plays(
+        self, source: model.DailySource, code: str, as_of: datetime.date | None = None
+    ) -> inter.PlayLog:
+        """Get the plays for a chart that is built one day at a time.
+
+        Each day is stored, so later charts only get the plays for new days.
+        The days before the chart are removed, including after a past chart,
+        so the days stored by a backfill do not build up.
+        """
+        store = snapshot.DayPlayStore(self.base_path)
+        days = source.days(as_of)
+        day_plays, new_days = self._plays_on_days(source, code, days, store)
+        plays = inter.PlayLog()
+        for day in days:
+            plays.merge(day_plays[day])
+
+        if days and self._stores_days:
+            store.prune(source.code, code, days[0])
+        logger.info(
+            "Got %s plays for %s-%s from %s stored and %s new days.",
+            len(plays),
+            source.code,
+            code,
+            len(days) - new_days,
+            new_days,
+        )
+        return plays
+
+    def _plays_on_days(
+        self,
+        source: model.DailySource,
+        code: str,
+        days: list[datetime.date],
+        store: snapshot.DayPlayStore,
+        *,
+        save: bool = True,
+    ) -> tuple[dict[datetime.date, inter.PlayLog], int]:
+        """Get the normalised plays on each day, and the number of days not stored.
+
+        The plays for the missing days are saved if 'save' is true.
+        """
+        time_zone = str(self._time_zone)
+
+        def build(missing: list[datetime.date]) -> dict[datetime.date, inter.PlayLog]:
+            # the source gets the missing days together
+            result = {}
+            for day, tracks in source.days_plays(code, missing).items():
+                plays = inter.PlayLog()
+                plays.extend(tracks)
+                self._intermediate.normalise_tracklist(
+                    inter.TrackList(
+                        type=TrackListType.ALL_PLAYS, title=None, tracks=plays.tracks
+                    )
+                )
+                if save and self._stores_days:
+                    store.write(source.code, code, time_zone, day, plays)
+                result[day] = plays
+            return result
+
+        return self._per_day(
+            ("day_plays", source.code, code),
+            days,
+            lambda day: store.read(source.code, code, time_zone, day),
+            build,
+        )
+
+    def _per_day(
+        self,
+        key: tuple[str, ...],
+        days: list[datetime.date],
+        read: typing.Callable[[datetime.date], typing.Any],
+        build: typing.Callable[[list[datetime.date]], dict[datetime.date, typing.Any]],
+    ) -> tuple[dict[datetime.date, typing.Any], int]:
+        """Get the stored item for each day, building the missing days together.
+
+        Each day is built once, and saved by 'build', even when charts
+        with overlapping days are built at the same time in other threads.
+        A thread that needs a day being built by another thread waits for it.
+        Returns the items and the number of days that were not stored.
+        """
+        result = {}
+        missing = []
+        for day in days:
+            item = read(day)
+            if item is None:
+                missing.append(day)
+            else:
+                result[day] = item
+
+        futures, owned = self._claim_days(key, missing)
+        if owned:
+            try:
+                # another thread may have saved the day since it was read
+                built = {day: read(day) for day in owned}
+                built.update(
+                    build([day for day, item in built.items() if item is None])
+                )
+                for day in owned:
+                    futures[day].set_result(built[day])
+            except Exception as e:
+                for day in owned:
+                    if not futures[day].done():
+                        futures[day].set_exception(e)
+                raise
+            finally:
+                with self._day_builds_lock:
+                    for day in owned:
+                        self._day_builds.pop((*key, day), None)
+
+        for day in missing:
+            result[day] = futures[day].result()
+        return result, len(missing)
+
+    def _claim_days(
+        self, key: tuple[str, ...], days: list[datetime.date]
+    ) -> tuple[
+        dict[datetime.date, concurrent.futures.Future[typing.Any]], list[datetime.date]
+    ]:
+        """Get the result of the build of each day.
+
+        Returns the results, and the days that are not being built by another
+        thread, which the caller must build.
+        """
+        owned = []
+        futures = {}
+        with self._day_builds_lock:
+            for day in days:
+                future = self._day_builds.get((*key, day))
+                if future is None:
+                    future = concurrent.futures.Future()
+                    self._day_builds[(*key, day)] = future
+                    owned.append(day)
+                futures[day] = future
+        return futures, owned
+
+    def _window_chart(
+        self,
+        source: model.DailySource,
+        code: str,
+        title: str,
+        as_of: datetime.date | None = None,
+    ) -> inter.TrackList:
+        """Get a chart of all plays over many days from a sketch of each day.
+
+        The sketch of each day is stored, and the sketches are merged,
+        so the plays are only counted once.
+        The plays already stored for the daily chart are used,
+        but the plays of a new day are not stored, as the sketch replaces them.
+        The ranking settings are not used, as the sketches only have counts.
+        """
+        windows = source.windows()
+        daily_code, count = windows[code]
+        sketches = sketch.SketchStore(self.base_path)
+        plays_store = snapshot.DayPlayStore(self.base_path)
+        time_zone = str(self._time_zone)
+
+        def build(missing: list[datetime.date]) -> dict[datetime.date, typing.Any]:
+            plays, _ = self._plays_on_days(
+                source, daily_code, missing, plays_store, save=False
+            )
+            result = {}
+            for day in missing:
+                result[day] = sketch.PlaySketch.from_plays(plays[day])
+                if self._stores_days:
+                    sketches.write(source.code, daily_code, time_zone, day, result[day])
+            return result
+
+        days = source.days(as_of, count)
+        day_sketches, new_days = self._per_day(
+            ("sketches", source.code, daily_code),
+            days,
+            lambda day: sketches.read(source.code, daily_code, time_zone, day),
+            build,
+        )
+        result = sketch.PlaySketch()
+        for day in days:
+            result.merge(day_sketches[day])
+
+        if as_of is None and self._stores_days:
+            longest = max(n for c, n in windows.values() if c == daily_code)
+            sketches.prune(source.code, daily_code, source.days(None, longest)[0])
+        logger.info(
+            "Merged sketches for %s-%s from %s stored and %s new days.",
+            source.code,
+            code,
+            len(days) - new_days,
+            new_days,
+        )
+        return result.most_played(title)
+
+    def _search(
+        self,
+        service_name: str,
+        search_func: typing.Callable[[str], inter.TrackList],
+        query: str,
+        search_allowed: typing.Callable[[], bool] | None = None,
+    ) -> inter.TrackList | None:
+        """Search a service, reusing the results from earlier in the run.
+
+        Returns None if a search is needed and it is not allowed by the quota.
+        """
+        cache = self._run_cache.searches if self._run_cache is not None else {}
+        key = (service_name, query)
+        if key not in cache:
+            if search_allowed is not None and not search_allowed():
+                return None
+            cache[key] = search_func(query)
+        return cache[key]
+
+    def update_spotify(
+        self,
+        track_list: inter.TrackList,
+        playlist_id: str,
+        deadline: utils.Deadline | None = None,
+    ) -> list[inter.Track] | None:
         return self._update_service(
-            "Spotify",
+            spotify.Manage.title,
             track_list,
             playlist_id,
-            inter.ServiceConfig(
-                track_search=self._spotify.search_tracks,
-                track_embedded_id=self._spotify.track_embedded_id,
-                playlist_tracks=self._spotify.update_playlist_tracks,
-                playlist_info=self._spotify.update_playlist_details,
-            ),
+            self._service_config(self._service(spotify.Manage.code)),
+            deadline,
         )
 
-    def update_youtube_music(self, track_list: inter.TrackList, playlist_id: str):
+    def update_youtube_music(
+        self,
+        track_list: inter.TrackList,
+        playlist_id: str,
+        deadline: utils.Deadline | None = None,
+    ) -> list[inter.Track] | None:
         return self._update_service(
-            "YouTube Music",
+            youtube_music.Manage.title,
             track_list,
             playlist_id,
-            inter.ServiceConfig(
-                track_search=self._youtube_music.search_tracks,
-                track_embedded_id=self._youtube_music.track_embedded_id,
-                playlist_tracks=self._youtube_music.update_playlist_tracks,
-                playlist_info=self._youtube_music.update_playlist_details,
-            ),
+            self._service_config(self._service(youtube_music.Manage.code)),
+            deadline,
+        )
+
+    def _service_config(
+        self, service: model.Service, share: int = 1
+    ) -> inter.ServiceConfig:
+        return inter.ServiceConfig(
+            track_search=service.search_tracks,
+            track_embedded_id=service.track_embedded_id,
+            playlist_tracks=service.update_playlist_tracks,
+            playlist_info=service.update_playlist_details,
+            search_allowed=self._search_allowance(service.code, share),
         )
 
+    def _search_allowance(
+        self, service_code: str, share: int
+    ) -> typing.Callable[[], bool] | None:
+        """Build a check that allows a search while the service has quota left.
+
+        The quota left today is shared equally by the playlists left in the run.
+        """
+        remaining = self._quota.remaining(service_code)
+        if remaining is None:
+            return None
+        allowance = remaining // max(share, 1)
+        spent = 0
+
+        def allowed() -> bool:
+            nonlocal spent
+            if spent >= allowance or not self._quota.spend(service_code):
+                return False
+            spent += 1
+            return True
+
+        return allowed
+
     def _find_tracks(
-        self, service_name: str, tracks: list[inter.Track], search_func, embedded_func
-    ):
-        embedded_query = "___EMBEDDED_QUERY___"
+        self,
+        service_name: str,
+        tracks: list[inter.Track],
+        service_config: inter.ServiceConfig,
+        deadline: utils.Deadline | None = None,
+    ) -> tuple[dict[int, inter.Track], str, bool]:
+        """Find the service track for each source track.
 
-        first_count = 5
-        total_count = 0
-        found_count = 0
-        results = {}
-        for track in tracks:
-            total_count += 1
-            query_match = None
+        The first query for every track is tried before the other queries,
+        from the highest to the lowest ranked track.
+        This spends the searches on the most important tracks first,
+        in case the deadline or the search quota is reached.
+
+        Returns the found tracks, the playlist description,
+        and whether every track was searched.
+        """
+        items = self._track_searches(tracks, service_config.track_embedded_id)
+        with self._downloader.using(deadline or utils.Deadline()):
+            stopped = self._search_tracks(service_name, items, service_config, deadline)
 
-            # Check the track to see if it already has an id from the service.
-            embedded = embedded_func(track)
+        unsearched = 0
+        for item in items:
+            if item.match is not None:
+                continue
+            if item.tried_count < len(item.queries):
+                unsearched += 1
+                continue
+            logger.warning(
+                "No match for track %s in first %s %s service tracks "
+                "for %s queries %s.",
+                item.track,
+                min(item.found_count, _first_count),
+                service_name,
+                len(item.queries),
+                item.queries,
+            )
+
+        if stopped == "deadline" and deadline is not None:
+            deadline.cut(
+                f"{service_name}: did not finish searching for {unsearched} "
+                f"of {len(tracks)} tracks."
+            )
+        elif stopped == "quota":
+            logger.warning(
+                "%s search quota reached, did not finish searching for %s "
+                "of %s tracks.",
+                service_name,
+                unsearched,
+                len(tracks),
+            )
+
+        # keep the tracks in rank order, once each
+        results: dict[int, inter.Track] = {}
+        for item in items:
+            if item.match is not None:
+                results.setdefault(item.match.fingerprint, item.match)
+
+        found_count = sum(1 for i in items if i.match is not None)
+        descr = self._description(found_count, len(tracks))
+        return results, descr, stopped is None
+
+    def _track_searches(
+        self,
+        tracks: list[inter.Track],
+        track_embedded_id: typing.Callable[[inter.Track], inter.Track | None],
+    ) -> list[_TrackSearch]:
+        """Start a search for each track.
+
+        A track that already has an id from the service is matched to it,
+        otherwise the search has the queries for the track.
+        """
+        items = []
+        for track in tracks:
+            item = _TrackSearch(track)
+            embedded = track_embedded_id(track)
             if embedded is not None:
-                results[embedded_query] = embedded
-                query_match = embedded_query
-
-            # Query the service to find the track.
-            if embedded is None:
-                queries = self._intermediate.queries(track)
-                service_found_count = 0
-                for query in queries:
-                    if query in results:
-                        query_match = query
-                        break
-                    found_tracks = search_func(query)
-                    service_found_count += len(found_tracks.tracks)
-                    match = self._intermediate.match(
-                        track, found_tracks.tracks, first_count
-                    )
-                    if match:
-                        results[query] = match
-                        query_match = query
-                        break
-
-                if query_match:
-                    found_count += 1
-                else:
-                    logger.warning(
-                        "No match for track %s in first %s %s service tracks for %s queries %s.",
-                        track,
-                        min(service_found_count, first_count),
-                        service_name,
-                        len(queries),
-                        queries,
-                    )
+                self._intermediate.normalise_track(embedded)
+                item.match = embedded
+            else:
+                item.queries = self._intermediate.queries(track)
+            items.append(item)
+        return items
+
+    def _search_tracks(
+        self,
+        service_name: str,
+        items: list["_TrackSearch"],
+        service_config: inter.ServiceConfig,
+        deadline: utils.Deadline | None = None,
+    ) -> str | None:
+        """Search for the tracks that do not have a match, one query at a time.
+
+        Returns 'deadline' or 'quota' if the searches stopped early, otherwise None.
+        """
+        found: dict[str, inter.Track] = {}
+        depth_count = max((len(i.queries) for i in items), default=0)
+        for depth in range(depth_count):
+            for item in items:
+                if item.match is not None or depth >= len(item.queries):
+                    continue
+                if deadline is not None and deadline.expired:
+                    return "deadline"
 
+                query = item.queries[depth]
+                if query in found:
+                    item.tried_count += 1
+                    item.match = found[query]
+                    continue
+                found_tracks = self._search(
+                    service_name,
+                    service_config.track_search,
+                    query,
+                    service_config.search_allowed,
+                )
+                if found_tracks is None:
+                    return "quota"
+                item.tried_count += 1
+                item.found_count += len(found_tracks.tracks)
+                match = self._intermediate.match(
+                    item.track, found_tracks.tracks, _first_count, self._match_threshold
+                )
+                if match:
+                    found[query] = match
+                    item.match = match
+        return None
+
+    def _description(self, found_count: int, total_count: int) -> str:
+        """Build the text for a streaming service playlist description."""
         tracks_percent = float(found_count) / float(total_count + 0.000001)
         current_datetime = datetime.datetime.now(tz=self._time_zone)
         found_info = (
@@ -233,8 +1315,7 @@ class Process:
         )
         logger.warning(found_info)
 
-        # build text for streaming service playlists
-        descr = " ".join(
+        return " ".join(
             [
                 "This playlist was generated on "
                 f"{current_datetime.strftime('%a, %d %b %Y')}.",
@@ -243,21 +1324,30 @@ class Process:
             ],
         )
 
-        return results, descr
-
     def _update_service(
         self,
         service_name: str,
         track_list: inter.TrackList,
         playlist_id: str,
         service_config: inter.ServiceConfig,
-    ):
-        sp_tracks, sp_descr = self._find_tracks(
-            service_name,
-            track_list.tracks,
-            service_config.track_search,
-            service_config.track_embedded_id,
+        deadline: utils.Deadline | None = None,
+    ) -> list[inter.Track] | None:
+        """Find the tracks in a service and update the playlist.
+
+        Returns the service tracks if every track was searched and
+        the playlist was updated, otherwise None.
+        """
+        deadline = deadline or utils.Deadline()
+        match_deadline = deadline.stage(0.8)
+        sp_tracks, sp_descr, finished = self._find_tracks(
+            service_name, track_list.tracks, service_config, match_deadline
         )
+        if not sp_tracks and track_list.tracks and match_deadline.expired:
+            deadline.cut(
+                f"{service_name} {track_list.title}: "
+                "did not update, as no tracks were found in time."
+            )
+            return None
 
         playlist_info = inter.ServicePlaylistInfo(
             playlist_id=playlist_id,
@@ -278,3 +1368,47 @@ class Process:
         logger.info(
             f"Update tracks {'succeeded' if tracks_result is True else 'failed'}."
         )
+        if tracks_result is not True or not finished:
+            return None
+        return playlist_tracks.tracks
+
+
+def run_batch(  # noqa: PLR0913
+    config_files: list[pathlib.Path],
+    code_name: str | None = None,
+    source_name: str | None = None,
+    service_name: str | None = None,
+    deadline: utils.Deadline | None = None,
+    *,
+    refresh: bool = False,
+    from_snapshot: bool = False,
+) -> list[pathlib.Path]:
+    """Update the playlists for many config files in one run.
+
+    The downloader, source charts and service searches are shared.
+    Each config file has its own service clients and credentials.
+
+    Returns the config files that could not be updated.
+    """
+    run_cache = RunCache()
+    deadline = deadline or utils.Deadline()
+    failed = []
+    for index, config_file in enumerate(config_files):
+        logger.info("Updating playlists for config file %s.", config_file)
+        try:
+            p = Process(
+                config_file,
+                refresh=refresh,
+                run_cache=run_cache,
+                from_snapshot=from_snapshot,
+            )
+            p.services_update(
+                code_name,
+                source_name,
+                service_name,
+                deadline.stage(1 / (len(config_files) - index)),
+            )
+        except Exception:
+            logger.exception("Could not update playlists for %s.", config_file)
+            failed.append(config_file)
+    return failed
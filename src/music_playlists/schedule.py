@@ -0,0 +1,175 @@
+import datetime
+import logging
+import random
+import time
+
+from beartype import beartype, typing
+
+
+logger = logging.getLogger(__name__)
+
+
+@beartype
+class CronSchedule:
+    """A cron-like schedule of 'minute hour day-of-month month day-of-week'."""
+
+    _ranges = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != len(self._ranges):
+            msg = f"Invalid schedule '{expression}'."
+            raise ValueError(msg)
+
+        self._expression = expression
+        fields = [
+            self._parse_field(part, low, high)
+            for part, (low, high) in zip(parts, self._ranges, strict=True)
+        ]
+        self._minutes, self._hours, self._days, self._months, self._weekdays = fields
+        self._any_day = parts[2] == "*"
+        self._any_weekday = parts[4] == "*"
+
+    def __str__(self) -> str:
+        return self._expression
+
+    def next_after(self, value: datetime.datetime) -> datetime.datetime:
+        """Get the first scheduled time after a time."""
+        current = value.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = current + datetime.timedelta(days=366 * 5)
+        while current < limit:
+            if current.month not in self._months:
+                current = current.replace(day=1) + datetime.timedelta(days=32)
+                current = current.replace(day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(current):
+                current = (current + datetime.timedelta(days=1)).replace(
+                    hour=0, minute=0
+                )
+                continue
+            if current.hour not in self._hours:
+                current = (current + datetime.timedelta(hours=1)).replace(minute=0)
+                continue
+            if current.minute not in self._minutes:
+                current += datetime.timedelta(minutes=1)
+                continue
+            return current
+        msg = f"Schedule '{self._expression}' never runs."
+        raise ValueError(msg)
+
+    def _day_matches(self, value: datetime.datetime) -> bool:
+        day = value.day in self._days
+        # cron uses 0 for Sunday, python uses 6 for Sunday
+        weekday = (value.weekday() + 1) % 7 in self._weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    @classmethod
+    def _parse_field(cls, value: str, low: int, high: int) -> set[int]:
+        result: set[int] = set()
+        for part in value.split(","):
+            item, _, step_text = part.partition("/")
+            step = int(step_text) if step_text else 1
+            if item == "*":
+                start, end = low, high
+            elif "-" in item:
+                start_text, end_text = item.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = int(item)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end or step < 1:
+                msg = f"Invalid schedule field '{value}'."
+                raise ValueError(msg)
+            result.update(range(start, end + 1, step))
+        return result
+
+
+@beartype
+class Daemon:
+    """Runs each playlist update on its own schedule in one long-lived process."""
+
+    def __init__(
+        self,
+        process: typing.Any,
+        jitter: int = 0,
+        poll: int = 60,
+        sleep: typing.Callable[[float], None] = time.sleep,
+    ):
+        self._process = process
+        self._jitter = jitter
+        self._poll = poll
+        self._sleep = sleep
+        self._next_runs: dict[tuple[str, ...], datetime.datetime] = {}
+        self._schedules: dict[str, CronSchedule | None] = {}
+
+    def run(self, iterations: int | None = None) -> None:
+        """Run scheduled playlist updates until stopped."""
+        logger.info("Starting scheduler with jitter of %s seconds.", self._jitter)
+        count = 0
+        while iterations is None or count < iterations:
+            count += 1
+            try:
+                self._process.reload()
+            except Exception:
+                logger.exception("Could not reload the config, keeping the previous.")
+            now = self._process.now()
+            pending = self.run_pending(now)
+            if pending:
+                wait = (min(pending) - self._process.now()).total_seconds()
+                wait = min(max(wait, 1), self._poll)
+            else:
+                wait = self._poll
+            self._sleep(wait)
+
+    def run_pending(self, now: datetime.datetime) -> list[datetime.datetime]:
+        """Run the playlist updates that are due and get the next run times."""
+        default = self._process.default_schedule
+        keys: set[tuple[str, ...]] = set()
+        # the playlists due at the same time share the charts and searches
+        with self._process.run_context():
+            for source, code, pc in self._process.playlist_jobs():
+                expression = pc.schedule or default
+                if not expression:
+                    continue
+                key = (source.code, code, pc.service, pc.playlist_id, expression)
+                cron = self._schedule(expression)
+                if cron is None:
+                    continue
+                keys.add(key)
+
+                next_run = self._next_runs.get(key)
+                if next_run is None:
+                    self._next_runs[key] = self._with_jitter(cron.next_after(now))
+                    continue
+                if next_run > now:
+                    continue
+
+                try:
+                    self._process.update_playlist(source, code, pc)
+                except Exception:
+                    logger.exception("Could not update playlist %s.", pc.title)
+                self._next_runs[key] = self._with_jitter(cron.next_after(now))
+
+        # forget playlists removed from the config
+        for removed in set(self._next_runs) - keys:
+            del self._next_runs[removed]
+
+        return list(self._next_runs.values())
+
+    def _schedule(self, expression: str) -> CronSchedule | None:
+        """Get the schedule for an expression, logging an invalid one once."""
+        if expression not in self._schedules:
+            try:
+                self._schedules[expression] = CronSchedule(expression)
+            except ValueError:
+                logger.exception("Skipping playlists with invalid schedule.")
+                self._schedules[expression] = None
+        return self._schedules[expression]
+
+    def _with_jitter(self, value: datetime.datetime) -> datetime.datetime:
+        if self._jitter < 1:
+            return value
+        seconds = random.randint(0, self._jitter)  # noqa: S311
+        return value + datetime.timedelta(seconds=seconds)
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from beartype import beartype, typing
+
+from music_playlists import intermediate as inter
+from music_playlists import snapshot, utils
+
+
+logger = logging.getLogger(__name__)
+
+
+def track_list_dict(track_list: inter.TrackList) -> dict[str, typing.Any]:
+    """Convert a track list to a dict that can be serialised to json."""
+    return {
+        "title": track_list.title,
+        "type": track_list.type.name.lower(),
+        "tracks": [snapshot.track_dict(t) for t in track_list.tracks],
+    }
+
+
+@beartype
+class ResponseCache:
+    """Keeps the body of each response for the current time window.
+
+    Only one response is built at a time, as the process and downloader
+    are not thread-safe. Cached responses are served concurrently.
+    """
+
+    def __init__(self, window: int):
+        self._window = max(window, 1)
+        self._items: dict[str, tuple[int, bytes, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self, key: str, build: typing.Callable[[], typing.Any]
+    ) -> tuple[bytes, str]:
+        """Get the body and etag for a key, building it if needed."""
+        window = int(time.time() // self._window)
+        item = self._items.get(key)
+        if item is None or item[0] != window:
+            with self._lock:
+                item = self._items.get(key)
+                if item is None or item[0] != window:
+                    body = json.dumps(build(), indent=2).encode("utf-8")
+                    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+                    item = (window, body, etag)
+                    self._items[key] = item
+        return item[1], item[2]
+
+
+@beartype
+class Handler(BaseHTTPRequestHandler):
+    """Serves charts and service matches as json.
+
+    Routes:
+        /charts
+        /charts/{code}
+        /charts/{code}/matches/{service}
+
+    The matches use the service search quota,
+    and the response is 429 when there is no quota left.
+    """
+
+    process: typing.Any = None
+    cache: ResponseCache
+
+    def do_GET(self) -> None:
+        parts = [i for i in self.path.split("?", 1)[0].split("/") if i]
+        try:
+            build = self._route(parts)
+        except ValueError as e:
+            self._send_error(HTTPStatus.NOT_FOUND, str(e))
+            return
+
+        try:
+            body, etag = self.cache.get("/".join(parts), build)
+        except utils.QuotaReachedError as e:
+            self._send_error(HTTPStatus.TOO_MANY_REQUESTS, str(e))
+            return
+        except ValueError as e:
+            self._send_error(HTTPStatus.NOT_FOUND, str(e))
+            return
+        except Exception:
+            logger.exception("Could not build response for %s.", self.path)
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, "Server error.")
+            return
+
+        if etag in self.headers.get("If-None-Match", ""):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: typing.Any) -> None:  # noqa: A002
+        logger.info("%s - %s", self.address_string(), format % args)
+
+    def _route(self, parts: list[str]) -> typing.Callable[[], typing.Any]:
+        p = self.process
+        if parts == ["charts"]:
+            return lambda: p.list_available()
+        if len(parts) == 2 and parts[0] == "charts":  # noqa: PLR2004
+            return lambda: track_list_dict(p.source_show(parts[1]))
+        if len(parts) == 4 and parts[0] == "charts" and parts[2] == "matches":  # noqa: PLR2004
+            return lambda: self._matches(parts[1], parts[3])
+        msg = f"Unknown path '{self.path}'."
+        raise ValueError(msg)
+
+    def _matches(self, code: str, service: str) -> dict[str, typing.Any]:
+        chart, matched, descr, complete = self.process.source_matches(code, service)
+        return {
+            "chart": track_list_dict(chart),
+            "service": service,
+            "description": descr,
+            "complete": complete,
+            "matches": [snapshot.track_dict(t) for t in matched.tracks],
+        }
+
+    def _send_error(self, status: HTTPStatus, message: str) -> None:
+        body = json.dumps({"error": message}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(process: typing.Any, host: str, port: int, window: int) -> None:
+    """Serve charts and matches over http until stopped."""
+    handler = type(
+        "ProcessHandler",
+        (Handler,),
+        {"process": process, "cache": ResponseCache(window)},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    logger.info("Serving on http://%s:%s with a %ss cache window.", host, port, window)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -1,6 +1,7 @@
 import base64
 import logging
 import secrets
+import time
 import webbrowser
 
 from dataclasses import field
@@ -151,6 +152,7 @@ class Client(model.ServiceClient):
         self._client_secret = client_secret
         self._refresh_token = refresh_token
         self._access_token = access_token
+        self._access_token_expires: float | None = None
 
         self._session = self._downloader.get_session
 
@@ -175,8 +177,15 @@ class Client(model.ServiceClient):
         result = f"Bearer {self.access_token}"
         return result
 
+    @property
+    def access_token_expired(self):
+        expires = self._access_token_expires
+        return expires is not None and time.monotonic() >= expires
+
     def login(self) -> None:
-        if self._refresh_token and not self._access_token:
+        if self._refresh_token and (
+            not self._access_token or self.access_token_expired
+        ):
             self._get_access_token()
         if not self._refresh_token:
             self._get_refresh_token()
@@ -197,6 +206,7 @@ class Client(model.ServiceClient):
 
         data = r.json()
         self._access_token = data.get("access_token")
+        self._set_expires(data.get("expires_in"))
 
     def _get_refresh_token(self) -> None:
         logger.info("Login using Spotify authorisation flow.")
@@ -234,6 +244,14 @@ class Client(model.ServiceClient):
 
         expires_in = response.get("expires_in")
         logger.info(f"Spotify access token expires in {expires_in / 60.0 / 60.0} hours")
+        self._set_expires(expires_in)
+
+    def _set_expires(self, expires_in: int | None) -> None:
+        # renew the access token a minute before it expires
+        if expires_in is None:
+            self._access_token_expires = None
+        else:
+            self._access_token_expires = time.monotonic() + expires_in - 60
 
     def _login_client_auth(self, client_id: str, client_secret: str):
         basic = f"{client_id}:{client_secret}"
@@ -252,6 +270,10 @@ class Client(model.ServiceClient):
 @beartype
 class Manage(model.Service):
     code = "spotify"
+    title = "Spotify"
+    host = "api.spotify.com"
+    login_request_count = 1
+    update_request_count = 2
 
     def __init__(self, downloader: utils.Downloader, client: Client):
         self._downloader = downloader
@@ -328,7 +350,9 @@ class Manage(model.Service):
             "market": market,
         }
         headers = {self._client.auth_header: self._client.auth_value}
-        r = self._session.get(url, params=params, headers=headers)
+        r = self._session.get(
+            url, params=params, headers=headers, timeout=self._downloader.timeout
+        )
         self._check_status(r)
         ts = utils.c.structure(r.json()["tracks"], Tracks)
         results = [self._convert_track(t) for t in ts.items]
@@ -377,4 +401,5 @@ class Manage(model.Service):
             title=item.name,
             artists=[a.name for a in item.artists],
             raw=item,
+            duration=round(item.duration_ms / 1000) if item.duration_ms else None,
         )
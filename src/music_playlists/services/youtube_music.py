@@ -1,4 +1,3 @@
-import functools
 import logging
 import typing
 
@@ -125,12 +124,21 @@ class Client(model.ServiceClient):
         return self._api
 
     def login(self) -> None:
+        if self._api:
+            return
         if not self._credentials:
             self._get_credentials()
 
         logger.info("Login using YouTube Music credentials.")
         s = self._session
-        s.request = functools.partial(s.request, timeout=30)
+        request = s.request
+
+        def request_with_timeout(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+            # the client library requests end at the downloader deadline
+            kwargs.setdefault("timeout", self._downloader.timeout)
+            return request(*args, **kwargs)
+
+        s.request = request_with_timeout
         cred_type, creds = self._credentials.get("type"), self._credentials.get("data")
         if cred_type == "oauth":
             self._api = YTMusic(
@@ -184,6 +192,10 @@ class Client(model.ServiceClient):
 @beartype
 class Manage(model.Service):
     code = "youtube-music"
+    title = "YouTube Music"
+    host = "music.youtube.com"
+    login_request_count = 0
+    update_request_count = 4
 
     def __init__(self, downloader: utils.Downloader, client: Client):
         self._downloader = downloader
@@ -296,4 +308,5 @@ class Manage(model.Service):
             title=item.title,
             artists=[a.name for a in item.artists],
             raw=item,
+            duration=item.duration_seconds,
         )
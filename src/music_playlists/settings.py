@@ -4,7 +4,7 @@ import tomllib
 
 from dataclasses import dataclass
 
-from beartype import beartype
+from beartype import beartype, typing
 
 
 logger = logging.getLogger(__name__)
@@ -18,46 +18,124 @@ class PlaylistSetting:
     code: str
     title: str
     playlist_id: str
+    schedule: str | None = None
+    """A cron-like schedule for updating the playlist in daemon mode."""
 
 
 @beartype
 class Settings:
     def __init__(self, config_path: pathlib.Path):
         self._p = config_path
-        self._data = {}
+        self._data: dict[str, typing.Any] = {}
+        self._modified: float | None = None
         if self._p.exists():
+            self._modified = self._p.stat().st_mtime
             self._data = tomllib.loads(self._p.read_text(encoding="utf-8"))
 
     @property
-    def time_zone(self):
-        return self._get_setting("general", "time_zone")
+    def time_zone(self) -> str:
+        result: str = self._get_setting("general", "time_zone")
+        return result
 
     @property
-    def base_path(self):
-        return self._get_setting("general", "base_path")
+    def base_path(self) -> str:
+        result: str = self._get_setting("general", "base_path")
+        return result
 
     @property
-    def lastfm_api_key(self):
-        return self._get_setting("secrets", "last-fm", "api_key")
+    def schedule(self) -> str | None:
+        result: str | None = self._get_optional("general", "schedule")
+        return result
 
     @property
-    def spotify_refresh_token(self):
-        return self._get_setting("secrets", "spotify", "auth_refresh_token")
+    def schedule_jitter(self) -> int:
+        result: int = self._get_optional("general", "schedule_jitter", default=0)
+        return result
 
     @property
-    def spotify_client_id(self):
-        return self._get_setting("secrets", "spotify", "auth_client_id")
+    def refresh_description(self) -> bool:
+        """Update the description of a playlist even when its chart is unchanged."""
+        result: bool = self._get_optional(
+            "general", "refresh_description", default=False
+        )
+        return result
 
     @property
-    def spotify_client_secret(self):
-        return self._get_setting("secrets", "spotify", "auth_client_secret")
+    def normalise_cache_size(self) -> int | None:
+        """The maximum number of items in each normalisation cache."""
+        result: int | None = self._get_optional("general", "normalise_cache_size")
+        return result
 
     @property
-    def spotify_redirect_uri(self):
-        return self._get_setting("secrets", "spotify", "auth_redirect_uri")
+    def match_threshold(self) -> float | int:
+        """The minimum score, from 0 to 1, for a search result to match a track."""
+        result: float | int = self._get_optional(
+            "general", "match_threshold", default=0.85
+        )
+        return result
 
     @property
-    def youtube_music_config(self):
+    def rankings(self) -> dict[str, dict[str, typing.Any]]:
+        """How to rank the plays for each chart, by '{source}-{chart}' code.
+
+        Each ranking can have a 'half_life' duration and 'station_weights'.
+        """
+        result: dict[str, dict[str, typing.Any]] = self._get_optional(
+            "rankings", default={}
+        )
+        return result
+
+    @property
+    def composites(self) -> dict[str, dict[str, typing.Any]]:
+        """The charts made by merging other charts, by chart code.
+
+        Each composite has 'charts', a list of '{source}-{chart}' codes,
+        and can have a 'method', 'rrf' (default) or 'borda', and a 'limit'.
+        A playlist uses a composite chart with the source 'composite'.
+        """
+        result: dict[str, dict[str, typing.Any]] = self._get_optional(
+            "composites", default={}
+        )
+        return result
+
+    @property
+    def quotas(self) -> dict[str, int]:
+        """The maximum number of searches each day for each service code."""
+        result: dict[str, int] = self._get_optional("quotas", default={})
+        return result
+
+    @property
+    def secrets(self) -> dict[str, typing.Any]:
+        result: dict[str, typing.Any] = self._get_optional("secrets", default={})
+        return result
+
+    @property
+    def lastfm_api_key(self) -> str:
+        result: str = self._get_setting("secrets", "last-fm", "api_key")
+        return result
+
+    @property
+    def spotify_refresh_token(self) -> str:
+        result: str = self._get_setting("secrets", "spotify", "auth_refresh_token")
+        return result
+
+    @property
+    def spotify_client_id(self) -> str:
+        result: str = self._get_setting("secrets", "spotify", "auth_client_id")
+        return result
+
+    @property
+    def spotify_client_secret(self) -> str:
+        result: str = self._get_setting("secrets", "spotify", "auth_client_secret")
+        return result
+
+    @property
+    def spotify_redirect_uri(self) -> str:
+        result: str = self._get_setting("secrets", "spotify", "auth_redirect_uri")
+        return result
+
+    @property
+    def youtube_music_config(self) -> typing.Any:
         p = ["secrets", "youtube-music"]
         try:
             auth = self._get_setting(*[*p, "oauth"])
@@ -76,16 +154,27 @@ class Settings:
         raise ValueError("No auth provided for YouTube Music.")
 
     @property
-    def playlists(self):
+    def playlists(self) -> typing.Iterator[PlaylistSetting]:
         items = self._get_setting("playlists")
         for item in items:
             yield PlaylistSetting(**item)
 
-    def _get_setting(self, *args):
+    @property
+    def modified(self) -> float | None:
+        """The last modified time of the config file when it was loaded."""
+        return self._modified
+
+    def _get_optional(self, *args: str, default: typing.Any = None) -> typing.Any:
+        try:
+            return self._get_setting(*args)
+        except ValueError:
+            return default
+
+    def _get_setting(self, *args: str) -> typing.Any:
         d = self._data or {}
         value = None
         if d:
-            current = {**d}
+            current: typing.Any = {**d}
             for arg in args:
                 current = (current or {}).get(arg)
             if current != d:
@@ -0,0 +1,317 @@
+import array
+import base64
+import datetime
+import logging
+import operator
+import sys
+
+from pathlib import Path
+
+from beartype import beartype, typing
+
+from music_playlists import intermediate as inter
+from music_playlists import snapshot
+
+
+logger = logging.getLogger(__name__)
+
+_mask = (1 << 64) - 1
+_multipliers = (
+    0x9E3779B97F4A7C15,
+    0xC2B2AE3D27D4EB4F,
+    0x165667B19E3779F9,
+    0xD6E8FEB86659FD93,
+    0xFF51AFD7ED558CCD,
+    0xC4CEB9FE1A85EC53,
+    0x94D049BB133111EB,
+    0xBF58476D1CE4E5B9,
+)
+
+
+@beartype
+class CountMinSketch:
+    """Estimates the number of plays of each track in a fixed amount of memory.
+
+    An estimate is never less than the real count.
+    Sketches with the same size can be merged.
+    """
+
+    def __init__(self, width: int = 8192, depth: int = 4):
+        if width < 1 or width & (width - 1):
+            msg = f"Width must be a power of 2, not {width}."
+            raise ValueError(msg)
+        if not 1 <= depth <= len(_multipliers):
+            msg = f"Depth must be from 1 to {len(_multipliers)}."
+            raise ValueError(msg)
+        self.width = width
+        self.depth = depth
+        self.table = array.array("I", [0]) * (width * depth)
+        self._shift = 64 - (width.bit_length() - 1)
+
+    def _indexes(self, key: int) -> list[int]:
+        if self.width == 1:
+            return list(range(self.depth))
+        return [
+            row * self.width + (((key * m) & _mask) >> self._shift)
+            for row, m in enumerate(_multipliers[: self.depth])
+        ]
+
+    def add(self, key: int, count: int = 1) -> None:
+        """Add plays of a track."""
+        for index in self._indexes(key):
+            self.table[index] += count
+
+    def estimate(self, key: int) -> int:
+        """Get the estimated number of plays of a track."""
+        return min(self.table[index] for index in self._indexes(key))
+
+    def merge(self, other: "CountMinSketch") -> None:
+        """Add the plays from another sketch with the same size."""
+        if (self.width, self.depth) != (other.width, other.depth):
+            msg = "Only sketches with the same size can be merged."
+            raise ValueError(msg)
+        self.table = array.array("I", map(operator.add, self.table, other.table))
+
+    def to_bytes(self) -> bytes:
+        """Get the counts as little-endian bytes."""
+        table = array.array("I", self.table)
+        if sys.byteorder != "little":
+            table.byteswap()
+        return table.tobytes()
+
+    def load_bytes(self, value: bytes) -> None:
+        """Set the counts from little-endian bytes."""
+        table = array.array("I")
+        table.frombytes(value)
+        if sys.byteorder != "little":
+            table.byteswap()
+        if len(table) != len(self.table):
+            msg = "The counts are not the same size as the sketch."
+            raise ValueError(msg)
+        self.table = table
+
+
+@beartype
+class SpaceSaving:
+    """Keeps the tracks that may be the most played in a fixed amount of memory.
+
+    A track played more than total plays / capacity times is always kept.
+    The count of a track can be more than the real count by up to its error.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        if capacity < 1:
+            msg = f"Capacity must be at least 1, not {capacity}."
+            raise ValueError(msg)
+        self.capacity = capacity
+        self.counts: dict[int, int] = {}
+        self.errors: dict[int, int] = {}
+
+    def add(self, key: int, count: int = 1) -> None:
+        """Add plays of a track, replacing the least played track if full."""
+        if key in self.counts:
+            self.counts[key] += count
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+            return
+        least = min(self.counts, key=self.counts.__getitem__)
+        least_count = self.counts.pop(least)
+        self.errors.pop(least)
+        self.counts[key] = least_count + count
+        self.errors[key] = least_count
+
+    @property
+    def minimum(self) -> int:
+        """The most plays a track that is not kept can have."""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge(self, other: "SpaceSaving") -> None:
+        """Add the tracks from another summary, keeping the most played.
+
+        A track missing from a full summary may have up to its minimum plays.
+        """
+        own_minimum = self.minimum
+        other_minimum = other.minimum
+        for key in self.counts.keys() - other.counts.keys():
+            self.counts[key] += other_minimum
+            self.errors[key] += other_minimum
+        for key, count in other.counts.items():
+            if key in self.counts:
+                self.counts[key] += count
+                self.errors[key] += other.errors[key]
+            else:
+                self.counts[key] = count + own_minimum
+                self.errors[key] = other.errors[key] + own_minimum
+        if len(self.counts) > self.capacity:
+            ordered = sorted(self.counts, key=self.counts.__getitem__, reverse=True)
+            keep = set(ordered[: self.capacity])
+            self.counts = {k: v for k, v in self.counts.items() if k in keep}
+            self.errors = {k: v for k, v in self.errors.items() if k in keep}
+
+
+@beartype
+class PlaySketch:
+    """The plays over one or more days, as mergeable sketches.
+
+    The space-saving summary keeps the tracks that may be the most played.
+    The plays of those tracks are the lower of the estimates
+    from the summary and the count-min sketch, as both can only be too high.
+    The first play of each kept track represents the track.
+    """
+
+    def __init__(self, width: int = 8192, depth: int = 4, capacity: int = 1000):
+        self.counts = CountMinSketch(width, depth)
+        self.heavy = SpaceSaving(capacity)
+        self.tracks: dict[int, inter.Track] = {}
+
+    @classmethod
+    def from_plays(cls, plays: inter.PlayLog, **kwargs: int) -> "PlaySketch":
+        """Create a sketch from a log of normalised plays."""
+        sketch = cls(**kwargs)
+        fingerprints = [t.fingerprint for t in plays.tracks]
+        for track_id, count in enumerate(plays.counts()):
+            key = fingerprints[track_id]
+            sketch.counts.add(key, count)
+            sketch.heavy.add(key, count)
+            sketch.tracks.setdefault(key, plays.tracks[track_id])
+        sketch.tracks = {
+            k: v for k, v in sketch.tracks.items() if k in sketch.heavy.counts
+        }
+        return sketch
+
+    def merge(self, other: "PlaySketch") -> None:
+        """Add the plays from another sketch."""
+        self.counts.merge(other.counts)
+        self.heavy.merge(other.heavy)
+        for key, track in other.tracks.items():
+            self.tracks.setdefault(key, track)
+        self.tracks = {k: v for k, v in self.tracks.items() if k in self.heavy.counts}
+
+    def most_played(
+        self, title: str | None, limit: int | None = 100
+    ) -> inter.TrackList:
+        """Get the tracks from the most to least played.
+
+        Tracks played only once are left out.
+        Tracks with the same estimate are in the order they were first added.
+        """
+        items = []
+        for order, (key, track) in enumerate(self.tracks.items()):
+            count = min(self.heavy.counts[key], self.counts.estimate(key))
+            if count > 1:
+                items.append((count, -order, track))
+        items.sort(key=lambda i: i[:2], reverse=True)
+        if limit is not None:
+            items = items[:limit]
+        return inter.TrackList(
+            title=title,
+            type=inter.TrackListType.ORDERED,
+            tracks=[track for _, _, track in items],
+        )
+
+
+@beartype
+class SketchStore:
+    """Stores the play sketch of each day for the charts of all plays."""
+
+    version = 1
+
+    def __init__(self, store_path: Path):
+        self._path = store_path / "sketches"
+
+    def path(self, source_code: str, chart_code: str, day: datetime.date) -> Path:
+        """Get the path to the file with the sketch for a chart on a day."""
+        return self._path / f"{source_code}-{chart_code}" / f"{day}.json.gz"
+
+    def write(
+        self,
+        source_code: str,
+        chart_code: str,
+        time_zone: str,
+        day: datetime.date,
+        sketch: PlaySketch,
+    ) -> Path:
+        """Save the sketch for a day, replacing any sketch already stored."""
+        data = {
+            "version": self.version,
+            "source": source_code,
+            "code": chart_code,
+            "time_zone": time_zone,
+            "day": day.isoformat(),
+            "width": sketch.counts.width,
+            "depth": sketch.counts.depth,
+            "capacity": sketch.heavy.capacity,
+            "table": base64.b64encode(sketch.counts.to_bytes()).decode("ascii"),
+            "heavy": [
+                [str(key), count, sketch.heavy.errors[key]]
+                for key, count in sketch.heavy.counts.items()
+            ],
+            "tracks": {
+                str(key): snapshot.track_dict(track)
+                for key, track in sketch.tracks.items()
+            },
+        }
+        path = self.path(source_code, chart_code, day)
+        snapshot.write_json(path, data)
+        logger.debug("Saved sketch for %s to %s.", day, path)
+        return path
+
+    def read(
+        self,
+        source_code: str,
+        chart_code: str,
+        time_zone: str,
+        day: datetime.date,
+        **kwargs: typing.Any,
+    ) -> PlaySketch | None:
+        """Load the sketch for a day.
+
+        Returns None if there is no sketch,
+        or the sketch has another size or time zone.
+        """
+        path = self.path(source_code, chart_code, day)
+        if not path.exists():
+            return None
+
+        data = snapshot.read_json(path)
+        sketch = PlaySketch(**kwargs)
+        expected = [
+            self.version,
+            time_zone,
+            sketch.counts.width,
+            sketch.counts.depth,
+            sketch.heavy.capacity,
+        ]
+        actual = [
+            data.get(i) for i in ["version", "time_zone", "width", "depth", "capacity"]
+        ]
+        if actual != expected:
+            logger.info("Ignoring sketch with other settings in %s.", path)
+            return None
+
+        sketch.counts.load_bytes(base64.b64decode(data["table"]))
+        for key, count, error in data["heavy"]:
+            sketch.heavy.counts[int(key)] = count
+            sketch.heavy.errors[int(key)] = error
+        sketch.tracks = {
+            int(key): snapshot.track_from_dict(track)
+            for key, track in data["tracks"].items()
+        }
+        return sketch
+
+    def prune(self, source_code: str, chart_code: str, before: datetime.date) -> int:
+        """Remove the sketches for the days before a day.
+
+        Returns the number of days removed.
+        """
+        removed = 0
+        for path in self._path.glob(f"{source_code}-{chart_code}/*.json.gz"):
+            day = datetime.date.fromisoformat(path.name.removesuffix(".json.gz"))
+            if day < before:
+                path.unlink()
+                removed += 1
+        return removed
@@ -0,0 +1,262 @@
+import datetime
+import gzip
+import json
+import logging
+import math
+import tempfile
+
+from pathlib import Path
+
+from beartype import beartype, typing
+
+from music_playlists import intermediate as inter
+
+
+logger = logging.getLogger(__name__)
+
+
+@beartype
+class SnapshotStore:
+    """Stores the normalised source charts as compressed json files.
+
+    A snapshot has everything needed to update the service playlists,
+    so the service updates can run without getting the source charts.
+    The raw source data is not kept.
+    """
+
+    version = 1
+
+    def __init__(self, store_path: Path):
+        self._path = store_path / "snapshots"
+
+    def path(
+        self,
+        source_code: str,
+        chart_code: str,
+        as_of: datetime.date | None = None,
+    ) -> Path:
+        """Get the path to the snapshot file for a chart.
+
+        A chart for a past day has the date in the file name.
+        """
+        suffix = f"-{as_of.isoformat()}" if as_of else ""
+        return self._path / f"{source_code}-{chart_code}{suffix}.json.gz"
+
+    def write(
+        self,
+        source_code: str,
+        chart_code: str,
+        time_zone: str,
+        track_list: inter.TrackList,
+        as_of: datetime.date | None = None,
+    ) -> Path:
+        """Save the snapshot of a chart, replacing any earlier snapshot."""
+        data = {
+            "version": self.version,
+            "created": datetime.datetime.now(datetime.UTC).isoformat(),
+            "source": source_code,
+            "code": chart_code,
+            "time_zone": time_zone,
+            "as_of": as_of.isoformat() if as_of else None,
+            "track_list": {
+                "type": track_list.type.name,
+                "title": track_list.title,
+                "tracks": [track_dict(t) for t in track_list.tracks],
+            },
+        }
+        path = self.path(source_code, chart_code, as_of)
+        write_json(path, data)
+
+        logger.info(
+            "Saved snapshot of %s with %s tracks to %s.",
+            track_list.title,
+            len(track_list.tracks),
+            path,
+        )
+        return path
+
+    def read(
+        self,
+        source_code: str,
+        chart_code: str,
+        time_zone: str,
+        as_of: datetime.date | None = None,
+    ) -> inter.TrackList:
+        """Load the snapshot of a chart."""
+        path = self.path(source_code, chart_code, as_of)
+        if not path.exists():
+            msg = f"No snapshot for '{source_code}-{chart_code}' at '{path}'."
+            raise ValueError(msg)
+
+        data = read_json(path)
+        if data.get("version") != self.version:
+            msg = f"Snapshot '{path}' has unknown version '{data.get('version')}'."
+            raise ValueError(msg)
+        if data.get("time_zone") != time_zone:
+            msg = (
+                f"Snapshot '{path}' is for time zone '{data.get('time_zone')}', "
+                f"not '{time_zone}'."
+            )
+            raise ValueError(msg)
+
+        logger.info("Loaded snapshot created %s from %s.", data.get("created"), path)
+        track_list = data["track_list"]
+        return inter.TrackList(
+            type=inter.TrackListType[track_list["type"]],
+            title=track_list["title"],
+            tracks=[track_from_dict(t) for t in track_list["tracks"]],
+        )
+
+
+@beartype
+class DayPlayStore:
+    """Stores the normalised plays of each day for the charts of all plays.
+
+    A chart that covers many days only needs to get the plays for the days
+    that are not stored yet, and the stored plays are already normalised.
+    Each play is kept, instead of a count for each track, as the plays are
+    ranked using the half life and station weights of the playlist,
+    which need the time and station of every play.
+    """
+
+    version = 1
+
+    def __init__(self, store_path: Path):
+        self._path = store_path / "day_plays"
+
+    def path(self, source_code: str, chart_code: str, day: datetime.date) -> Path:
+        """Get the path to the file with the plays for a chart on a day."""
+        return self._path / f"{source_code}-{chart_code}" / f"{day}.json.gz"
+
+    def write(
+        self,
+        source_code: str,
+        chart_code: str,
+        time_zone: str,
+        day: datetime.date,
+        plays: inter.PlayLog,
+    ) -> Path:
+        """Save the plays on a day, replacing any plays already stored."""
+        data = {
+            "version": self.version,
+            "source": source_code,
+            "code": chart_code,
+            "time_zone": time_zone,
+            "day": day.isoformat(),
+            "tracks": [track_dict(t) for t in plays.tracks],
+            "stations": plays.stations,
+            "track_ids": plays.track_ids.tolist(),
+            "played_at": [None if math.isnan(i) else i for i in plays.played_at],
+            "station_ids": plays.station_ids.tolist(),
+        }
+        path = self.path(source_code, chart_code, day)
+        write_json(path, data)
+        logger.debug("Saved %s plays on %s to %s.", len(plays), day, path)
+        return path
+
+    def read(
+        self,
+        source_code: str,
+        chart_code: str,
+        time_zone: str,
+        day: datetime.date,
+    ) -> inter.PlayLog | None:
+        """Load the plays on a day, or None if they are not stored."""
+        path = self.path(source_code, chart_code, day)
+        if not path.exists():
+            return None
+
+        data = read_json(path)
+        if data.get("version") != self.version or data.get("time_zone") != time_zone:
+            logger.info("Ignoring plays stored with other settings in %s.", path)
+            return None
+
+        return inter.PlayLog.from_columns(
+            tracks=[track_from_dict(t) for t in data["tracks"]],
+            stations=data["stations"],
+            track_ids=data["track_ids"],
+            played_at=[math.nan if i is None else i for i in data["played_at"]],
+            station_ids=data["station_ids"],
+        )
+
+    def prune(self, source_code: str, chart_code: str, before: datetime.date) -> int:
+        """Remove the plays on the days before a day.
+
+        Returns the number of days removed.
+        """
+        removed = 0
+        for path in self._path.glob(f"{source_code}-{chart_code}/*.json.gz"):
+            day = datetime.date.fromisoformat(path.name.removesuffix(".json.gz"))
+            if day < before:
+                path.unlink()
+                removed += 1
+        return removed
+
+
+def track_dict(track: inter.Track) -> dict[str, typing.Any]:
+    """Convert a track to a dict that can be serialised to json."""
+    normalised = track.normalised
+    return {
+        "origin_code": track.origin_code,
+        "track_id": track.track_id,
+        "title": track.title,
+        "artists": track.artists,
+        "duration": track.duration,
+        "normalised": (
+            {"title": normalised.title, "artists": normalised.artists}
+            if normalised
+            else None
+        ),
+    }
+
+
+def track_from_dict(data: dict[str, typing.Any]) -> inter.Track:
+    """Convert a dict from track_dict to a track."""
+    normalised = data.get("normalised")
+    return inter.Track(
+        origin_code=data["origin_code"],
+        track_id=data["track_id"],
+        title=data["title"],
+        artists=data["artists"],
+        raw=None,
+        duration=data.get("duration"),
+        normalised=(
+            inter.TrackNormalised(
+                title=normalised["title"], artists=normalised["artists"]
+            )
+            if normalised
+            else None
+        ),
+    )
+
+
+def write_json(path: Path, data: dict[str, typing.Any]) -> None:
+    """Save data as compressed json.
+
+    The data is written to a temporary file then renamed,
+    so a reader never sees a partial file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    content = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    # each writer has its own temporary file, so writers of the same path
+    # at the same time do not replace each other's temporary file
+    temp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False
+        ) as temp_file:
+            temp_path = Path(temp_file.name)
+            temp_file.write(gzip.compress(content))
+        temp_path.replace(path)
+    except BaseException:
+        if temp_path is not None:
+            temp_path.unlink(missing_ok=True)
+        raise
+
+
+def read_json(path: Path) -> dict[str, typing.Any]:
+    """Load data from compressed json."""
+    result: dict[str, typing.Any] = json.loads(
+        gzip.decompress(path.read_bytes()).decode("utf-8")
+    )
+    return result
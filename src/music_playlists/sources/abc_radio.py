@@ -1,5 +1,7 @@
+import concurrent.futures
 import datetime
 import logging
+import threading
 
 import attrs
 import beartype
@@ -208,7 +210,9 @@ class MostPlayedItem:
     primaryPerformer: str  # ":"DMA'S"
     youTubeUrl: str  # ":"https://www.youtube.com/results?search_query=My%20Baby's%20Place%20DMA'S"
     spotifyUrl: str  # ":"https://open.spotify.com/search/My%20Baby's%20Place%20DMA'S"
-    appleUrl: str  # ":"https://music.apple.com/au/search?term=My%20Baby's%20Place%20DMA'S"
+    appleUrl: (
+        str  # ":"https://music.apple.com/au/search?term=My%20Baby's%20Place%20DMA'S"
+    )
     timestampType: str  # ":"default"
     timestampRelativeSR: str  # ":""
     isAustralian: bool  # ":true
@@ -216,13 +220,15 @@ class MostPlayedItem:
     cardImageProps: MostPlayedItemImage | None = None  # ":{
     release: str | None = None  # ":"My Baby's Place"
     label: str | None = None  # ":""
-    year: str  | None = None # ":"2026"
+    year: str | None = None  # ":"2026"
+
 
 utils.c.register_structure_hook(
     MostPlayedItem,
     make_dict_structure_fn(MostPlayedItem, utils.c),
 )
 
+
 @beartype.beartype
 @attrs.frozen
 class MostPlayedPagination:
@@ -240,13 +246,20 @@ class MostPlayedResult:
     date_from: str
     date_to: str
 
+
 utils.c.register_structure_hook(
     MostPlayedResult,
-    make_dict_structure_fn(MostPlayedResult, utils.c, date_from=override(rename="from"), date_to=override(rename="to")),
+    make_dict_structure_fn(
+        MostPlayedResult,
+        utils.c,
+        date_from=override(rename="from"),
+        date_to=override(rename="to"),
+    ),
 )
 
+
 @beartype.beartype
-class Manage(model.Source):
+class Manage(model.DailySource):
     code = "abc-radio"
 
     @classmethod
@@ -257,18 +270,53 @@ class Manage(model.Source):
             "unearthed-most-played-weekly": cls.unearthed_most_played,
             "jazz-recently-played": cls.jazz_recently_played,
             "classic-recently-played": cls.classic_recently_played,
+            "jazz-most-played-monthly": cls.jazz_most_played_monthly,
+            "jazz-most-played-yearly": cls.jazz_most_played_yearly,
+            "classic-most-played-monthly": cls.classic_most_played_monthly,
+            "classic-most-played-yearly": cls.classic_most_played_yearly,
+        }
+
+    @classmethod
+    def daily(cls) -> dict[str, str]:
+        """The charts of all plays that can be built one day at a time.
+
+        Gives the station for each chart code.
+        """
+        return {
+            "jazz-recently-played": "jazz",
+            "classic-recently-played": "classic",
+        }
+
+    @classmethod
+    def windows(cls) -> dict[str, tuple[str, int]]:
+        """The charts of all plays over many days.
+
+        Gives the daily chart code and the number of days for each chart code.
+        """
+        return {
+            "jazz-most-played-monthly": ("jazz-recently-played", 30),
+            "jazz-most-played-yearly": ("jazz-recently-played", 365),
+            "classic-most-played-monthly": ("classic-recently-played", 30),
+            "classic-most-played-yearly": ("classic-recently-played", 365),
         }
 
     def __init__(self, downloader: utils.Downloader, time_zone):
         self._dl = downloader
         self._tz = time_zone
+        self._days: dict[
+            tuple[str, datetime.date], concurrent.futures.Future[list[inter.Track]]
+        ] = {}
+        self._days_lock = threading.Lock()
+        self._days_max = 400
         self._url_abc_radio = "https://music.abcradio.net.au/api/v1"
         self._url_recordings_plays = f"{self._url_abc_radio}/recordings/plays.json"
         self._url_plays_search = f"{self._url_abc_radio}/plays/search.json"
         self._url_tracks_showcase = (
             "https://www.abc.net.au/triplejunearthed/api/loader/TracksShowcaseLoader"
         )
-        self._url_core_next_most_played = "https://www.abc.net.au/core-next/api/mostPlayed"
+        self._url_core_next_most_played = (
+            "https://www.abc.net.au/core-next/api/mostPlayed"
+        )
 
         # https://www.abc.net.au/core-next/api/mostPlayed?
         # station=TRIPLEJ&
@@ -283,14 +331,12 @@ class Manage(model.Source):
         # https://www.abc.net.au/triplejunearthed/music/
         # https://www.abc.net.au/triplej/most-played
 
-    def triplej_most_played(self, title: str) -> inter.TrackList:
+    def triplej_most_played(
+        self, title: str, as_of: datetime.date | None = None
+    ) -> inter.TrackList:
         logger.info("Get %s.", title)
 
-        current_time = datetime.datetime.now(tz=self._tz)
-        current_day = current_time.date()
-
-        date_from = current_day - datetime.timedelta(days=8)
-        date_to = current_day - datetime.timedelta(days=1)
+        date_from, date_to = self._window(as_of)
 
         plays = self.recordings_plays("triplej", date_from, date_to, limit=100)
         tl = inter.TrackList(
@@ -300,14 +346,12 @@ class Manage(model.Source):
         )
         return tl
 
-    def doublej_most_played(self, title: str) -> inter.TrackList:
+    def doublej_most_played(
+        self, title: str, as_of: datetime.date | None = None
+    ) -> inter.TrackList:
         logger.info("Get %s.", title)
 
-        current_time = datetime.datetime.now(tz=self._tz)
-        current_day = current_time.date()
-
-        date_from = current_day - datetime.timedelta(days=8)
-        date_to = current_day - datetime.timedelta(days=1)
+        date_from, date_to = self._window(as_of)
 
         plays = self.recordings_plays("doublej", date_from, date_to, limit=100)
         tl = inter.TrackList(
@@ -317,14 +361,12 @@ class Manage(model.Source):
         )
         return tl
 
-    def unearthed_most_played(self, title: str) -> inter.TrackList:
+    def unearthed_most_played(
+        self, title: str, as_of: datetime.date | None = None
+    ) -> inter.TrackList:
         logger.info("Get %s.", title)
 
-        current_time = datetime.datetime.now(tz=self._tz)
-        current_day = current_time.date()
-
-        date_from = current_day - datetime.timedelta(days=8)
-        date_to = current_day - datetime.timedelta(days=1)
+        date_from, date_to = self._window(as_of)
 
         results = []
         size = 20
@@ -346,7 +388,6 @@ class Manage(model.Source):
             else:
                 break
 
-
         # showcase = self.tracks_showcase()
         # first = self._convert_unearthed_track(showcase.trackOfTheDay)
         # second = [self._convert_unearthed_track(t) for t in showcase.popularTracks]
@@ -359,57 +400,144 @@ class Manage(model.Source):
         )
         return tl
 
-    def classic_recently_played(self, title: str) -> inter.TrackList:
+    def classic_recently_played(
+        self, title: str, as_of: datetime.date | None = None
+    ) -> inter.TrackList:
         logger.info("Get %s.", title)
 
-        current_time = datetime.datetime.now(tz=self._tz)
-        current_day = current_time.date()
+        date_from, date_to = self._window(as_of)
 
-        date_from = current_day - datetime.timedelta(days=8)
-        date_to = current_day - datetime.timedelta(days=1)
-
-        results = []
-        limit = 100
-        offset = 0
-        while True:
-            search = self.plays_search(
-                service="classic",
-                date_from=date_from,
-                date_to=date_to,
-                limit=limit,
-                offset=offset
-            )
-            results.extend([self._convert_play(p) for p in search.items])
-            count = search.offset + len(search.items)
-            if count < search.total:
-                offset += limit
-            else:
-                break
+        results = self._plays_between("classic", date_from, date_to)
 
         tl = inter.TrackList(
             title=title, type=inter.TrackListType.ALL_PLAYS, tracks=results
         )
         return tl
 
-    def jazz_recently_played(self, title: str) -> inter.TrackList:
+    def jazz_recently_played(
+        self, title: str, as_of: datetime.date | None = None
+    ) -> inter.TrackList:
+        logger.info("Get %s.", title)
+
+        date_from, date_to = self._window(as_of)
+
+        results = self._plays_between("jazz", date_from, date_to)
+
+        return inter.TrackList(
+            title=title,
+            type=inter.TrackListType.ALL_PLAYS,
+            tracks=results,
+        )
+
+    def jazz_most_played_monthly(
+        self, title: str, as_of: datetime.date | None = None
+    ) -> inter.TrackList:
+        return self._days_plays(title, "jazz", 30, as_of)
+
+    def jazz_most_played_yearly(
+        self, title: str, as_of: datetime.date | None = None
+    ) -> inter.TrackList:
+        return self._days_plays(title, "jazz", 365, as_of)
+
+    def classic_most_played_monthly(
+        self, title: str, as_of: datetime.date | None = None
+    ) -> inter.TrackList:
+        return self._days_plays(title, "classic", 30, as_of)
+
+    def classic_most_played_yearly(
+        self, title: str, as_of: datetime.date | None = None
+    ) -> inter.TrackList:
+        return self._days_plays(title, "classic", 365, as_of)
+
+    def _days_plays(
+        self, title: str, service: str, count: int, as_of: datetime.date | None
+    ) -> inter.TrackList:
         logger.info("Get %s.", title)
 
-        current_time = datetime.datetime.now(tz=self._tz)
-        current_day = current_time.date()
+        days = self.days(as_of, count)
+        results = self._plays_between(
+            service, days[0], days[-1] + datetime.timedelta(days=1)
+        )
 
+        return inter.TrackList(
+            title=title, type=inter.TrackListType.ALL_PLAYS, tracks=results
+        )
+
+    def _window(
+        self, as_of: datetime.date | None = None
+    ) -> tuple[datetime.date, datetime.date]:
+        """Get the dates of the week before a day, by default today."""
+        current_day = as_of or datetime.datetime.now(tz=self._tz).date()
         date_from = current_day - datetime.timedelta(days=8)
         date_to = current_day - datetime.timedelta(days=1)
-
+        return date_from, date_to
+
+    def days(
+        self, as_of: datetime.date | None = None, count: int | None = None
+    ) -> list[datetime.date]:
+        """Get the days of plays in the charts built one day at a time.
+
+        The days end on the same day as the weekly window,
+        and go back for 'count' days, by default the length of the window.
+        """
+        date_from, date_to = self._window(as_of)
+        count = count or (date_to - date_from).days
+        return [date_to - datetime.timedelta(days=count - i) for i in range(count)]
+
+    def days_plays(
+        self, code: str, days: list[datetime.date]
+    ) -> dict[datetime.date, list[inter.Track]]:
+        """Get the plays on each day for a chart built one day at a time."""
+        service = self.daily()[code]
+        return {day: self._plays_for_day(service, day) for day in days}
+
+    def _plays_between(
+        self, service: str, date_from: datetime.date, date_to: datetime.date
+    ) -> list[inter.Track]:
+        """Get all the plays in a date range, one day at a time.
+
+        Each day is only downloaded once, so charts with overlapping date
+        ranges share the plays, including charts built in other threads.
+        """
+        results = []
+        day = date_from
+        while day < date_to:
+            results.extend(self._plays_for_day(service, day))
+            day += datetime.timedelta(days=1)
+        return results
+
+    def _plays_for_day(self, service: str, day: datetime.date) -> list[inter.Track]:
+        key = (service, day)
+        with self._days_lock:
+            future = self._days.get(key)
+            owner = future is None
+            if future is None:
+                future = concurrent.futures.Future()
+                self._days[key] = future
+                while len(self._days) > self._days_max:
+                    self._days.pop(next(iter(self._days)))
+
+        if owner:
+            try:
+                future.set_result(self._download_day(service, day))
+            except Exception as e:
+                future.set_exception(e)
+                with self._days_lock:
+                    self._days.pop(key, None)
+                raise
+        return future.result()
+
+    def _download_day(self, service: str, day: datetime.date) -> list[inter.Track]:
         results = []
         limit = 100
         offset = 0
         while True:
             search = self.plays_search(
-                service="jazz",
-                date_from=date_from,
-                date_to=date_to,
+                service=service,
+                date_from=day,
+                date_to=day + datetime.timedelta(days=1),
                 limit=limit,
-                offset=offset
+                offset=offset,
             )
             results.extend([self._convert_play(p) for p in search.items])
             count = search.offset + len(search.items)
@@ -417,22 +545,16 @@ class Manage(model.Source):
                 offset += limit
             else:
                 break
-
-        tl = inter.TrackList(
-            title=title,
-            type=inter.TrackListType.ALL_PLAYS,
-            tracks=results,
-        )
-        return tl
+        return results
 
     def recordings_plays(
-            self,
-            service: str,
-            date_from: datetime.date,
-            date_to: datetime.date,
-            order: str = "desc",
-            limit: int = 50,
-            offset: int = 0
+        self,
+        service: str,
+        date_from: datetime.date,
+        date_to: datetime.date,
+        order: str = "desc",
+        limit: int = 50,
+        offset: int = 0,
     ) -> Plays:
         """Get the most played songs for a service."""
         params = {
@@ -443,21 +565,19 @@ class Manage(model.Source):
             "from": f"{date_from.strftime('%Y-%m-%d')}T13:00:00Z",
             "to": f"{date_to.strftime('%Y-%m-%d')}T13:00:00Z",
         }
-        r = self._dl.get(
-            self._url_recordings_plays, params=params
-        )
+        r = self._dl.get(self._url_recordings_plays, params=params)
         if r.status_code == requests.codes.ok and r.text:
             return utils.c.structure(r.json(), Plays)
         raise ValueError(str(r))
 
     def plays_search(
-            self,
-            service: str,
-            date_from: datetime.date,
-            date_to: datetime.date,
-            order: str = "desc",
-            limit: int = 50,
-            offset: int = 0
+        self,
+        service: str,
+        date_from: datetime.date,
+        date_to: datetime.date,
+        order: str = "desc",
+        limit: int = 50,
+        offset: int = 0,
     ) -> Search:
         """Get the recently played songs for a service."""
         params = {
@@ -468,9 +588,7 @@ class Manage(model.Source):
             "order": order,
             "offset": offset,
         }
-        r = self._dl.get(
-            self._url_plays_search, params=params
-        )
+        r = self._dl.get(self._url_plays_search, params=params)
         if r.status_code == requests.codes.ok and r.text:
             return utils.c.structure(r.json(), Search)
         raise ValueError(str(r))
@@ -482,14 +600,15 @@ class Manage(model.Source):
             return utils.c.structure(r.json(), UnearthedTracksShowcase)
         raise ValueError(str(r))
 
-    def most_played_api(self,
-                        station: str,
-                        date_from: datetime.date,
-                        date_to: datetime.date,
-                        size: int = 50,
-                        offset: int = 0,
-                        item_cap: int = 50
-                        ):
+    def most_played_api(
+        self,
+        station: str,
+        date_from: datetime.date,
+        date_to: datetime.date,
+        size: int = 50,
+        offset: int = 0,
+        item_cap: int = 50,
+    ):
         params = {
             "station": station,
             "from": f"{date_from.strftime('%Y-%m-%d')}T14:00:00+00:00",
@@ -498,9 +617,7 @@ class Manage(model.Source):
             "offset": offset,
             "item_cap": item_cap,
         }
-        r = self._dl.get(
-            self._url_core_next_most_played, params=params
-        )
+        r = self._dl.get(self._url_core_next_most_played, params=params)
         if r.status_code == requests.codes.ok and r.text:
             data = r.json()
             return utils.c.structure(data, MostPlayedResult)
@@ -517,6 +634,7 @@ class Manage(model.Source):
                         title=recording.title,
                         artists=[artist.name for artist in recording.artists],
                         raw=recording,
+                        duration=recording.duration,
                     ),
                 )
         return result
@@ -529,6 +647,9 @@ class Manage(model.Source):
                 title=item.recording.title,
                 artists=[artist.name for artist in item.recording.artists],
                 raw=item.recording,
+                duration=item.recording.duration,
+                played_at=datetime.datetime.fromisoformat(item.played_time),
+                station=item.service_id,
             )
         if item.release:
             return inter.Track(
@@ -537,6 +658,8 @@ class Manage(model.Source):
                 title=item.release.title,
                 artists=[artist.name for artist in item.release.artists],
                 raw=item.release,
+                played_at=datetime.datetime.fromisoformat(item.played_time),
+                station=item.service_id,
             )
 
     def _convert_unearthed_track(self, item: UnearthedTrack):
@@ -546,6 +669,7 @@ class Manage(model.Source):
             title=item.title,
             artists=[item.artist.profileName],
             raw=item,
+            duration=round(item.webSourceFile.durationMs / 1000),
         )
 
     def _convert_most_played_item(self, item: MostPlayedItem):
@@ -555,4 +679,5 @@ class Manage(model.Source):
             title=item.title,
             artists=list({item.artist, item.primaryPerformer}),
             raw=item,
+            duration=item.duration,
         )
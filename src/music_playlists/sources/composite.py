@@ -0,0 +1,19 @@
+from beartype import beartype, typing
+
+from music_playlists import intermediate as inter
+from music_playlists import model
+
+
+@beartype
+class Manage(model.Source):
+    """Charts made by merging the charts from other sources.
+
+    The composite charts are defined in the settings, so there are no fixed charts.
+    The process builds each composite chart from the other charts in the same run.
+    """
+
+    code = "composite"
+
+    @classmethod
+    def available(cls) -> dict[str, typing.Callable[..., inter.TrackList]]:
+        return {}
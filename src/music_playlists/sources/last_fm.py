@@ -130,6 +130,7 @@ class Manage(model.Source):
                 title=t.name,
                 artists=[t.artist.name],
                 raw=t,
+                duration=int(t.duration) if t.duration.strip("0").isdigit() else None,
             )
             for t in top
         ]
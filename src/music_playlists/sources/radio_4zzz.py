@@ -1,6 +1,6 @@
 import logging
 
-from datetime import datetime, timedelta, tzinfo
+from datetime import date, datetime, time, timedelta, tzinfo
 
 import attrs
 import requests
@@ -134,13 +134,34 @@ class Track:
 
 
 @beartype
-class Manage(model.Source):
+class Manage(model.DailySource):
     code = "radio-4zzz"
 
     @classmethod
     def available(cls):
         return {
             "all-most-played-weekly": cls.active_program_tracks,
+            "all-most-played-monthly": cls.monthly_program_tracks,
+            "all-most-played-yearly": cls.yearly_program_tracks,
+        }
+
+    @classmethod
+    def daily(cls) -> dict[str, str]:
+        """The charts of all plays that can be built one day at a time.
+
+        Gives the station for each chart code.
+        """
+        return {"all-most-played-weekly": "4zzz"}
+
+    @classmethod
+    def windows(cls) -> dict[str, tuple[str, int]]:
+        """The charts of all plays over many days.
+
+        Gives the daily chart code and the number of days for each chart code.
+        """
+        return {
+            "all-most-played-monthly": ("all-most-played-weekly", 30),
+            "all-most-played-yearly": ("all-most-played-weekly", 365),
         }
 
     def __init__(self, downloader: utils.Downloader, time_zone: tzinfo):
@@ -149,25 +170,93 @@ class Manage(model.Source):
         self._url = "https://airnet.org.au/rest/stations/4ZZZ/programs"
 
     def active_program_tracks(self, title: str) -> inter.TrackList:
+        return self._program_tracks(title, 7)
+
+    def monthly_program_tracks(self, title: str) -> inter.TrackList:
+        return self._program_tracks(title, 30)
+
+    def yearly_program_tracks(self, title: str) -> inter.TrackList:
+        return self._program_tracks(title, 365)
+
+    def days(self, as_of: date | None = None, count: int | None = None) -> list[date]:
+        """Get the days of plays in the charts built one day at a time."""
+        current_day = as_of or datetime.now(tz=self._tz).date()
+        count = count or 7
+        return [current_day - timedelta(days=count - i) for i in range(count)]
+
+    def days_plays(self, code: str, days: list[date]) -> dict[date, list[inter.Track]]:
+        """Get the plays in the episodes that started on each day.
+
+        The programs are crawled once for all the days.
+        Raises an error if the crawl does not finish before the deadline,
+        as requests after the deadline may use old cached responses,
+        so the plays for each day are complete.
+        """
+        if not days:
+            return {}
+        title = f"{self.code}-{code} {min(days)} to {max(days)}"
+        date_from = datetime.combine(min(days), time(), tzinfo=self._tz)
+        date_to = datetime.combine(max(days), time(), tzinfo=self._tz)
+        date_to += timedelta(days=1)
+
+        result: dict[date, list[inter.Track]] = {day: [] for day in days}
+        for track in self._crawl(title, date_from, date_to, by_start=True):
+            day = track.played_at.date() if track.played_at else None
+            if day is not None and day in result:
+                result[day].append(track)
+        if self._dl.deadline.expired:
+            msg = f"{title}: the deadline was reached during the crawl."
+            raise ValueError(msg)
+        return result
+
+    def _program_tracks(self, title: str, days: int) -> inter.TrackList:
         logger.info("Get %s.", title)
 
         current_time = datetime.now(tz=self._tz)
-        date_from = current_time - timedelta(days=7)
+        date_from = current_time - timedelta(days=days)
         date_to = current_time
 
+        tl = inter.TrackList(
+            title=title,
+            type=inter.TrackListType.ALL_PLAYS,
+            tracks=self._crawl(title, date_from, date_to),
+        )
+        return tl
+
+    def _crawl(
+        self,
+        title: str,
+        date_from: datetime,
+        date_to: datetime,
+        *,
+        by_start: bool = False,
+    ) -> list[inter.Track]:
+        """Get the plays in the episodes between two times.
+
+        The episodes must be fully inside the times,
+        or only start inside the times if 'by_start' is set.
+        """
         results = []
 
-        for ps in self.programs():
+        programs = self.programs()
+        for index, ps in enumerate(programs):
+            if self._dl.deadline.expired:
+                message = f"{title}: crawled {index} of {len(programs)} programs."
+                if by_start:
+                    raise ValueError(message)
+                self._dl.deadline.cut(message)
+                break
             if ps.archived is not False:
                 continue
             p = self.program(ps)
             if not p:
                 continue
             for es in self.episodes(p):
-                # must be fully inside the 'from date' -> 'to date'
                 episode_start = self._episode_date(es.start)
                 episode_end = self._episode_date(es.end)
-                if episode_start < date_from or episode_end > date_to:
+                if episode_start < date_from or episode_start >= date_to:
+                    continue
+                if not by_start and episode_end > date_to:
                     continue
 
                 e = self.episode(es)
@@ -179,15 +268,11 @@ class Manage(model.Source):
                             title=t.title or "",
                             artists=[t.artist],
                             raw=t,
+                            played_at=episode_start,
+                            station=p.slug,
                         ),
                     )
-
-        tl = inter.TrackList(
-            title=title,
-            type=inter.TrackListType.ALL_PLAYS,
-            tracks=results,
-        )
-        return tl
+        return results
 
     def programs(self) -> list[ProgramSummary]:
         r = self._dl.get(self._url)
@@ -1,11 +1,19 @@
+import contextlib
 import functools
+import json
 import logging
-from datetime import timedelta
+import re
+import sqlite3
+import time
+from datetime import date, timedelta
 from pathlib import Path
+from urllib.parse import urlparse
 
 import cattr
 import beartype
 import requests
+
+from beartype import typing
 from requests_cache import CachedSession, SQLiteCache
 
 c = cattr.GenConverter(forbid_extra_keys=True)
@@ -18,15 +26,20 @@ class Downloader:
     """Provides a shared downloader that can cache resources."""
 
     def __init__(
-            self,
-            store_path: Path = None,
-            expire_days: float | int | None = None,
-            timeout: int | None = 30,
-            refresh=False,
-            force_refresh=False,
+        self,
+        store_path: Path | None = None,
+        expire_days: float | int | None = None,
+        timeout: int | None = 30,
+        refresh=False,
+        force_refresh=False,
     ):
         self._refresh = refresh
         self._force_refresh = force_refresh
+        self._timeout = timeout
+        self._latencies: dict[str, list[float]] = {}
+        self._last_recorded = None
+        self._cache_only = False
+        self.deadline = Deadline()
         if store_path is None:
             self._session = requests.Session()
             self._session.request = functools.partial(
@@ -60,9 +73,377 @@ class Downloader:
             )
             self._session.cache.delete(expired=True)
 
+        self._session.hooks["response"].append(self._record_latency)
+
     @property
     def get_session(self):
         return self._session
 
+    @property
+    def latencies(self) -> dict[str, list[float]]:
+        """The response times in seconds of requests sent to each host."""
+        return self._latencies
+
+    def _record_latency(
+        self, r: requests.Response, *_args: typing.Any, **_kwargs: typing.Any
+    ) -> None:
+        # the cached session dispatches the hook again for the same response
+        if getattr(r, "from_cache", False) or r is self._last_recorded:
+            return
+        self._last_recorded = r
+        host = urlparse(r.url).hostname or ""
+        self._latencies.setdefault(host, []).append(r.elapsed.total_seconds())
+
+    @property
+    def timeout(self) -> float | None:
+        """The timeout for a request, which ends at the deadline."""
+        if self._timeout is None:
+            return None
+        timeout = float(self._timeout)
+        remaining = self.deadline.remaining
+        if remaining is not None:
+            timeout = max(min(timeout, remaining), 1.0)
+        return timeout
+
+    @contextlib.contextmanager
+    def using(self, deadline: "Deadline") -> typing.Iterator["Deadline"]:
+        """Use a deadline for the requests sent in a block."""
+        previous = self.deadline
+        self.deadline = deadline
+        try:
+            yield deadline
+        finally:
+            self.deadline = previous
+
+    @contextlib.contextmanager
+    def cache_only(self) -> typing.Iterator[None]:
+        """Only use the cached responses, even if they are stale, in a block."""
+        previous = self._cache_only
+        self._cache_only = True
+        try:
+            yield
+        finally:
+            self._cache_only = previous
+
     def get(self, url: str, params=None):
-        return self.get_session.get(url, params=params, refresh=self._refresh, force_refresh=self._force_refresh)
+        session = self.get_session
+        if not self.deadline.expired and not self._cache_only:
+            return session.get(
+                url,
+                params=params,
+                refresh=self._refresh,
+                force_refresh=self._force_refresh,
+                timeout=self.timeout,
+            )
+
+        reason = "Deadline reached"
+        if self._cache_only:
+            reason = "Only using cached responses"
+        if isinstance(session, CachedSession):
+            # out of time, or not sending requests,
+            # so use the cached response, even if it is stale
+            r = session.get(
+                url,
+                params=params,
+                only_if_cached=True,
+                headers={"Cache-Control": f"max-stale={60 * 60 * 24 * 365}"},
+            )
+            if r.status_code == requests.codes.gateway_timeout:
+                msg = f"{reason} and no cached response for '{url}'."
+                raise ValueError(msg)
+            return r
+
+        msg = f"{reason} before request to '{url}'."
+        raise ValueError(msg)
+
+
+@beartype.beartype
+class Registry:
+    """Builds each registered component the first time it is used."""
+
+    def __init__(self) -> None:
+        self._factories: dict[str, typing.Callable[[], typing.Any]] = {}
+        self._built: dict[str, typing.Any] = {}
+
+    def register(self, name: str, factory: typing.Callable[[], typing.Any]) -> None:
+        """Add or replace the function that builds a component."""
+        self._factories[name] = factory
+        self._built.pop(name, None)
+
+    def get(self, name: str) -> typing.Any:
+        """Get a component, building it if needed."""
+        if name not in self._built:
+            factory = self._factories.get(name)
+            if factory is None:
+                msg = f"Unknown component '{name}'."
+                raise ValueError(msg)
+            logger.debug("Building component %s.", name)
+            self._built[name] = factory()
+        return self._built[name]
+
+    def is_built(self, name: str) -> bool:
+        return name in self._built
+
+    def clear(self, *names: str) -> None:
+        """Forget the built components, so they are built again on next use."""
+        for name in names or list(self._built):
+            self._built.pop(name, None)
+
+
+@beartype.beartype
+class Deadline:
+    """A time that a run, or a stage of a run, must finish by.
+
+    A deadline without an end never expires.
+    The stages of a run share the list of the work that was cut to meet the deadline.
+    """
+
+    def __init__(
+        self,
+        seconds: float | int | None = None,  # noqa: PYI041
+        end: float | None = None,
+        cuts: list[str] | None = None,
+    ):
+        if end is None and seconds is not None:
+            end = time.monotonic() + seconds
+        self._end = end
+        self.cuts = cuts if cuts is not None else []
+
+    @property
+    def remaining(self) -> float | None:
+        """The number of seconds left, or None if there is no deadline."""
+        if self._end is None:
+            return None
+        return max(self._end - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self._end is not None and time.monotonic() >= self._end
+
+    def stage(self, fraction: float) -> "Deadline":
+        """Get a deadline that uses a fraction of the time that is left."""
+        remaining = self.remaining
+        if remaining is None:
+            return Deadline(cuts=self.cuts)
+        return Deadline(remaining * fraction, cuts=self.cuts)
+
+    def cut(self, message: str) -> None:
+        """Record work that was skipped to meet the deadline."""
+        logger.warning("Deadline: %s", message)
+        self.cuts.append(message)
+
+
+@contextlib.contextmanager
+def connect(
+    path: Path, schema: str | None = None, timeout: float = 30
+) -> typing.Iterator[sqlite3.Connection]:
+    """Connect to a sqlite database for one block.
+
+    The tables in the schema are created if they do not exist.
+    The transaction is committed at the end of the block,
+    or rolled back if the block raises an error.
+    """
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    try:
+        if schema:
+            conn.executescript(schema)
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def parse_duration(value: str) -> timedelta:
+    """Parse a duration such as '90', '90s', '30m', '2h', '1d' or '1w'."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*", value or "")
+    if not match:
+        msg = f"Invalid duration '{value}'."
+        raise ValueError(msg)
+    number = float(match.group(1))
+    unit = match.group(2) or "s"
+    units = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+    return timedelta(**{units[unit]: number})
+
+
+@beartype.beartype
+class LatencyStore:
+    """Keeps a moving average of the response time for each host.
+
+    The averages are saved in state.sqlite in the store path.
+    Each update is merged into the saved average,
+    so updates from workers running at the same time are all kept.
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS latency (
+            host TEXT PRIMARY KEY,
+            seconds REAL NOT NULL
+        );
+    """
+
+    def __init__(self, store_path: Path | None = None, weight: float = 0.3):
+        self._path = store_path / "state.sqlite" if store_path else None
+        self._weight = weight
+        self._data: dict[str, float] = {}
+
+    def estimate(self, host: str, default: float = 0.5) -> float:
+        """Get the expected response time in seconds for a host."""
+        if not self._path:
+            return self._data.get(host, default)
+        with connect(self._path, self._schema) as conn:
+            row = conn.execute(
+                "SELECT seconds FROM latency WHERE host = ?", (host,)
+            ).fetchone()
+        return row[0] if row else default
+
+    def update(self, latencies: dict[str, list[float]]) -> None:
+        """Merge new response times and save them."""
+        means = {
+            host: sum(samples) / len(samples)
+            for host, samples in latencies.items()
+            if samples
+        }
+        if not self._path:
+            for host, mean in means.items():
+                previous = self._data.get(host)
+                if previous is None:
+                    self._data[host] = mean
+                else:
+                    weighted = previous * (1 - self._weight) + mean * self._weight
+                    self._data[host] = weighted
+            return
+        if not means:
+            return
+
+        with connect(self._path, self._schema) as conn:
+            conn.executemany(
+                "INSERT INTO latency (host, seconds) VALUES (?, ?) "
+                "ON CONFLICT (host) DO UPDATE SET "
+                "seconds = seconds * ? + excluded.seconds * ?",
+                [(h, m, 1 - self._weight, self._weight) for h, m in means.items()],
+            )
+
+
+class QuotaReachedError(ValueError):
+    """The search quota for a service is used up for today."""
+
+
+@beartype.beartype
+class QuotaStore:
+    """Counts the searches sent to each service each day, to stay within a quota.
+
+    The counts are saved in state.sqlite in the store path,
+    so they are shared by the runs and workers on the same day.
+    Spending checks and adds to the count in one update,
+    so workers running at the same time cannot go over the quota.
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS quota (
+            day TEXT NOT NULL,
+            service TEXT NOT NULL,
+            used INTEGER NOT NULL,
+            PRIMARY KEY (day, service)
+        );
+    """
+
+    def __init__(
+        self,
+        store_path: Path | None,
+        limits: dict[str, int],
+        today: typing.Callable[[], date],
+    ):
+        self._path = store_path / "state.sqlite" if store_path else None
+        self._limits = limits
+        self._today = today
+        self._used: dict[tuple[str, str], int] = {}
+
+    def remaining(self, service: str) -> int | None:
+        """Get the number of searches left today, or None if there is no quota."""
+        limit = self._limits.get(service)
+        if limit is None:
+            return None
+        key = (self._today().isoformat(), service)
+        used = self._used.get(key, 0)
+        if self._path:
+            with connect(self._path, self._schema) as conn:
+                row = conn.execute(
+                    "SELECT used FROM quota WHERE day = ? AND service = ?", key
+                ).fetchone()
+            used = row[0] if row else 0
+        return max(limit - used, 0)
+
+    def spend(self, service: str, count: int = 1) -> bool:
+        """Use some of the quota, if there is enough left."""
+        limit = self._limits.get(service)
+        if limit is None:
+            return True
+        day = self._today().isoformat()
+        if not self._path:
+            used = self._used.get((day, service), 0)
+            if used + count > limit:
+                return False
+            self._used[(day, service)] = used + count
+            return True
+
+        with connect(self._path, self._schema) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM quota WHERE day < ?", (day,))
+            conn.execute(
+                "INSERT OR IGNORE INTO quota (day, service, used) VALUES (?, ?, 0)",
+                (day, service),
+            )
+            cursor = conn.execute(
+                "UPDATE quota SET used = used + ? "
+                "WHERE day = ? AND service = ? AND used + ? <= ?",
+                (count, day, service, count, limit),
+            )
+            return cursor.rowcount > 0
+
+
+@beartype.beartype
+class PlaylistStateStore:
+    """Keeps the chart fingerprint and service track ids of each updated playlist.
+
+    The state is saved in state.sqlite in the store path.
+    Each playlist is saved as its own row,
+    so workers updating different playlists keep each other's state.
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS playlists (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, store_path: Path | None = None):
+        self._path = store_path / "state.sqlite" if store_path else None
+        self._data: dict[str, dict[str, typing.Any]] = {}
+
+    def get(self, key: str) -> dict[str, typing.Any] | None:
+        """Get the state of a playlist from the last update."""
+        if not self._path:
+            return self._data.get(key)
+        with connect(self._path, self._schema) as conn:
+            row = conn.execute(
+                "SELECT value FROM playlists WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: dict[str, typing.Any]) -> None:
+        """Save the state of a playlist."""
+        if not self._path:
+            self._data[key] = value
+            return
+        with connect(self._path, self._schema) as conn:
+            conn.execute(
+                "INSERT INTO playlists (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (key, json.dumps(value)),
+            )
@@ -0,0 +1,115 @@
+import pathlib
+
+from importlib.resources import files
+from typing import override
+
+import attrs
+import pytest
+
+from music_playlists import intermediate as inter
+from music_playlists import model
+from music_playlists.sources import abc_radio
+
+
+@pytest.fixture
+def config_file(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> pathlib.Path:
+    """Write the test config to a temporary directory, and run the test there.
+
+    The config uses the current directory as the base path.
+    """
+    monkeypatch.chdir(tmp_path)
+    result = tmp_path / "test.toml"
+    result.write_text(files("tests.resources").joinpath("test.toml").read_text())
+    return result
+
+
+@pytest.fixture
+def chart_titles(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    """Replace the Double J chart with a chart of these titles by artist 'A'.
+
+    Change the list to change the chart.
+    """
+    titles = ["Song"]
+
+    def chart(_self: abc_radio.Manage, title: str | None) -> inter.TrackList:
+        tracks = [
+            inter.Track(
+                origin_code="abc-radio", track_id=t, title=t, artists=["A"], raw={}
+            )
+            for t in titles
+        ]
+        return inter.TrackList(
+            type=inter.TrackListType.ORDERED, title=title, tracks=tracks
+        )
+
+    monkeypatch.setattr(abc_radio.Manage, "doublej_most_played", chart)
+    return titles
+
+
+class FakeClient:
+    def login(self) -> None:
+        pass
+
+
+class FakeService(model.Service):
+    """A service that finds a track for every search and records the updates."""
+
+    code = "spotify"
+    title = "Spotify"
+    host = "api.spotify.com"
+    login_request_count = 1
+    update_request_count = 2
+
+    def __init__(self, *, embedded: bool = False) -> None:
+        self._client = FakeClient()
+        self.embedded = embedded
+        self.searches: list[str] = []
+        self.details: list[str | None] = []
+        self.updates: list[list[str | None]] = []
+
+    @property
+    def client(self) -> FakeClient:
+        return self._client
+
+    def playlist_tracks(
+        self, playlist_id: str, limit: int | None = 100, *args: str, **kwargs: str
+    ) -> inter.TrackList:
+        raise NotImplementedError
+
+    @override
+    def search_tracks(
+        self, query: str, limit: int | None = 5, *args: str, **kwargs: str
+    ) -> inter.TrackList:
+        self.searches.append(query)
+        track = inter.Track(
+            origin_code="spotify",
+            track_id=f"id-{query}",
+            title="Song",
+            artists=["A"],
+            raw=None,
+        )
+        return inter.TrackList(
+            type=inter.TrackListType.ORDERED, title=None, tracks=[track]
+        )
+
+    @override
+    def track_embedded_id(self, track: inter.Track) -> inter.Track | None:
+        if not self.embedded:
+            return None
+        return attrs.evolve(track, origin_code="spotify", normalised=None)
+
+    def update_playlist_tracks(self, info: inter.ServicePlaylistTracks) -> bool:
+        self.updates.append([t.track_id for t in info.tracks])
+        return True
+
+    def update_playlist_details(self, info: inter.ServicePlaylistInfo) -> bool:
+        self.details.append(info.description)
+        return True
+
+
+@pytest.fixture
+def fake_service() -> FakeService:
+    """A fake Spotify service, to register in place of the real one."""
+    return FakeService()
@@ -0,0 +1,53 @@
+import datetime
+import threading
+import zoneinfo
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from music_playlists import intermediate as inter
+from music_playlists import utils
+from music_playlists.sources import abc_radio
+
+
+def test_days() -> None:
+    source = abc_radio.Manage(utils.Downloader(), zoneinfo.ZoneInfo("UTC"))
+    assert source.days(datetime.date(2024, 3, 10)) == [
+        datetime.date(2024, 3, d) for d in range(2, 9)
+    ]
+
+
+def test_plays_between_shares_days(monkeypatch: pytest.MonkeyPatch) -> None:
+    source = abc_radio.Manage(utils.Downloader(), zoneinfo.ZoneInfo("UTC"))
+    calls: list[datetime.date] = []
+    lock = threading.Lock()
+
+    def download_day(
+        _self: abc_radio.Manage, _service: str, day: datetime.date
+    ) -> list[inter.Track]:
+        with lock:
+            calls.append(day)
+        track = inter.Track(
+            origin_code="abc-radio",
+            track_id=day.isoformat(),
+            title=day.isoformat(),
+            artists=["A"],
+            raw=None,
+        )
+        return [track]
+
+    monkeypatch.setattr(abc_radio.Manage, "_download_day", download_day)
+
+    days = [datetime.date(2024, 3, d) for d in range(10, 24)]
+    with ThreadPoolExecutor(4) as pool:
+        results = list(
+            pool.map(lambda day: source.jazz_recently_played("Chart", day), days)
+        )
+
+    # 14 windows of 7 days that cover 20 days
+    assert sorted(calls) == sorted(set(calls))
+    assert len(calls) == 20
+    assert [t.track_id for t in results[0].tracks] == [
+        f"2024-03-0{d}" for d in range(2, 9)
+    ]
@@ -1,23 +1,31 @@
 import pathlib
+import subprocess
+import sys
 
 from importlib.resources import files
 
+import click
+import pytest
+
 from click.testing import CliRunner
 
-from music_playlists.cli import music_playlists
+from music_playlists import manifest, model
+from music_playlists.cli import ChartCode, _config_files, music_playlists
+from music_playlists.services import spotify, youtube_music
+from music_playlists.sources import abc_radio, composite, last_fm, radio_4zzz
 
 
-def test_no_args():
+def test_no_args() -> None:
     runner = CliRunner()
     result = runner.invoke(music_playlists, [])
     assert result.exit_code == 2
     assert "Usage: music-playlists [OPTIONS] COMMAND [ARGS]..." in result.output
 
 
-def test_list():
+def test_list() -> None:
     runner = CliRunner()
     with runner.isolated_filesystem() as tmp_dir:
-        with files("tests.resources").joinpath("test.toml").open('r') as config_path:
+        with files("tests.resources").joinpath("test.toml").open("r") as config_path:
             config_content = config_path.read()
             text_config_file = pathlib.Path(tmp_dir, "test.toml")
             text_config_file.write_text(config_content)
@@ -26,3 +34,63 @@ def test_list():
             )
     assert result.exit_code == 0
     assert "Available Sources and Services" in result.output
+
+
+def test_config_files(tmp_path: pathlib.Path) -> None:
+    configs = tmp_path / "configs"
+    configs.mkdir()
+    (configs / "b.toml").write_text("")
+    (configs / "a.toml").write_text("")
+    (configs / "notes.txt").write_text("")
+    single = tmp_path / "single.toml"
+
+    actual = _config_files([str(single), str(configs)])
+    assert actual == [single, configs / "a.toml", configs / "b.toml"]
+
+
+def test_manifest_matches_available() -> None:
+    sources: list[type[model.Source]] = [
+        abc_radio.Manage,
+        last_fm.Manage,
+        radio_4zzz.Manage,
+        composite.Manage,
+    ]
+    assert {m.code: list(m.available().keys()) for m in sources} == manifest.SOURCES
+    assert [spotify.Manage.code, youtube_music.Manage.code] == manifest.SERVICES
+
+
+def test_chart_code() -> None:
+    chart_code = ChartCode()
+    assert chart_code.convert("composite-mix", None, None) == "composite-mix"
+    assert (
+        chart_code.convert("ABC-RADIO-doublej-most-played-daily", None, None)
+        == "abc-radio-doublej-most-played-daily"
+    )
+    with pytest.raises(click.BadParameter):
+        chart_code.convert("other-chart", None, None)
+
+
+def test_import_time_budget() -> None:
+    # run in a new interpreter, as the tests have already imported everything
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import music_playlists.cli\n"
+        "print(time.perf_counter() - start)\n"
+        "print(' '.join(sorted(sys.modules)))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    seconds, names = result.stdout.splitlines()
+    modules = set(names.split())
+
+    heavy = {
+        "music_playlists.process",
+        "requests_cache",
+        "ytmusicapi",
+        "cattrs",
+        "rich",
+    }
+    assert modules & heavy == set()
+    assert float(seconds) < 0.5
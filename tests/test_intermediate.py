@@ -1,3 +1,6 @@
+import datetime
+import random
+
 import pytest as pytest
 
 from music_playlists import intermediate as inter
@@ -7,7 +10,7 @@ _inter_manage = inter.Manage()
 
 
 @pytest.mark.parametrize(
-    "title_a,artists_a,title_b,artists_b,expected",
+    ("title_a", "artists_a", "title_b", "artists_b", "expected"),
     [
         (
             "Low Down (part i)",
@@ -47,7 +50,7 @@ def test_match(
     title_b: str,
     artists_b: list[str],
     expected: bool,
-):
+) -> None:
     a = inter.Track(
         origin_code="",
         track_id="",
@@ -71,130 +74,469 @@ def test_match(
         assert actual is None
 
 
+_normalise_cases = [
+    (None, "", None, []),
+    ("", "", [], []),
+    (
+        "For My Friends",
+        "for my friends",
+        ["King Princess"],
+        ["king princess"],
+    ),
+    (
+        "SLOW IT DOWN",
+        "slow it down",
+        ["The Kid LAROI & Quavo"],
+        ["the kid laroi", "quavo"],
+    ),
+    (
+        "Going On",
+        "going on",
+        ["Young Franco, piri & MC DT"],
+        ["young franco", "piri", "mc dt"],
+    ),
+    (
+        "GAY 4 ME (feat. Lauren Sanderson)",
+        "gay 4 me",
+        ["G Flip"],
+        ["g flip", "lauren sanderson"],
+    ),
+    (
+        "The Girls (Xero)",
+        "the girls",
+        ["Devotions"],
+        ["devotions", "xero"],
+    ),
+    (
+        "Day In, Day Out (Tape/Off)",
+        "day in, day out",
+        ["Smallest Horse"],
+        ["smallest horse", "tape off"],
+    ),
+    (
+        "It's Not That Bad",
+        "its not that bad",
+        ["Caroline & Claude"],
+        ["caroline", "claude"],
+    ),
+    (
+        "How Do I Know?",
+        "how do i know",
+        ["Thomas Headon"],
+        ["thomas headon"],
+    ),
+    (
+        "Head on Fire",
+        "head on fire",
+        ["Griff x Sigrid"],
+        ["griff", "sigrid"],
+    ),
+    (
+        "bbycakes (with lil uzi vert, pinkpantheress & shygirl)",
+        "bbycakes",
+        ["mura masa"],
+        ["mura masa", "lil uzi vert", "pinkpantheress", "shygirl"],
+    ),
+    (
+        "stuff i dont need {ft. banks}",
+        "stuff i dont need",
+        ["kimbra"],
+        ["kimbra", "banks"],
+    ),
+    (
+        "the baddest (badder)",
+        "the baddest",
+        ["joey valence", "brae"],
+        ["joey valence", "brae", "badder"],
+    ),
+    (
+        "the baddest (badder) [feat. ayesha erotica]",
+        "the baddest",
+        ["joey valence", "brae"],
+        ["joey valence", "brae", "badder", "ayesha erotica"],
+    ),
+    (
+        "for cryin out loud!",
+        "for crying out loud",
+        ["finneas"],
+        ["finneas"],
+    ),
+    (
+        "talk talk featuring troye sivan",
+        "talk talk",
+        ["charli xcx"],
+        ["charli xcx", "troye sivan"],
+    ),
+    (
+        "Low Down (part i)",
+        "low down",
+        ["Michael Kiwanuka"],
+        ["michael kiwanuka", "part i"],
+    ),
+    (
+        "Walk With Me In Hell",
+        "walk with me in hell",
+        ["Lamb Of God"],
+        ["lamb of god"],
+    ),
+    (
+        "Big Dreams",
+        "big dreams",
+        ["Amyl And The Sniffers"],
+        ["amyl", "the sniffers"],
+    ),
+    (
+        "A. I",
+        "a i",
+        ["Morukerdu"],
+        ["morukerdu"],
+    ),
+]
+
+
 @pytest.mark.parametrize(
-    "original_title,expected_title,original_artists,expected_artists",
-    [
-        (None, "", None, []),
-        ("", "", [], []),
-        (
-            "For My Friends",
-            "for my friends",
-            ["King Princess"],
-            ["king princess"],
-        ),
-        (
-            "SLOW IT DOWN",
-            "slow it down",
-            ["The Kid LAROI & Quavo"],
-            ["the kid laroi", "quavo"],
-        ),
-        (
-            "Going On",
-            "going on",
-            ["Young Franco, piri & MC DT"],
-            ["young franco", "piri", "mc dt"],
-        ),
-        (
-            "GAY 4 ME (feat. Lauren Sanderson)",
-            "gay 4 me",
-            ["G Flip"],
-            ["g flip", "lauren sanderson"],
-        ),
-        (
-            "The Girls (Xero)",
-            "the girls",
-            ["Devotions"],
-            ["devotions", "xero"],
-        ),
-        (
-            "Day In, Day Out (Tape/Off)",
-            "day in, day out",
-            ["Smallest Horse"],
-            ["smallest horse", "tape off"],
-        ),
-        (
-            "It's Not That Bad",
-            "its not that bad",
-            ["Caroline & Claude"],
-            ["caroline", "claude"],
-        ),
-        (
-            "How Do I Know?",
-            "how do i know",
-            ["Thomas Headon"],
-            ["thomas headon"],
-        ),
-        (
-            "Head on Fire",
-            "head on fire",
-            ["Griff x Sigrid"],
-            ["griff", "sigrid"],
-        ),
-        (
-            "bbycakes (with lil uzi vert, pinkpantheress & shygirl)",
-            "bbycakes",
-            ["mura masa"],
-            ["mura masa", "lil uzi vert", "pinkpantheress", "shygirl"],
-        ),
-        (
-            "stuff i dont need {ft. banks}",
-            "stuff i dont need",
-            ["kimbra"],
-            ["kimbra", "banks"],
-        ),
-        (
-            "the baddest (badder)",
-            "the baddest",
-            ["joey valence", "brae"],
-            ["joey valence", "brae", "badder"],
-        ),
-        (
-            "the baddest (badder) [feat. ayesha erotica]",
-            "the baddest",
-            ["joey valence", "brae"],
-            ["joey valence", "brae", "badder", "ayesha erotica"],
-        ),
-        (
-            "for cryin out loud!",
-            "for crying out loud",
-            ["finneas"],
-            ["finneas"],
-        ),
-        (
-            "talk talk featuring troye sivan",
-            "talk talk",
-            ["charli xcx"],
-            ["charli xcx", "troye sivan"],
-        ),
-        (
-            "Low Down (part i)",
-            "low down",
-            ["Michael Kiwanuka"],
-            ["michael kiwanuka", "part i"],
-        ),
-        (
-            "Walk With Me In Hell",
-            "walk with me in hell",
-            ["Lamb Of God"],
-            ["lamb of god"],
-        ),
-        (
-            "Big Dreams",
-            "big dreams",
-            ["Amyl And The Sniffers"],
-            ["amyl", "the sniffers"],
-        ),
-        (
-            "A. I",
-            "a i",
-            ["Morukerdu"],
-            ["morukerdu"],
-        ),
-    ],
+    ("original_title", "expected_title", "original_artists", "expected_artists"),
+    _normalise_cases,
 )
 def test_intermediate_normalised_track(
-    original_title, expected_title, original_artists, expected_artists
-):
+    original_title: str,
+    expected_title: str,
+    original_artists: list[str],
+    expected_artists: list[str],
+) -> None:
     n = _inter_manage.normalise_info(original_title, original_artists)
     assert n.title == expected_title
     assert n.artists == expected_artists
+
+
+def _normalise_both(title: str, artists: list[str]) -> bool:
+    """Check the compiled normalisation gives the same result as the steps."""
+    compiled = _inter_manage.normalise_info(title, artists)
+    staged = _inter_manage.normalise_trace(title, artists)[-1]["after"]
+    return bool(compiled == inter.TrackNormalised(staged["title"], staged["artists"]))
+
+
+@pytest.mark.parametrize(
+    ("title", "artists"),
+    [(i[0], i[2]) for i in _normalise_cases]
+    + [
+        ("Song radio--edit", ["A/-B"]),
+        ("Song.. Radio Edit", ["A  &  B"]),
+        ("100% Cryin", ["Beyoncé", "Sigur Rós"]),
+        ("Cryin (Single Version)", ["ẞtraße"]),
+        ("  ?!  ", ["'", "  "]),
+        (
+            # full width letters and an en dash
+            "\uff26\uff55\uff4c\uff4c \uff37\uff49\uff44\uff54\uff48"
+            " \u2013 Live at Home",
+            ["\uff21 ft. \uff22"],
+        ),
+    ],
+)
+def test_normalise_compiled_same_as_staged(title: str, artists: list[str]) -> None:
+    assert _normalise_both(title, artists)
+
+
+def test_normalise_compiled_same_as_staged_random() -> None:
+    parts = [
+        *["a", "B", "é", "ß", " ", "  ", "&", "+", ",", "/", "-", ".", "'", "?"],
+        *["(", ")", "[", "{", " ft. ", " feat ", " with ", " x ", " and "],
+        *[" live at ", "cryin", "%", " radio edit", " single version", "\uff46"],
+    ]
+    rand = random.Random(42)
+    for _ in range(2000):
+        title = "".join(rand.choices(parts, k=rand.randint(0, 8)))
+        artists = [
+            "".join(rand.choices(parts, k=rand.randint(0, 5)))
+            for _ in range(rand.randint(0, 3))
+        ]
+        assert _normalise_both(title, artists), (title, artists)
+
+
+def test_normalise_caches() -> None:
+    try:
+        inter.configure_caches(4, split_artist=2)
+        manage = inter.Manage()
+        for i in range(10):
+            manage.normalise_info(f"Title {i}", [f"Artist {i}"])
+        manage.normalise_info("Title 9", ["Artist 9"])
+
+        stats = inter.cache_stats()
+        assert stats["clean"]["max_size"] == 4
+        assert stats["clean"]["size"] == 4
+        assert stats["clean"]["hits"] == 2
+        assert stats["split_artist"]["max_size"] == 2
+        assert stats["split_artist"]["size"] == 2
+
+        # the caches are shared by all instances
+        inter.Manage().normalise_info("Title 9", ["Artist 9"])
+        assert inter.cache_stats()["clean"]["hits"] == 4
+
+        inter.clear_caches()
+        assert inter.cache_stats()["clean"]["size"] == 0
+
+        with pytest.raises(ValueError, match="Unknown normalisation caches other"):
+            inter.configure_caches(other=1)
+    finally:
+        inter.configure_caches()
+
+
+def test_normalise_many() -> None:
+    titles = [i[0] for i in _normalise_cases] * 2
+    artists = [i[2] for i in _normalise_cases] * 2
+    actual = _inter_manage.normalise_many(titles, artists)
+
+    assert actual == [
+        _inter_manage.normalise_info(t, a) for t, a in zip(titles, artists, strict=True)
+    ]
+    # identical inputs share the result
+    count = len(_normalise_cases)
+    assert actual[3] is actual[count + 3]
+
+    with pytest.raises(ValueError, match="Got 1 titles and 0 artist lists"):
+        _inter_manage.normalise_many(["a"], [])
+
+
+def test_normalise_tracklist() -> None:
+    tracks = [
+        inter.Track(origin_code="", track_id=str(i), title=t, artists=a, raw=None)
+        for i, (t, a) in enumerate([("Song (feat. B)", ["A"]), ("Other", ["C & D"])])
+    ]
+    _inter_manage.normalise_tracklist(
+        inter.TrackList(type=inter.TrackListType.ALL_PLAYS, title=None, tracks=tracks)
+    )
+    assert tracks[0].normalised == inter.TrackNormalised("song", ["a", "b"])
+    assert tracks[1].normalised == inter.TrackNormalised("other", ["c", "d"])
+
+
+def test_normalise_trace(caplog: pytest.LogCaptureFixture) -> None:
+    steps = _inter_manage.normalise_trace("Song's (feat. B)", ["A"])
+    assert [i["name"] for i in steps] == [
+        "input",
+        "collapse_spaces1",
+        "case",
+        "split_artist",
+        "punctuation",
+        "constants",
+        "spelling",
+        "encoding",
+        "collapse_spaces2",
+    ]
+    assert steps[3]["before"] == {"title": "song's (feat. b)", "artists": ["a"]}
+    assert steps[3]["after"] == {"title": "song's", "artists": ["a", "b"]}
+    assert steps[-1]["after"] == {"title": "songs", "artists": ["a", "b"]}
+
+    with caplog.at_level("INFO"):
+        actual = inter.Manage(trace=True).normalise_info("Song's (feat. B)", ["A"])
+    assert actual == _inter_manage.normalise_info("Song's (feat. B)", ["A"])
+    assert "Normalise split_artist" in caplog.text
+
+    caplog.clear()
+    with caplog.at_level("INFO"):
+        inter.Manage().normalise_info("Song's (feat. B)", ["A"])
+    assert caplog.text == ""
+
+
+def test_match_keys() -> None:
+    n = inter.TrackNormalised(title="low down", artists=["michael kiwanuka", "a b"])
+    assert n.title_key == "lowdown"
+    assert n.artist_keys == frozenset(["michaelkiwanuka", "ab"])
+    assert n == inter.TrackNormalised("low down", ["michael kiwanuka", "a b"])
+
+
+def _track(title: str, artists: list[str], duration: int | None = None) -> inter.Track:
+    return inter.Track(
+        origin_code="",
+        track_id=title,
+        title=title,
+        artists=artists,
+        raw=None,
+        duration=duration,
+    )
+
+
+def test_match_best_score() -> None:
+    track = _track("Hold On", ["The Band"], 200)
+    available = [
+        _track("Hold On Tight", ["The Band"], 200),
+        _track("Hold On", ["Other Artist"], 200),
+        _track("Hold On", ["The Band"], 260),
+        _track("Hold On", ["The Band"], 201),
+    ]
+    assert _inter_manage.match(track, available, 5) is available[3]
+    assert _inter_manage.match(track, available[:2], 5) is None
+
+
+def test_match_close_artists() -> None:
+    track = _track("Queen Of The Junkyard", ["Fat Dog", "Guest"], 180)
+    available = [_track("Queen of the Junkyard", ["Fat Dog", "Someone"], 182)]
+    assert _inter_manage.match(track, available, 5) is available[0]
+    assert _inter_manage.match(track, available, 5, threshold=0.99) is None
+
+
+def test_match_score_same_track() -> None:
+    track = _track("Wolves", ["Total Buzzkill"], 100)
+    other = _track("Wolves", ["Totalbuzzkill"], 300)
+    _inter_manage.normalise_track(track)
+    _inter_manage.normalise_track(other)
+
+    # the same title and artists always reach the default threshold
+    assert _inter_manage.match_score(track, other, 10, 5) >= 0.85
+    assert _inter_manage.match_score(track, track, 0, 5) == 1.0
+
+    with pytest.raises(ValueError, match="must be normalised"):
+        _inter_manage.match_score(track, _track("Wolves", ["Total Buzzkill"]), 0, 5)
+
+
+def test_fingerprint() -> None:
+    a = inter.TrackNormalised(title="low down", artists=["michael kiwanuka", "b"])
+    b = inter.TrackNormalised(title="lowdown", artists=["b", "michaelkiwanuka"])
+    c = inter.TrackNormalised(title="low down", artists=["michael kiwanuka"])
+    assert a.fingerprint == b.fingerprint
+    assert a.fingerprint != c.fingerprint
+    assert 0 <= a.fingerprint < 2**64
+
+
+def test_track_fingerprint() -> None:
+    track = _track("Low Down", ["Michael Kiwanuka"])
+    with pytest.raises(ValueError, match="is not normalised"):
+        _ = track.fingerprint
+
+    _inter_manage.normalise_track(track)
+    assert track.normalised is not None
+    assert track.fingerprint == track.normalised.fingerprint
+
+
+def test_most_played_normalised() -> None:
+    plays = [
+        ("Song (feat. B)", ["A"]),
+        ("Other", ["C"]),
+        ("Song", ["A", "B"]),
+        ("song", ["a & b"]),
+        ("Other", ["C"]),
+        ("Once", ["D"]),
+    ]
+    tracks = [
+        inter.Track(origin_code="", track_id=str(i), title=t, artists=a, raw=None)
+        for i, (t, a) in enumerate(plays)
+    ]
+    actual = _inter_manage.most_played(
+        inter.TrackList(type=inter.TrackListType.ALL_PLAYS, title=None, tracks=tracks)
+    )
+    assert [t.track_id for t in actual.tracks] == ["0", "1"]
+
+
+def test_most_played_limit() -> None:
+    plays = ["A", "B", "C", "B", "C", "A", "C", "D"]
+    tracks = [
+        inter.Track(origin_code="", track_id=str(i), title=t, artists=["X"], raw=None)
+        for i, t in enumerate(plays)
+    ]
+    track_list = inter.TrackList(
+        type=inter.TrackListType.ALL_PLAYS, title=None, tracks=tracks
+    )
+
+    actual = _inter_manage.most_played(track_list, limit=None)
+    assert [t.title for t in actual.tracks] == ["C", "A", "B"]
+    actual = _inter_manage.most_played(track_list, limit=2)
+    assert [t.title for t in actual.tracks] == ["C", "A"]
+
+    # only the first play of each distinct track is normalised
+    normalised = [t.normalised is not None for t in tracks]
+    assert normalised == [True, True, True, False, False, False, False, True]
+
+
+def test_play_log_scores() -> None:
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    plays = [
+        ("A", "jazz", 0),
+        ("A", "jazz", 1),
+        ("B", "classic", 6),
+        ("B", "classic", 7),
+        ("A", None, 2),
+    ]
+    log = inter.PlayLog()
+    log.extend(
+        inter.Track(
+            origin_code="",
+            track_id=title,
+            title=title,
+            artists=["X"],
+            raw=None,
+            played_at=start + datetime.timedelta(days=days),
+            station=station,
+        )
+        for title, station, days in plays
+    )
+    assert len(log) == len(plays)
+    assert [t.title for t in log.tracks] == ["A", "B"]
+    assert log.stations == ["jazz", "classic", None]
+    assert list(log.counts()) == [3, 2]
+    assert list(log.scores()) == [3.0, 2.0]
+    assert list(log.scores(station_weights={"classic": 2.0})) == [3.0, 4.0]
+
+    day = datetime.timedelta(days=1).total_seconds()
+    scores = log.scores(half_life=day)
+    assert scores[0] == pytest.approx(2**-7 + 2**-6 + 2**-5)
+    assert scores[1] == pytest.approx(1.5)
+
+    with pytest.raises(ValueError, match="Half life must be more than 0"):
+        log.scores(half_life=0.0)
+
+
+def test_most_played_decay() -> None:
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    plays = [("A", 0), ("A", 1), ("A", 2), ("B", 6), ("B", 7)]
+    tracks = [
+        inter.Track(
+            origin_code="",
+            track_id=title,
+            title=title,
+            artists=["X"],
+            raw=None,
+            played_at=start + datetime.timedelta(days=days),
+        )
+        for title, days in plays
+    ]
+    track_list = inter.TrackList(
+        type=inter.TrackListType.ALL_PLAYS, title=None, tracks=tracks
+    )
+
+    actual = _inter_manage.most_played(track_list)
+    assert [t.title for t in actual.tracks] == ["A", "B"]
+    actual = _inter_manage.most_played(track_list, half_life=86400.0)
+    assert [t.title for t in actual.tracks] == ["B", "A"]
+
+
+def test_merge_charts() -> None:
+    charts = [
+        ("one", ["A", "B", "C"]),
+        ("two", ["B", "D", "a", "B"]),
+        ("three", ["D", "B"]),
+    ]
+    track_lists = [
+        inter.TrackList(
+            type=inter.TrackListType.ORDERED,
+            title=None,
+            tracks=[
+                inter.Track(
+                    origin_code=code, track_id=t, title=t, artists=["X"], raw=None
+                )
+                for t in titles
+            ],
+        )
+        for code, titles in charts
+    ]
+
+    for method in ["rrf", "borda"]:
+        actual = _inter_manage.merge_charts(track_lists, "Mix", method=method)
+        assert actual.title == "Mix"
+        assert [t.title for t in actual.tracks] == ["B", "D", "A", "C"]
+        # the best ranked play represents the track
+        assert [t.origin_code for t in actual.tracks] == ["two", "three", "one", "one"]
+
+    actual = _inter_manage.merge_charts(track_lists, "Mix", limit=2)
+    assert [t.title for t in actual.tracks] == ["B", "D"]
+
+    with pytest.raises(ValueError, match="Unknown chart merge method"):
+        _inter_manage.merge_charts(track_lists, "Mix", method="other")
@@ -0,0 +1,103 @@
+import contextlib
+import pathlib
+
+from collections.abc import Iterator
+
+import attrs
+
+from music_playlists import job_queue
+
+
+@attrs.frozen
+class StubSource:
+    code: str
+
+
+@attrs.frozen
+class StubSetting:
+    service: str
+    playlist_id: str
+
+
+class StubProcess:
+    def __init__(self, *, fail: bool = False) -> None:
+        self.fail = fail
+        self.updated: list[tuple[str, str, str, str, int, bool]] = []
+        self.in_run = False
+
+    @contextlib.contextmanager
+    def run_context(self) -> Iterator[None]:
+        self.in_run = True
+        try:
+            yield
+        finally:
+            self.in_run = False
+
+    def playlist_jobs(
+        self, code_name: str, source_name: str, service_name: str
+    ) -> Iterator[tuple[StubSource, str, StubSetting]]:
+        code = code_name.removeprefix(f"{source_name}-")
+        yield StubSource(source_name), code, StubSetting(service_name, "p1")
+
+    def update_playlist(
+        self, source: StubSource, code: str, pc: StubSetting, share: int = 1
+    ) -> None:
+        if self.fail:
+            msg = "Service error."
+            raise ValueError(msg)
+        item = (source.code, code, pc.service, pc.playlist_id, share, self.in_run)
+        self.updated.append(item)
+
+
+def test_enqueue_once(tmp_path: pathlib.Path) -> None:
+    queue = job_queue.JobQueue(tmp_path / "jobs.sqlite")
+    assert queue.enqueue("abc-radio", "chart", "spotify", "p1") is True
+    assert queue.enqueue("abc-radio", "chart", "spotify", "p1") is False
+    assert queue.counts() == {"pending": 1}
+
+    job = queue.claim("w1", lease=60)
+    assert job is not None
+    assert queue.claim("w2", lease=60) is None
+    assert queue.complete(job, "w1") is True
+
+    # a finished job can be queued again
+    assert queue.enqueue("abc-radio", "chart", "spotify", "p1") is True
+
+
+def test_expired_lease(tmp_path: pathlib.Path) -> None:
+    queue = job_queue.JobQueue(tmp_path / "jobs.sqlite")
+    queue.enqueue("abc-radio", "chart", "spotify", "p1")
+
+    job1 = queue.claim("w1", lease=-1)
+    job2 = queue.claim("w2", lease=60)
+    assert job1 is not None
+    assert job2 is not None
+    assert job2.id == job1.id
+    assert job2.attempts == 2
+    assert queue.complete(job1, "w1") is False
+    assert queue.complete(job2, "w2") is True
+    assert queue.counts() == {"done": 1}
+
+
+def test_worker(tmp_path: pathlib.Path) -> None:
+    queue = job_queue.JobQueue(tmp_path / "jobs.sqlite")
+    queue.enqueue("abc-radio", "chart", "spotify", "p1")
+    queue.enqueue("abc-radio", "chart", "youtube-music", "p1")
+    queue.enqueue("abc-radio", "other", "spotify", "p1")
+
+    # the jobs run in one shared run, and share the quota with the jobs left
+    process = StubProcess()
+    assert job_queue.Worker(process, queue, owner="w1").run() == 3
+    assert process.updated == [
+        ("abc-radio", "chart", "spotify", "p1", 2, True),
+        ("abc-radio", "chart", "youtube-music", "p1", 1, True),
+        ("abc-radio", "other", "spotify", "p1", 1, True),
+    ]
+
+
+def test_worker_retry(tmp_path: pathlib.Path) -> None:
+    queue = job_queue.JobQueue(tmp_path / "jobs.sqlite", max_attempts=2, retry_delay=0)
+    queue.enqueue("abc-radio", "chart", "spotify", "p1")
+
+    assert job_queue.Worker(StubProcess(fail=True), queue, owner="w1").run() == 0
+    assert queue.counts() == {"failed": 1}
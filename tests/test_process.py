@@ -0,0 +1,490 @@
+import collections
+import datetime
+import os
+import pathlib
+import typing
+import zoneinfo
+
+import pytest
+
+from music_playlists import intermediate as inter
+from music_playlists import process, settings, snapshot, utils
+from music_playlists.sources import abc_radio
+from tests.conftest import FakeService
+
+
+def add_playlist(
+    config_file: pathlib.Path, code: str, title: str, source: str = "abc-radio"
+) -> None:
+    """Add a playlist for a chart to the test config."""
+    with config_file.open("a", encoding="utf-8") as f:
+        f.write(
+            f'\n[[playlists]]\nsource = "{source}"\nservice = "spotify"\n'
+            f'code = "{code}"\ntitle = "{title}"\nplaylist_id = "value-for-testing"\n'
+        )
+
+
+def test_list_builds_no_components(config_file: pathlib.Path) -> None:
+    p = process.Process(config_file)
+    rows = p.list_available()
+
+    assert [row["code"] for row in rows] == ["doublej-most-played-daily"]
+    for name in ["downloader", "abc-radio", "spotify", "youtube-music"]:
+        assert p.components.is_built(name) is False
+
+
+def test_chart_from_snapshot(config_file: pathlib.Path, tmp_path: pathlib.Path) -> None:
+    track = inter.Track(
+        origin_code="abc-radio", track_id="1", title="Song", artists=["A"], raw=None
+    )
+    snapshot.SnapshotStore(tmp_path).write(
+        "abc-radio",
+        "doublej-most-played-daily",
+        "Australia/Canberra",
+        inter.TrackList(
+            type=inter.TrackListType.ORDERED, title="Old Title", tracks=[track]
+        ),
+    )
+
+    p = process.Process(config_file, from_snapshot=True)
+    actual = p.source_show("abc-radio-doublej-most-played-daily")
+
+    assert actual.title == "ABC Double J Most Played Daily"
+    assert [t.title for t in actual.tracks] == ["Song"]
+
+
+@pytest.mark.usefixtures("chart_titles")
+def test_sources_fetch(config_file: pathlib.Path, tmp_path: pathlib.Path) -> None:
+    p = process.Process(config_file)
+    paths = p.sources_fetch()
+
+    assert [i.name for i in paths] == ["abc-radio-doublej-most-played-daily.json.gz"]
+    actual = snapshot.SnapshotStore(tmp_path).read(
+        "abc-radio", "doublej-most-played-daily", "Australia/Canberra"
+    )
+    assert actual.tracks[0].normalised is not None
+    assert actual.tracks[0].normalised.title == "song"
+
+
+def test_update_playlist_unchanged_chart(
+    config_file: pathlib.Path, chart_titles: list[str], fake_service: FakeService
+) -> None:
+    service = fake_service
+    p = process.Process(config_file)
+    p.components.register("spotify", lambda: service)
+
+    p.services_update()
+    assert service.searches == ["song a"]
+    assert service.updates == [["id-song a"]]
+
+    # the same chart is not searched or written again
+    p.services_update()
+    assert service.searches == ["song a"]
+    assert len(service.updates) == 1
+    assert len(service.details) == 1
+    assert p.services_plan()[0]["requests"] == 0
+
+    # a changed chart is
+    chart_titles.append("Song")
+    chart_titles[0] = "Other"
+    p.services_update()
+    assert len(service.updates) == 2
+
+
+@pytest.mark.usefixtures("chart_titles")
+def test_services_plan_reuses_searches(
+    config_file: pathlib.Path, fake_service: FakeService
+) -> None:
+    add_playlist(config_file, "doublej-most-played-daily", "Other")
+
+    service = fake_service
+    p = process.Process(config_file)
+    p.components.register("spotify", lambda: service)
+
+    # the second playlist uses the search planned for the first
+    rows = p.services_plan()
+    assert [(i["known"], i["searches_max"]) for i in rows] == [(0, 1), (1, 0)]
+
+    # a search from earlier in the run is used
+    with p.run_context() as run_cache:
+        run_cache.searches["spotify", "song a"] = service.search_tracks("song a")
+        rows = p.services_plan()
+    assert [(i["known"], i["searches_max"]) for i in rows] == [(1, 0), (1, 0)]
+
+
+def test_sources_backfill(
+    config_file: pathlib.Path, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def chart(
+        _self: abc_radio.Manage, title: str, as_of: datetime.date | None = None
+    ) -> inter.TrackList:
+        track = inter.Track(
+            origin_code="abc-radio",
+            track_id="1",
+            title=f"Song {as_of}",
+            artists=["A"],
+            raw={},
+        )
+        return inter.TrackList(
+            type=inter.TrackListType.ORDERED, title=title, tracks=[track]
+        )
+
+    monkeypatch.setattr(abc_radio.Manage, "doublej_most_played", chart)
+
+    p = process.Process(config_file)
+    paths = p.sources_backfill(
+        datetime.date(2024, 1, 1),
+        datetime.date(2024, 1, 20),
+        datetime.timedelta(weeks=1),
+    )
+
+    assert [i.name for i in paths] == [
+        f"abc-radio-doublej-most-played-daily-2024-01-{d}.json.gz"
+        for d in ["01", "08", "15"]
+    ]
+    actual = snapshot.SnapshotStore(tmp_path).read(
+        "abc-radio",
+        "doublej-most-played-daily",
+        "Australia/Canberra",
+        datetime.date(2024, 1, 8),
+    )
+    assert actual.tracks[0].title == "Song 2024-01-08"
+
+
+def test_source_matches_embedded(
+    config_file: pathlib.Path, chart_titles: list[str], fake_service: FakeService
+) -> None:
+    chart_titles[:] = ["One", "Two", "Three", "One"]
+    service = fake_service
+    service.embedded = True
+    p = process.Process(config_file)
+    p.components.register("spotify", lambda: service)
+    _, matched, _, complete = p.source_matches(
+        "abc-radio-doublej-most-played-daily", "spotify"
+    )
+
+    # every embedded track is kept, and a repeated track is only kept once
+    assert [t.track_id for t in matched.tracks] == ["One", "Two", "Three"]
+    assert service.searches == []
+    assert complete is True
+
+
+def test_chart_day_plays(
+    config_file: pathlib.Path, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    downloaded: list[datetime.date] = []
+
+    def plays_for_day(
+        _self: abc_radio.Manage, service: str, day: datetime.date
+    ) -> list[inter.Track]:
+        downloaded.append(day)
+        return [
+            inter.Track(
+                origin_code="abc-radio",
+                track_id=title,
+                title=title,
+                artists=["A"],
+                raw={},
+                station=service,
+            )
+            for title in ["Song", "Song", f"Day {day.day}", f"Day {day.day}", "Song"]
+        ]
+
+    monkeypatch.setattr(abc_radio.Manage, "_plays_for_day", plays_for_day)
+    add_playlist(config_file, "jazz-recently-played", "Jazz")
+
+    def chart(as_of: datetime.date) -> inter.TrackList:
+        p = process.Process(config_file)
+        return p.source_show("abc-radio-jazz-recently-played", as_of)
+
+    actual = chart(datetime.date(2024, 1, 10))
+    assert len(downloaded) == 7
+    assert [t.title for t in actual.tracks] == ["Song"] + [
+        f"Day {d}" for d in range(2, 9)
+    ]
+
+    # only the new day is downloaded, and the result is the same as a recount
+    downloaded.clear()
+    actual = chart(datetime.date(2024, 1, 11))
+    assert downloaded == [datetime.date(2024, 1, 9)]
+    source = abc_radio.Manage(
+        utils.Downloader(), zoneinfo.ZoneInfo("Australia/Canberra")
+    )
+    expected = inter.Manage().most_played(
+        source.jazz_recently_played("Jazz", datetime.date(2024, 1, 11))
+    )
+    assert [t.normalised for t in actual.tracks] == [
+        t.normalised for t in expected.tracks
+    ]
+
+    # the days before a past chart are removed
+    chart(datetime.date(2024, 3, 10))
+    stored = tmp_path.glob("day_plays/abc-radio-jazz-recently-played/*.json.gz")
+    assert sorted(i.name for i in stored) == [
+        f"2024-03-0{d}.json.gz" for d in range(2, 9)
+    ]
+
+
+def test_chart_window_sketches(
+    config_file: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    downloaded: list[datetime.date] = []
+
+    def plays_for_day(
+        _self: abc_radio.Manage, _service: str, day: datetime.date
+    ) -> list[inter.Track]:
+        downloaded.append(day)
+        titles = ["Song"] * 3 + [f"Month {day.month}"] * 2 + [f"Day {day}"]
+        return [
+            inter.Track(
+                origin_code="abc-radio", track_id=t, title=t, artists=["A"], raw={}
+            )
+            for t in titles
+        ]
+
+    monkeypatch.setattr(abc_radio.Manage, "_plays_for_day", plays_for_day)
+    add_playlist(config_file, "jazz-most-played-monthly", "Jazz Monthly")
+
+    def chart(as_of: datetime.date) -> inter.TrackList:
+        p = process.Process(config_file)
+        return p.source_show("abc-radio-jazz-most-played-monthly", as_of)
+
+    actual = chart(datetime.date(2024, 2, 10))
+    assert len(downloaded) == 30
+    assert [t.title for t in actual.tracks] == ["Song", "Month 1", "Month 2"]
+
+    # only the new day is downloaded
+    downloaded.clear()
+    actual = chart(datetime.date(2024, 2, 11))
+    assert downloaded == [datetime.date(2024, 2, 9)]
+    assert [t.title for t in actual.tracks] == ["Song", "Month 1", "Month 2"]
+
+
+def test_chart_composite(
+    config_file: pathlib.Path, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    add_playlist(config_file, "mix", "Mix", source="composite")
+    with config_file.open("a", encoding="utf-8") as f:
+        f.write("""
+[composites.mix]
+charts = ["abc-radio-doublej-most-played-daily", "abc-radio-triplej-most-played-daily"]
+method = "borda"
+""")
+
+    built: list[str] = []
+
+    def chart(titles: list[str]) -> typing.Callable[..., inter.TrackList]:
+        def func(
+            _self: abc_radio.Manage, title: str, _as_of: datetime.date | None = None
+        ) -> inter.TrackList:
+            built.append(title)
+            tracks = [
+                inter.Track(
+                    origin_code="abc-radio", track_id=t, title=t, artists=["A"], raw={}
+                )
+                for t in titles
+            ]
+            return inter.TrackList(
+                type=inter.TrackListType.ORDERED, title=title, tracks=tracks
+            )
+
+        return func
+
+    monkeypatch.setattr(abc_radio.Manage, "doublej_most_played", chart(["A", "B"]))
+    monkeypatch.setattr(abc_radio.Manage, "triplej_most_played", chart(["B", "C"]))
+
+    p = process.Process(config_file)
+    assert [row["code"] for row in p.list_available()] == [
+        "doublej-most-played-daily",
+        "mix",
+    ]
+    paths = p.sources_fetch()
+
+    # the chart already built in the run is reused,
+    # and the other chart is built with its own title
+    assert built == [
+        "ABC Double J Most Played Daily",
+        "abc-radio-triplej-most-played-daily",
+    ]
+    assert [i.name for i in paths] == [
+        "abc-radio-doublej-most-played-daily.json.gz",
+        "composite-mix.json.gz",
+    ]
+    actual = snapshot.SnapshotStore(tmp_path).read(
+        "composite", "mix", "Australia/Canberra"
+    )
+    assert actual.title == "Mix"
+    assert [t.title for t in actual.tracks] == ["B", "A", "C"]
+
+
+def test_backfill_overlapping_windows(
+    config_file: pathlib.Path, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    add_playlist(config_file, "jazz-most-played-monthly", "Jazz Monthly")
+
+    def plays_for_day(
+        _self: abc_radio.Manage, _service: str, day: datetime.date
+    ) -> list[inter.Track]:
+        return [
+            inter.Track(
+                origin_code="abc-radio", track_id=t, title=t, artists=["A"], raw={}
+            )
+            for t in ["Song", "Song", f"Day {day}"]
+        ]
+
+    written: collections.Counter[str] = collections.Counter()
+    write_json = snapshot.write_json
+
+    def count_writes(path: pathlib.Path, data: dict[str, typing.Any]) -> None:
+        written[path.relative_to(tmp_path).parts[0]] += 1
+        write_json(path, data)
+
+    monkeypatch.setattr(abc_radio.Manage, "_plays_for_day", plays_for_day)
+    monkeypatch.setattr(snapshot, "write_json", count_writes)
+
+    p = process.Process(config_file)
+    paths = p.sources_backfill(
+        datetime.date(2024, 2, 1),
+        datetime.date(2024, 2, 10),
+        datetime.timedelta(days=1),
+        code_name="abc-radio-jazz-most-played-monthly",
+    )
+
+    # the 39 days in the overlapping windows are each sketched once,
+    # and the plays are not kept, as the sketches replace them
+    assert len(paths) == 10
+    assert written == {"snapshots": 10, "sketches": 39}
+    assert not list(tmp_path.glob("**/*.tmp"))
+
+
+def test_source_matches_quota(
+    config_file: pathlib.Path, chart_titles: list[str], fake_service: FakeService
+) -> None:
+    config = config_file.read_text()
+    config_file.write_text(
+        config.replace(
+            "[secrets.last-fm]", "[quotas]\nspotify = 1\n\n[secrets.last-fm]"
+        )
+    )
+    chart_titles[:] = ["One", "Two"]
+
+    service = fake_service
+    p = process.Process(config_file)
+    p.components.register("spotify", lambda: service)
+
+    # the searches stop when the quota is used up
+    _, matched, _, complete = p.source_matches(
+        "abc-radio-doublej-most-played-daily", "spotify"
+    )
+    assert service.searches == ["one a"]
+    assert complete is False
+
+    with pytest.raises(utils.QuotaReachedError):
+        p.source_matches("abc-radio-doublej-most-played-daily", "spotify")
+    assert service.searches == ["one a"]
+
+
+@pytest.mark.usefixtures("chart_titles")
+def test_services_plan_from_cache(
+    config_file: pathlib.Path, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    add_playlist(config_file, "jazz-recently-played", "Jazz")
+
+    store = snapshot.DayPlayStore(tmp_path)
+    time_zone = "Australia/Canberra"
+    source = abc_radio.Manage(utils.Downloader(), zoneinfo.ZoneInfo(time_zone))
+    days = source.days()
+
+    # the days that are not stored are not downloaded or saved
+    rows = process.Process(config_file).services_plan()
+    assert [row["code"] for row in rows] == ["abc-radio-doublej-most-played-daily"]
+    assert not list(tmp_path.glob("day_plays/**/*.json.gz"))
+
+    # the days got from the cached responses are not saved
+    monkeypatch.setattr(
+        abc_radio.Manage,
+        "_download_day",
+        lambda self, _s, _d: self.doublej_most_played("").tracks,
+    )
+    rows = process.Process(config_file).services_plan()
+    assert [row["tracks"] for row in rows] == [1, 1]
+    assert not list(tmp_path.glob("day_plays/**/*.json.gz"))
+
+    # the stored days are used, and the old days are kept
+    for day in [days[0] - datetime.timedelta(days=1), *days]:
+        plays = inter.PlayLog()
+        plays.extend(source.doublej_most_played("").tracks)
+        store.write("abc-radio", "jazz-recently-played", time_zone, day, plays)
+    rows = process.Process(config_file).services_plan()
+    assert [row["tracks"] for row in rows] == [1, 1]
+    assert len(list(tmp_path.glob("day_plays/**/*.json.gz"))) == len(days) + 1
+
+
+def test_run_cache_configures_caches_once(
+    config_file: pathlib.Path, tmp_path: pathlib.Path
+) -> None:
+    config = config_file.read_text()
+    other = tmp_path / "other.toml"
+    for path, size in [(config_file, 8), (other, 4)]:
+        path.write_text(
+            config.replace("[general]\n", f"[general]\nnormalise_cache_size = {size}\n")
+        )
+
+    # the first config file in the run sets the cache size
+    run_cache = process.RunCache()
+    try:
+        process.Process(config_file, run_cache=run_cache)
+        process.Process(other, run_cache=run_cache)
+        assert {i["max_size"] for i in inter.cache_stats().values()} == {8}
+    finally:
+        inter.configure_caches()
+
+
+def test_reload(config_file: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    config = config_file.read_text()
+    p = process.Process(config_file)
+
+    # the file is not read again when it has not changed
+    loaded = []
+    with monkeypatch.context() as m:
+        m.setattr(
+            settings.Settings, "__init__", lambda _self, path: loaded.append(path)
+        )
+        assert p.reload() is False
+    assert loaded == []
+
+    config_file.write_text(config.replace("Double J", "Other"))
+    modified = config_file.stat().st_mtime + 10
+    os.utime(config_file, (modified, modified))
+    assert p.reload() is True
+    assert p.list_available()[0]["title"] == "ABC Other Most Played Daily"
+    assert p.reload() is False
+
+
+@pytest.mark.parametrize(
+    ("old", "new"),
+    [
+        ("[general]\n", '[general]\nschedule = "61 * * * *"\n'),
+        ('title = "', "title = "),
+    ],
+)
+def test_reload_invalid(
+    config_file: pathlib.Path, caplog: pytest.LogCaptureFixture, old: str, new: str
+) -> None:
+    config = config_file.read_text()
+    p = process.Process(config_file)
+
+    config_file.write_text(config.replace(old, new).replace("Double J", "Other"))
+    modified = config_file.stat().st_mtime + 10
+    os.utime(config_file, (modified, modified))
+
+    # the previous settings are kept, and the file is not read again until it changes
+    assert p.reload() is False
+    assert p.reload() is False
+    assert p.list_available()[0]["title"] == "ABC Double J Most Played Daily"
+    assert caplog.text.count("Could not reload config file") == 1
+
+    config_file.write_text(config.replace("Double J", "Other"))
+    os.utime(config_file, (modified + 10, modified + 10))
+    assert p.reload() is True
+    assert p.list_available()[0]["title"] == "ABC Other Most Played Daily"
@@ -0,0 +1,64 @@
+import datetime
+import zoneinfo
+
+from types import SimpleNamespace
+
+import pytest
+
+from music_playlists import utils
+from music_playlists.sources import radio_4zzz
+
+
+@pytest.fixture
+def calls() -> list[str]:
+    return []
+
+
+@pytest.fixture
+def source(monkeypatch: pytest.MonkeyPatch, calls: list[str]) -> radio_4zzz.Manage:
+    starts = ["2024-03-01 22:00:00", "2024-03-02 08:00:00", "2024-03-04 08:00:00"]
+
+    def programs(_self: radio_4zzz.Manage) -> list[SimpleNamespace]:
+        calls.append("programs")
+        return [SimpleNamespace(archived=False, slug="show")]
+
+    def episodes(
+        _self: radio_4zzz.Manage, _program: SimpleNamespace
+    ) -> list[SimpleNamespace]:
+        return [SimpleNamespace(start=start, end=start) for start in starts]
+
+    monkeypatch.setattr(radio_4zzz.Manage, "programs", programs)
+    monkeypatch.setattr(radio_4zzz.Manage, "program", lambda _self, p: p)
+    monkeypatch.setattr(radio_4zzz.Manage, "episodes", episodes)
+    monkeypatch.setattr(radio_4zzz.Manage, "episode", lambda _self, e: e)
+    monkeypatch.setattr(
+        radio_4zzz.Manage,
+        "playlist",
+        lambda _self, e: [SimpleNamespace(id=1, title=e.start, artist="A")],
+    )
+    return radio_4zzz.Manage(utils.Downloader(), zoneinfo.ZoneInfo("UTC"))
+
+
+def test_days_plays_one_crawl(source: radio_4zzz.Manage, calls: list[str]) -> None:
+    days = [datetime.date(2024, 3, d) for d in [1, 2, 3]]
+    actual = source.days_plays("all-most-played-weekly", days)
+
+    assert calls == ["programs"]
+    assert {day: [t.title for t in tracks] for day, tracks in actual.items()} == {
+        days[0]: ["2024-03-01 22:00:00"],
+        days[1]: ["2024-03-02 08:00:00"],
+        days[2]: [],
+    }
+
+
+def test_days_plays_deadline(
+    source: radio_4zzz.Manage, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def playlist(self: radio_4zzz.Manage, _episode: SimpleNamespace) -> list[str]:
+        # later requests would use old cached responses
+        self._dl.deadline = utils.Deadline(0)
+        return []
+
+    monkeypatch.setattr(radio_4zzz.Manage, "playlist", playlist)
+    with pytest.raises(ValueError, match="deadline was reached"):
+        source.days_plays("all-most-played-weekly", [datetime.date(2024, 3, 1)])
@@ -0,0 +1,106 @@
+import contextlib
+import datetime
+
+from collections.abc import Iterator
+from types import SimpleNamespace
+
+import pytest
+
+from music_playlists import schedule
+
+
+@pytest.mark.parametrize(
+    ("expression", "current", "expected"),
+    [
+        ("0 6 * * *", "2026-04-20 05:59", "2026-04-20 06:00"),
+        ("0 6 * * *", "2026-04-20 06:00", "2026-04-21 06:00"),
+        ("*/15 * * * *", "2026-04-20 06:07", "2026-04-20 06:15"),
+        ("30 2 * * 1", "2026-04-20 03:00", "2026-04-27 02:30"),
+        ("0 0 1 * *", "2026-12-15 00:00", "2027-01-01 00:00"),
+        ("0 8-10/2 * * 1-5", "2026-04-18 09:00", "2026-04-20 08:00"),
+    ],
+)
+def test_cron_schedule(expression: str, current: str, expected: str) -> None:
+    cron = schedule.CronSchedule(expression)
+    actual = cron.next_after(datetime.datetime.fromisoformat(f"{current}+00:00"))
+    assert actual == datetime.datetime.fromisoformat(f"{expected}+00:00")
+
+
+@pytest.mark.parametrize("expression", ["", "* * * *", "60 * * * *", "5-1 * * * *"])
+def test_cron_schedule_invalid(expression: str) -> None:
+    with pytest.raises(ValueError, match="Invalid schedule"):
+        schedule.CronSchedule(expression)
+
+
+class StubProcess:
+    default_schedule = "0 6 * * *"
+
+    def __init__(self) -> None:
+        self.runs: list[tuple[str, bool]] = []
+        self.in_run = False
+
+    @contextlib.contextmanager
+    def run_context(self) -> Iterator[None]:
+        self.in_run = True
+        try:
+            yield
+        finally:
+            self.in_run = False
+
+    def playlist_jobs(self) -> Iterator[tuple[SimpleNamespace, str, SimpleNamespace]]:
+        source = SimpleNamespace(code="abc-radio")
+        for playlist_id in ["one", "two"]:
+            pc = SimpleNamespace(
+                schedule=None, service="spotify", playlist_id=playlist_id, title=""
+            )
+            yield source, "chart", pc
+
+    def update_playlist(
+        self, _source: SimpleNamespace, _code: str, pc: SimpleNamespace
+    ) -> None:
+        self.runs.append((pc.playlist_id, self.in_run))
+
+
+def test_daemon_run_pending() -> None:
+    process = StubProcess()
+    daemon = schedule.Daemon(process)
+    start = datetime.datetime(2026, 4, 20, 5, 0, tzinfo=datetime.UTC)
+
+    assert daemon.run_pending(start) == [start.replace(hour=6)] * 2
+    assert process.runs == []
+
+    # the playlists due at the same time run in one shared run
+    daemon.run_pending(start.replace(hour=6))
+    assert process.runs == [("one", True), ("two", True)]
+
+
+def test_daemon_invalid_schedule(caplog: pytest.LogCaptureFixture) -> None:
+    process = StubProcess()
+    process.default_schedule = "61 * * * *"
+    daemon = schedule.Daemon(process)
+    start = datetime.datetime(2026, 4, 20, 5, 0, tzinfo=datetime.UTC)
+
+    # the playlists with an invalid schedule are skipped and logged once
+    assert daemon.run_pending(start) == []
+    assert daemon.run_pending(start.replace(hour=6)) == []
+    assert process.runs == []
+    assert caplog.text.count("Invalid schedule field '61'") == 1
+
+
+def test_daemon_reload_error(caplog: pytest.LogCaptureFixture) -> None:
+    process = StubProcess()
+    start = datetime.datetime(2026, 4, 20, 5, 0, tzinfo=datetime.UTC)
+    waits: list[float] = []
+
+    def reload() -> bool:
+        msg = "Invalid config."
+        raise ValueError(msg)
+
+    process.reload = reload  # type: ignore[attr-defined]
+    process.now = lambda: start  # type: ignore[attr-defined]
+    daemon = schedule.Daemon(process, sleep=waits.append)
+
+    # the daemon keeps running with the previous settings
+    daemon.run(iterations=2)
+    assert waits == [60, 60]
+    assert caplog.text.count("Invalid config.") == 2
@@ -0,0 +1,98 @@
+import http.client
+import threading
+
+from http.server import ThreadingHTTPServer
+
+from music_playlists import intermediate as inter
+from music_playlists import server, utils
+
+
+class StubProcess:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def list_available(self) -> list[dict[str, str]]:
+        self.calls += 1
+        return [{"code": "doublej-most-played-daily", "source": "abc-radio"}]
+
+    def source_show(self, name: str) -> inter.TrackList:
+        self.calls += 1
+        if name != "abc-radio-doublej-most-played-daily":
+            msg = f"Could not find a source named '{name}'."
+            raise ValueError(msg)
+        track = inter.Track(
+            origin_code="abc-radio",
+            track_id="1",
+            title="Song",
+            artists=["Artist"],
+            raw=None,
+        )
+        return inter.TrackList(
+            type=inter.TrackListType.ORDERED, title="Chart", tracks=[track]
+        )
+
+    def source_matches(self, _name: str, _service: str) -> None:
+        self.calls += 1
+        msg = "The Spotify search quota is used up for today."
+        raise utils.QuotaReachedError(msg)
+
+
+def test_response_cache() -> None:
+    cache = server.ResponseCache(window=3600)
+    calls: list[int] = []
+
+    def build(value: int) -> dict[str, int]:
+        calls.append(value)
+        return {"a": value}
+
+    body1, etag1 = cache.get("a", lambda: build(1))
+    body2, etag2 = cache.get("a", lambda: build(2))
+    assert calls == [1]
+    assert body1 == body2
+    assert etag1 == etag2
+
+
+def test_serve_charts() -> None:
+    process = StubProcess()
+    handler = type(
+        "TestHandler",
+        (server.Handler,),
+        {"process": process, "cache": server.ResponseCache(3600)},
+    )
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", httpd.server_port)
+
+        conn.request("GET", "/charts/abc-radio-doublej-most-played-daily")
+        r = conn.getresponse()
+        assert r.status == 200
+        assert b'"title": "Song"' in r.read()
+        etag = r.getheader("ETag")
+        assert etag is not None
+
+        conn.request(
+            "GET",
+            "/charts/abc-radio-doublej-most-played-daily",
+            headers={"If-None-Match": etag},
+        )
+        r = conn.getresponse()
+        r.read()
+        assert r.status == 304
+        assert process.calls == 1
+
+        conn.request("GET", "/charts/unknown")
+        r = conn.getresponse()
+        r.read()
+        assert r.status == 404
+
+        conn.request(
+            "GET", "/charts/abc-radio-doublej-most-played-daily/matches/spotify"
+        )
+        r = conn.getresponse()
+        assert r.status == 429
+        assert b"quota is used up" in r.read()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
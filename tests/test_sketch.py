@@ -0,0 +1,98 @@
+import datetime
+import pathlib
+import random
+
+import pytest
+
+from music_playlists import intermediate as inter
+from music_playlists import sketch
+
+
+def _plays(titles: list[str]) -> inter.PlayLog:
+    plays = inter.PlayLog()
+    plays.extend(
+        inter.Track(origin_code="", track_id=t, title=t, artists=["A"], raw=None)
+        for t in titles
+    )
+    inter.Manage().normalise_tracklist(
+        inter.TrackList(
+            type=inter.TrackListType.ALL_PLAYS, title=None, tracks=plays.tracks
+        )
+    )
+    return plays
+
+
+def test_count_min_sketch() -> None:
+    rng = random.Random(1)
+    keys = [rng.getrandbits(64) for _ in range(500)]
+    expected = {k: rng.randint(1, 20) for k in keys}
+
+    a = sketch.CountMinSketch(width=256)
+    b = sketch.CountMinSketch(width=256)
+    for index, (key, count) in enumerate(expected.items()):
+        (a if index % 2 else b).add(key, count)
+    a.merge(b)
+
+    for key, count in expected.items():
+        assert a.estimate(key) >= count
+    errors = [a.estimate(k) - c for k, c in expected.items()]
+    assert sum(errors) / len(errors) < 20
+
+    with pytest.raises(ValueError, match="power of 2"):
+        sketch.CountMinSketch(width=100)
+    with pytest.raises(ValueError, match="same size"):
+        a.merge(sketch.CountMinSketch(width=512))
+
+
+def test_space_saving() -> None:
+    summary = sketch.SpaceSaving(capacity=3)
+    for key in [1, 1, 1, 2, 2, 3, 4, 1, 5, 5, 5, 5]:
+        summary.add(key)
+    assert summary.counts[1] == 4
+    assert 5 in summary.counts
+    assert len(summary.counts) == 3
+
+    other = sketch.SpaceSaving(capacity=3)
+    for key in [2, 2, 2, 2, 2, 6]:
+        other.add(key)
+    summary.merge(other)
+    assert len(summary.counts) == 3
+    for key, count in {1: 4, 2: 7, 5: 4}.items():
+        assert summary.counts[key] - summary.errors[key] <= count
+        assert summary.counts[key] >= count
+
+
+def test_play_sketch_matches_exact() -> None:
+    rng = random.Random(2)
+    titles = [f"Song {i}" for i in range(60)]
+    days = [rng.choices(titles, weights=range(60, 0, -1), k=200) for _ in range(10)]
+
+    merged = sketch.PlaySketch(width=1024, capacity=100)
+    for day in days:
+        merged.merge(sketch.PlaySketch.from_plays(_plays(day), width=1024))
+
+    everything = _plays([t for day in days for t in day])
+    expected = inter.Manage().rank_plays(everything, "Chart", limit=10)
+    actual = merged.most_played("Chart", limit=10)
+    assert [t.title for t in actual.tracks] == [t.title for t in expected.tracks]
+
+
+def test_sketch_store(tmp_path: pathlib.Path) -> None:
+    store = sketch.SketchStore(tmp_path)
+    day = datetime.date(2024, 1, 1)
+    assert store.read("abc-radio", "chart", "UTC", day) is None
+
+    expected = sketch.PlaySketch.from_plays(_plays(["B", "A", "B", "C", "A", "B"]))
+    store.write("abc-radio", "chart", "UTC", day, expected)
+
+    actual = store.read("abc-radio", "chart", "UTC", day)
+    assert actual is not None
+    assert actual.counts.table == expected.counts.table
+    assert actual.heavy.counts == expected.heavy.counts
+    assert [t.title for t in actual.most_played("Chart").tracks] == ["B", "A"]
+
+    # sketches with another size are not used
+    assert store.read("abc-radio", "chart", "UTC", day, capacity=10) is None
+
+    assert store.prune("abc-radio", "chart", datetime.date(2024, 1, 2)) == 1
+    assert store.read("abc-radio", "chart", "UTC", day) is None
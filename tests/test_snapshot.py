@@ -0,0 +1,93 @@
+import datetime
+import gzip
+import json
+import math
+import pathlib
+
+import attrs
+import pytest
+
+from music_playlists import intermediate as inter
+from music_playlists import snapshot
+
+
+def _track_list() -> inter.TrackList:
+    track = inter.Track(
+        origin_code="abc-radio",
+        track_id="1",
+        title="Song (feat. Other)",
+        artists=["Artist"],
+        raw={"arid": "1"},
+        duration=215,
+    )
+    track.set_normalised(
+        inter.TrackNormalised(title="song", artists=["artist", "other"])
+    )
+    return inter.TrackList(
+        type=inter.TrackListType.ORDERED, title="Chart", tracks=[track]
+    )
+
+
+def test_snapshot_round_trip(tmp_path: pathlib.Path) -> None:
+    store = snapshot.SnapshotStore(tmp_path)
+    path = store.write("abc-radio", "chart", "Australia/Brisbane", _track_list())
+    assert path == tmp_path / "snapshots" / "abc-radio-chart.json.gz"
+
+    actual = store.read("abc-radio", "chart", "Australia/Brisbane")
+    assert actual.type == inter.TrackListType.ORDERED
+    assert actual.title == "Chart"
+    assert len(actual.tracks) == 1
+    track = actual.tracks[0]
+    assert track.title == "Song (feat. Other)"
+    assert track.raw is None
+    assert track.duration == 215
+    assert track.normalised == inter.TrackNormalised(
+        title="song", artists=["artist", "other"]
+    )
+
+
+def test_snapshot_mismatch(tmp_path: pathlib.Path) -> None:
+    store = snapshot.SnapshotStore(tmp_path)
+    with pytest.raises(ValueError, match="No snapshot"):
+        store.read("abc-radio", "chart", "Australia/Brisbane")
+
+    path = store.write("abc-radio", "chart", "Australia/Brisbane", _track_list())
+    with pytest.raises(ValueError, match="time zone"):
+        store.read("abc-radio", "chart", "Australia/Perth")
+
+    data = json.loads(gzip.decompress(path.read_bytes()))
+    data["version"] = 99
+    path.write_bytes(gzip.compress(json.dumps(data).encode("utf-8")))
+    with pytest.raises(ValueError, match="unknown version"):
+        store.read("abc-radio", "chart", "Australia/Brisbane")
+
+
+def test_day_play_store(tmp_path: pathlib.Path) -> None:
+    store = snapshot.DayPlayStore(tmp_path)
+    day = datetime.date(2024, 1, 1)
+    assert store.read("abc-radio", "chart", "UTC", day) is None
+
+    plays = inter.PlayLog()
+    played_at = datetime.datetime(2024, 1, 1, 10, tzinfo=datetime.UTC)
+    track = _track_list().tracks[0]
+    plays.append(attrs.evolve(track, played_at=played_at, station="jazz"))
+    plays.append(attrs.evolve(track, played_at=played_at, station="jazz"))
+    plays.append(attrs.evolve(track, track_id="2", title="Other", station=None))
+    store.write("abc-radio", "chart", "UTC", day, plays)
+
+    actual = store.read("abc-radio", "chart", "UTC", day)
+    assert actual is not None
+    assert [t.title for t in actual.tracks] == ["Song (feat. Other)", "Other"]
+    assert actual.tracks[0].normalised == plays.tracks[0].normalised
+    assert actual.stations == ["jazz", None]
+    assert list(actual.track_ids) == [0, 0, 1]
+    assert list(actual.station_ids) == [0, 0, 1]
+    assert actual.played_at[0] == played_at.timestamp()
+    assert math.isnan(actual.played_at[2])
+
+    # plays stored for another time zone are not used
+    assert store.read("abc-radio", "chart", "Australia/Brisbane", day) is None
+
+    store.write("abc-radio", "chart", "UTC", datetime.date(2024, 1, 2), plays)
+    assert store.prune("abc-radio", "chart", datetime.date(2024, 1, 2)) == 1
+    assert store.read("abc-radio", "chart", "UTC", day) is None
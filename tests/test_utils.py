@@ -0,0 +1,127 @@
+import concurrent.futures
+import datetime
+import pathlib
+
+import pytest
+
+from music_playlists import utils
+
+
+def test_latency_store(tmp_path: pathlib.Path) -> None:
+    store = utils.LatencyStore(tmp_path, weight=0.5)
+    assert store.estimate("api.spotify.com") == 0.5
+
+    store.update({"api.spotify.com": [0.2, 0.4], "music.youtube.com": []})
+    assert store.estimate("api.spotify.com") == pytest.approx(0.3)
+    assert store.estimate("music.youtube.com", 1.0) == 1.0
+
+    store.update({"api.spotify.com": [0.5]})
+    assert store.estimate("api.spotify.com") == pytest.approx(0.4)
+
+    reloaded = utils.LatencyStore(tmp_path)
+    assert reloaded.estimate("api.spotify.com") == pytest.approx(0.4)
+
+
+def test_latency_store_memory() -> None:
+    store = utils.LatencyStore(weight=0.5)
+    store.update({"api.spotify.com": [0.2]})
+    store.update({"api.spotify.com": [0.4]})
+    assert store.estimate("api.spotify.com") == pytest.approx(0.3)
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        ("90", datetime.timedelta(seconds=90)),
+        ("45m", datetime.timedelta(minutes=45)),
+        ("1.5h", datetime.timedelta(hours=1.5)),
+        ("1w", datetime.timedelta(weeks=1)),
+    ],
+)
+def test_parse_duration(value: str, expected: datetime.timedelta) -> None:
+    assert utils.parse_duration(value) == expected
+
+
+def test_parse_duration_invalid() -> None:
+    with pytest.raises(ValueError, match="Invalid duration"):
+        utils.parse_duration("soon")
+
+
+def test_deadline() -> None:
+    unlimited = utils.Deadline()
+    assert unlimited.remaining is None
+    assert unlimited.expired is False
+    assert unlimited.stage(0.5).remaining is None
+
+    deadline = utils.Deadline(100)
+    stage = deadline.stage(0.5)
+    assert stage.remaining is not None
+    assert 49 < stage.remaining <= 50
+    stage.cut("skipped")
+    assert deadline.cuts == ["skipped"]
+
+    assert utils.Deadline(0).expired is True
+
+
+def test_downloader_timeout() -> None:
+    downloader = utils.Downloader(timeout=30)
+    assert downloader.timeout == 30
+    with downloader.using(utils.Deadline(10)):
+        assert downloader.timeout is not None
+        assert 9 < downloader.timeout <= 10
+    with downloader.using(utils.Deadline(0)):
+        assert downloader.timeout == 1
+    assert downloader.timeout == 30
+
+
+def test_quota_store(tmp_path: pathlib.Path) -> None:
+    day = [datetime.date(2026, 4, 20)]
+    quota = utils.QuotaStore(tmp_path, {"spotify": 2}, lambda: day[0])
+    assert quota.remaining("youtube-music") is None
+    assert quota.spend("youtube-music") is True
+
+    assert quota.spend("spotify") is True
+    assert quota.spend("spotify") is True
+    assert quota.spend("spotify") is False
+    assert quota.remaining("spotify") == 0
+
+    # the count is shared by runs on the same day
+    other = utils.QuotaStore(tmp_path, {"spotify": 2}, lambda: day[0])
+    assert other.remaining("spotify") == 0
+
+    day[0] = datetime.date(2026, 4, 21)
+    assert quota.remaining("spotify") == 2
+
+
+def test_quota_store_shared(tmp_path: pathlib.Path) -> None:
+    today = datetime.date(2026, 4, 20)
+    stores = [
+        utils.QuotaStore(tmp_path, {"spotify": 50}, lambda: today) for _ in range(4)
+    ]
+
+    # workers spending at the same time do not go over the quota
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        spent = list(pool.map(lambda i: stores[i % 4].spend("spotify"), range(80)))
+    assert spent.count(True) == 50
+    assert stores[0].remaining("spotify") == 0
+
+
+def test_quota_store_memory() -> None:
+    quota = utils.QuotaStore(None, {"spotify": 1}, lambda: datetime.date(2026, 4, 20))
+    assert quota.spend("spotify") is True
+    assert quota.spend("spotify") is False
+    assert quota.remaining("spotify") == 0
+
+
+def test_playlist_state_store(tmp_path: pathlib.Path) -> None:
+    first = utils.PlaylistStateStore(tmp_path)
+    second = utils.PlaylistStateStore(tmp_path)
+    assert first.get("missing") is None
+
+    # the state saved by another worker is kept
+    first.set("one", {"fingerprint": "b"})
+    second.set("two", {"fingerprint": "c"})
+    first.set("one", {"fingerprint": "d"})
+    reloaded = utils.PlaylistStateStore(tmp_path)
+    assert reloaded.get("one") == {"fingerprint": "d"}
+    assert reloaded.get("two") == {"fingerprint": "c"}